@@ -31,6 +31,11 @@ def print_help(exit_status):
     print('Type "theano-cache cleanup" to delete keys in the old '
           'format/code version')
     print('Type "theano-cache purge" to force deletion of the cache directory')
+    print('Type "theano-cache export <function.pkl> <archive>" to compile '
+          'the modules of a pickled Function or FunctionGraph and save them '
+          'in an archive')
+    print('Type "theano-cache import <archive>" to add the modules of an '
+          'exported archive to the cache')
     print('Type "theano-cache basecompiledir" '
           'to print the parent of the cache directory')
     print('Type "theano-cache basecompiledir list" '
@@ -84,6 +89,12 @@ def main():
             print(theano.config.base_compiledir)
         else:
             print_help(exit_status=1)
+    elif len(sys.argv) == 3 and sys.argv[1] == 'import':
+        n = theano.gof.compiledir.import_modules(sys.argv[2])
+        print('Imported %d module(s) into %s' % (n, config.compiledir))
+    elif len(sys.argv) == 4 and sys.argv[1] == 'export':
+        n = theano.gof.compiledir.export_modules(sys.argv[2], sys.argv[3])
+        print('Exported %d module(s) to %s' % (n, sys.argv[3]))
     elif len(sys.argv) == 3 and sys.argv[1] == 'basecompiledir':
         if sys.argv[2] == 'list':
             theano.gof.compiledir.basecompiledir_ls()
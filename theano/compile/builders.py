@@ -698,12 +698,22 @@ class OpFromGraph(gof.Op):
 
         return ret
 
+    def inner_function_builder(self):
+        """
+        Return a callable without arguments that compiles the inner function.
+
+        """
+        def compile_inner_function():
+            fn = orig_function(self.local_inputs,
+                               self.local_outputs,
+                               **self.kwargs)
+            fn.trust_input = True
+            return fn
+        return compile_inner_function
+
     def prepare_node(self, node, storage_map, compute_map, impl):
         if not hasattr(self, "fn") and impl == 'py':
-            self.fn = orig_function(self.local_inputs,
-                                    self.local_outputs,
-                                    **self.kwargs)
-            self.fn.trust_input = True
+            self.fn = self.inner_function_builder()()
 
     def perform(self, node, inputs, outputs):
         variables = self.fn(*inputs)
@@ -5,12 +5,18 @@ Driver of graph construction, optimization, and linking.
 from __future__ import absolute_import, print_function, division
 
 import copy
-from six import string_types, iteritems, iterkeys
+import multiprocessing
+import os
+from six import integer_types, string_types, iteritems, iterkeys
 from six.moves import xrange
 import six.moves.copyreg as copyreg
 import six.moves.cPickle as pickle
 from itertools import chain
+import sys
+import threading
 import time
+import traceback
+import types
 import warnings
 import numpy as np
 
@@ -22,14 +28,18 @@ import theano.compile.profiling
 from theano.compile.io import (
     In, SymbolicInput, SymbolicOutput)
 from theano.compile.ops import deep_copy_op, view_op
-from theano.gof.graph import is_same_graph
 from theano.gof.op import ops_with_inner_function
+from theano.gof.utils import hash_from_code
 
 import logging
 _logger = logging.getLogger('theano.compile.function_module')
 
 __docformat__ = "restructuredtext en"
 
+# Protects the creation of the executors of Function.call_async and of the
+# per-thread functions of thread safe functions.
+_async_lock = threading.Lock()
+
 
 class UnusedInputError(Exception):
     """
@@ -255,6 +265,14 @@ class Function(object):
     numpy tensor.  C code should raise an error if you pass an object
     of the wrong type.
 
+    A Function instance have a ``thread_safe`` field that default to
+    False. When True, the function can be called from several threads at
+    once: each thread gets its own storage and VM, made by the linker from
+    the same optimized graph and compiled modules, and sharing the storage
+    of the shared variables. The calls of functions with updates or with
+    Ops that have an inner function (e.g. scan) are serialized. The default
+    values of the inputs must be set before the first call.
+
     Attributes
     ----------
     finder
@@ -377,9 +395,16 @@ class Function(object):
         self.maker = maker
         self.profile = None  # reassigned in FunctionMaker.create
         self.trust_input = False  # If True, we don't check the input parameter
+        self.thread_safe = False  # If True, use one storage per thread
+        self._threads = None
         self.name = name
         self.nodes_with_inner_function = []
         self.output_keys = output_keys
+        # Used by fast_call
+        self._fast_call_n_args = None
+        self._fast_call_specs = {}
+        # Used by call_async
+        self._async_executor = None
 
         # See if we have any mutable / borrow inputs
         # TODO: this only need to be set if there is more then 1 input
@@ -762,25 +787,38 @@ class Function(object):
             and processed. To disable the updates, you should use the ``copy``
             method with ``delete_updates=True``.
 
+            Keyword argument ``out`` gives ndarrays where to write the outputs,
+            like the ``out`` argument of NumPy functions: one for each returned
+            output (or None to not give one), or a dict if the function has
+            `output_keys`, or an ndarray if the function returns one output.
+            Their dtype and number of dimensions must be those of the outputs,
+            and they must not share memory with the inputs. The Ops that reuse
+            their output storage compute the outputs directly in them, the
+            other outputs are copied into them. These ndarrays are returned.
+            An ndarray of the wrong shape is only detected once the outputs
+            are computed, so the ValueError is raised after the updates are
+            applied: the call took effect.
+
         Returns
         -------
         list
             List of outputs on indices/keys from ``output_subset`` or all of them,
             if ``output_subset`` is not passed.
         """
-        def restore_defaults():
-            for i, (required, refeed, value) in enumerate(self.defaults):
-                if refeed:
-                    if isinstance(value, gof.Container):
-                        value = value.storage[0]
-                    self[i] = value
-        profile = self.profile
+        if self.thread_safe:
+            fn, lock = self._thread_function()
+            if lock is None:
+                return fn(*args, **kwargs)
+            with lock:
+                return fn(*args, **kwargs)
+        restore_defaults = self._restore_defaults
         t0 = time.time()
 
         output_subset = kwargs.pop('output_subset', None)
         if output_subset is not None and self.output_keys is not None:
             output_subset =\
                 [self.output_keys.index(key) for key in output_subset]
+        out = kwargs.pop('out', None)
 
         # Reinitialize each container's 'provided' counter
         if self.trust_input:
@@ -813,22 +851,7 @@ class Function(object):
                             allow_downcast=s.allow_downcast)
 
                     except Exception as e:
-                        function_name = "theano function"
-                        argument_name = "argument"
-                        if self.name:
-                            function_name += ' with name "' + self.name + '"'
-                        if hasattr(arg, 'name') and arg.name:
-                            argument_name += ' with name "' + arg.name + '"'
-                        where = theano.gof.utils.get_variable_trace_string(
-                            self.maker.inputs[i].variable)
-                        if len(e.args) == 1:
-                            e.args = ("Bad input " + argument_name + " to " +
-                                      function_name + " at index %d (0-based). %s"
-                                      % (i, where) + e.args[0],)
-                        else:
-                            e.args = ("Bad input " + argument_name + " to " +
-                                      function_name + " at index %d (0-based). %s"
-                                      % (i, where),) + e.args
+                        self._bad_input(e, i, arg)
                         restore_defaults()
                         raise
                 s.provided += 1
@@ -896,6 +919,459 @@ class Function(object):
                         % getattr(self.inv_finder[c], 'variable',
                                   self.inv_finder[c]))
 
+        if out is not None:
+            try:
+                out = self._out_buffers(out, output_subset)
+            except Exception:
+                restore_defaults()
+                raise
+        return self._run_fn(output_subset, t0, out)
+
+    def fast_call(self, *args):
+        """
+        Evaluates value of a function on given arguments, with less Python
+        overhead than __call__.
+
+        All the explicit inputs must be given, as positional arguments. The
+        filtering of the arguments is done once per signature (the type,
+        dtype, number of dimensions and alignment of the arguments): the
+        ndarrays that `filter` left as is for a signature are put directly in
+        the input storage at the next calls, only checking their
+        broadcastable dimensions. The other arguments are filtered as in
+        __call__. When the signature can't be handled that way (e.g. the
+        inputs can be aliased or the arguments are incomplete), this falls
+        back to __call__.
+
+        Returns
+        -------
+        The same as __call__.
+
+        """
+        if self.thread_safe:
+            fn, lock = self._thread_function()
+            if lock is None:
+                return fn.fast_call(*args)
+            with lock:
+                return fn.fast_call(*args)
+        t0 = time.time()
+        values = self._fast_call_values(args)
+        if values is None or self.profile:
+            return self(*args)
+        for c, value in izip(self.input_storage, values):
+            c.storage[0] = value
+
+        t0_fn = time.time()
+        try:
+            outputs = self.fn()
+        except Exception:
+            self._restore_defaults()
+            self._raise_fn_error()
+        t1 = time.time()
+        self.maker.mode.fn_time += t1 - t0_fn
+        rval = self._fast_call_outputs(outputs)
+        self._fast_call_finish()
+        theano.compile.profiling.total_fct_exec_time += t1 - t0
+        self.maker.mode.call_time += t1 - t0
+        return rval
+
+    def map(self, args_list, stack=False):
+        """
+        Evaluates value of a function on each tuple of arguments of
+        `args_list`.
+
+        The arguments are given as to fast_call. With the C implementation
+        of the VM (linker cvm), the arguments are filtered first, then the
+        graph is run on each of them in one call to the VM, with the updates
+        of the shared variables applied between the runs. Otherwise, this
+        calls fast_call on each tuple. The outputs declared with
+        ``borrow=True`` are copied, as their storage is reused between the
+        calls.
+
+        Parameters
+        ----------
+        args_list : iterable
+            Tuples of positional arguments.
+        stack : bool
+            If True, stack the results of each output along a new first
+            axis.
+
+        Returns
+        -------
+        list
+            The list of what __call__ returns for each tuple of arguments.
+            If `stack` is True, what __call__ returns with the stacked
+            outputs instead.
+
+        """
+        if self.thread_safe:
+            fn, lock = self._thread_function()
+            if lock is None:
+                return fn.map(args_list, stack)
+            with lock:
+                return fn.map(args_list, stack)
+        t0 = time.time()
+        args_list = list(args_list)
+        batch = []
+        for args in args_list:
+            values = self._fast_call_values(args)
+            if values is None:
+                break
+            batch.append(values)
+        if any(getattr(o, 'borrow', False) for o in self.outputs):
+            # The storage of the borrowed outputs is reused at each call.
+            results = [copy.deepcopy(self.fast_call(*args))
+                       for args in args_list]
+        elif (len(batch) < len(args_list) or self.profile or
+                not getattr(self.fn, 'supports_inputs_seq', False)):
+            results = [self.fast_call(*args) for args in args_list]
+        else:
+            cells = [c.storage for c in
+                     self.input_storage[:self._fast_call_n_args]]
+            t0_fn = time.time()
+            try:
+                outputs_list = self.fn(input_cells=cells, inputs_seq=batch)
+            except Exception:
+                self._restore_defaults()
+                self._raise_fn_error()
+            t1 = time.time()
+            self.maker.mode.fn_time += t1 - t0_fn
+            results = [self._fast_call_outputs(outputs)
+                       for outputs in outputs_list]
+            self._fast_call_finish()
+            theano.compile.profiling.total_fct_exec_time += t1 - t0
+            self.maker.mode.call_time += t1 - t0
+
+        if not stack or self.return_none:
+            return results
+        if self.unpack_single and self.n_returned_outputs == 1:
+            return np.stack(results)
+        if self.output_keys is not None:
+            return dict((k, np.stack([r[k] for r in results]))
+                        for k in self.output_keys)
+        return [np.stack([r[i] for r in results])
+                for i in xrange(self.n_returned_outputs)]
+
+    def call_async(self, *args, **kwargs):
+        """
+        Start evaluating the function on the given arguments, and return a
+        `concurrent.futures.Future` of what __call__ returns. On Python 2,
+        this needs the package futures.
+
+        The calls are run in the order they were made, one at a time, in a
+        thread dedicated to this function. So the updates of the shared
+        variables are done in that order, and the storage of the function
+        is never used by two calls at once. The caller must not modify the
+        arguments before the future is done, nor call the function directly
+        while calls made with call_async are pending. The outputs declared
+        with ``borrow=True`` are copied, as the next call reuses their
+        storage.
+
+        """
+        if self._async_executor is None:
+            # Not imported at the top, the module is not in Python 2.
+            try:
+                from concurrent.futures import ThreadPoolExecutor
+            except ImportError:
+                raise ImportError(
+                    "call_async needs the module concurrent.futures. On "
+                    "Python 2, install the package futures.")
+            with _async_lock:
+                if self._async_executor is None:
+                    self._async_executor = ThreadPoolExecutor(max_workers=1)
+        return self._async_executor.submit(self._call_async_job, args,
+                                           kwargs)
+
+    def _call_async_job(self, args, kwargs):
+        rval = self(*args, **kwargs)
+        if any(getattr(o, 'borrow', False) for o in self.outputs):
+            rval = copy.deepcopy(rval)
+        return rval
+
+    def _thread_function(self):
+        """
+        Return the Function to call in the current thread when
+        self.thread_safe is True, and the lock to hold while calling it
+        (or None).
+
+        """
+        if self._threads is None:
+            with _async_lock:
+                if self._threads is None:
+                    lock = None
+                    if (self.nodes_with_inner_function or
+                            any(i.update is not None
+                                for i in self.maker.expanded_inputs)):
+                        lock = threading.Lock()
+                    self._threads = (threading.local(), lock)
+        local, lock = self._threads
+        fn = getattr(local, 'function', None)
+        if fn is None:
+            # The shared variables and the inputs with an update keep
+            # their storage, the other inputs get a new one with their
+            # default value.
+            defaults = []
+            for (input, indices, sinputs), c, (required, refeed, value) in \
+                    izip(self.indices, self.input_storage, self.defaults):
+                if input.shared or input.update is not None:
+                    defaults.append(c)
+                elif required:
+                    defaults.append(None)
+                else:
+                    defaults.append(c.storage[0])
+            with _async_lock:
+                fn = self.maker.create(defaults, trustme=True)
+            fn.trust_input = self.trust_input
+            fn.name = self.name
+            local.function = fn
+        return fn, lock
+
+    def _fast_call_values(self, args):
+        """
+        Return the filtered values of `args` for fast_call, or None if
+        fast_call can't handle them.
+
+        """
+        if self._fast_call_n_args is None:
+            n_args = 0
+            for c in self.input_storage:
+                if c.implicit:
+                    break
+                n_args += 1
+            if any(c.required for c in self.input_storage[n_args:]):
+                n_args = -1
+            self._fast_call_n_args = n_args
+            # What _run_fn does after running self.fn, precomputed.
+            fgraph_outputs = self.maker.fgraph.outputs
+            self._fast_call_tail = (
+                [c.storage for c in self.input_storage if c.required],
+                [c.storage for c, v in izip(self.output_storage,
+                                            fgraph_outputs)
+                 if v.owner is not None and getattr(self.fn, 'allow_gc',
+                                                    False)],
+                [c for i, c in reversed(list(izip(self.maker.expanded_inputs,
+                                                  self.input_storage)))
+                 if i.update is not None and
+                 getattr(self.fn, 'need_update_inputs', True)],
+                any(refeed for required, refeed, value in self.defaults))
+        if (len(args) != self._fast_call_n_args or
+                getattr(self, '_check_for_aliased_inputs', True)):
+            return None
+
+        signature = tuple([(a.dtype, a.ndim, a.flags.aligned)
+                           if type(a) is np.ndarray else type(a)
+                           for a in args])
+        spec = self._fast_call_specs.get(signature)
+        if spec is None:
+            spec = []
+            for i, (c, a) in enumerate(izip(self.input_storage, args)):
+                bcast = getattr(c.type, 'broadcastable', None)
+                if (type(a) is np.ndarray and bcast is not None and
+                        not getattr(c.type, 'filter_checks_isfinite',
+                                    False) and
+                        self._fast_call_filter(i, c, a) is a):
+                    spec.append((c, [i for i, b in enumerate(bcast) if b]))
+                else:
+                    spec.append((c, None))
+            self._fast_call_specs[signature] = spec
+
+        values = []
+        for j, ((c, bcast_axes), a) in enumerate(izip(spec, args)):
+            if bcast_axes is not None and not any(
+                    a.shape[i] != 1 for i in bcast_axes):
+                values.append(a)
+            elif a is None:
+                values.append(a)
+            else:
+                values.append(self._fast_call_filter(j, c, a))
+        return values
+
+    def _bad_input(self, e, i, arg):
+        """
+        Add to the exception `e`, raised by the filter of the argument `arg`
+        at index `i`, which function and argument it comes from.
+
+        """
+        function_name = "theano function"
+        argument_name = "argument"
+        if self.name:
+            function_name += ' with name "' + self.name + '"'
+        if hasattr(arg, 'name') and arg.name:
+            argument_name += ' with name "' + arg.name + '"'
+        where = theano.gof.utils.get_variable_trace_string(
+            self.maker.inputs[i].variable)
+        if len(e.args) == 1:
+            e.args = ("Bad input " + argument_name + " to " +
+                      function_name + " at index %d (0-based). %s"
+                      % (i, where) + e.args[0],)
+        else:
+            e.args = ("Bad input " + argument_name + " to " +
+                      function_name + " at index %d (0-based). %s"
+                      % (i, where),) + e.args
+
+    def _fast_call_filter(self, i, c, a):
+        try:
+            return c.type.filter(a, strict=c.strict,
+                                 allow_downcast=c.allow_downcast)
+        except Exception as e:
+            # The error of __call__, without running the function.
+            self._bad_input(e, i, a)
+            raise
+
+    def _fast_call_outputs(self, outputs):
+        """
+        Return what __call__ returns for the list of `outputs` of self.fn,
+        doing the updates if self.fn did not.
+
+        """
+        updated = self._fast_call_tail[2]
+        if outputs is None:
+            outputs = [c.storage[0] for c in self.output_storage]
+        if updated:
+            for c in updated:
+                c.data = outputs.pop()
+        elif not getattr(self.fn, 'need_update_inputs', True):
+            outputs = outputs[:self.n_returned_outputs]
+        if self.return_none:
+            return None
+        elif self.unpack_single and len(outputs) == 1:
+            return outputs[0]
+        elif self.output_keys is not None:
+            return dict(izip(self.output_keys, outputs))
+        return outputs
+
+    def _fast_call_finish(self):
+        required, gc_outputs, updated, refeed = self._fast_call_tail
+        for storage in required:
+            storage[0] = None
+        for storage in gc_outputs:
+            storage[0] = None
+        if refeed:
+            self._restore_defaults()
+
+    def _raise_fn_error(self):
+        # To be called in the except clause around self.fn().
+        if hasattr(self.fn, 'position_of_error'):
+            # this is a new vm-provided function or c linker
+            # they need this because the exception manipulation
+            # done by raise_with_op is not implemented in C.
+            thunk = None
+            if hasattr(self.fn, 'thunks'):
+                thunk = self.fn.thunks[self.fn.position_of_error]
+            gof.link.raise_with_op(
+                node=self.fn.nodes[self.fn.position_of_error],
+                thunk=thunk,
+                storage_map=getattr(self.fn, 'storage_map', None))
+        else:
+            # old-style linkers raise their own exceptions
+            raise
+
+    def _restore_defaults(self):
+        for i, (required, refeed, value) in enumerate(self.defaults):
+            if refeed:
+                if isinstance(value, gof.Container):
+                    value = value.storage[0]
+                self[i] = value
+
+    def _out_buffers(self, out, output_subset):
+        """
+        Check the `out` argument of __call__ and return the list of
+        (output index, ndarray) it gives.
+
+        """
+        if output_subset is None:
+            indices = list(range(self.n_returned_outputs))
+        else:
+            indices = list(output_subset)
+        if isinstance(out, dict):
+            if self.output_keys is None:
+                raise TypeError("out can only be a dict for functions with "
+                                "output_keys")
+            out = [out.get(self.output_keys[i]) for i in indices]
+        elif isinstance(out, np.ndarray):
+            out = [out]
+        if len(out) != len(indices):
+            raise ValueError("out has %d elements, but the function returns "
+                             "%d outputs" % (len(out), len(indices)))
+        inputs = [c.storage[0] for c in self.input_storage
+                  if isinstance(c.storage[0], np.ndarray)]
+        buffers = []
+        for i, buf in zip(indices, out):
+            if buf is None:
+                continue
+            var = self.maker.fgraph.outputs[i]
+            dtype = getattr(var.type, 'dtype', None)
+            bcast = getattr(var.type, 'broadcastable', None)
+            if not isinstance(buf, np.ndarray) or bcast is None:
+                raise TypeError("out only accepts ndarrays for the outputs "
+                                "of TensorType, got %s for output %d of "
+                                "type %s" % (type(buf), i, var.type))
+            if buf.dtype != dtype or buf.ndim != len(bcast):
+                raise TypeError(
+                    "out for output %d has dtype %s and %d dimensions, "
+                    "but the output has dtype %s and %d dimensions" %
+                    (i, buf.dtype, buf.ndim, dtype, len(bcast)))
+            if any(b and n != 1 for b, n in zip(bcast, buf.shape)):
+                raise ValueError(
+                    "out for output %d has shape %s, but the output has "
+                    "broadcastable pattern %s" % (i, buf.shape, bcast))
+            if not (buf.flags.writeable and buf.flags.aligned):
+                raise ValueError("out for output %d must be writeable and "
+                                 "aligned" % i)
+            if any(np.may_share_memory(buf, a) for a in inputs):
+                raise ValueError("out for output %d shares memory with an "
+                                 "input" % i)
+            if any(np.may_share_memory(buf, b) for j, b in buffers):
+                raise ValueError("out for output %d shares memory with "
+                                 "another one" % i)
+            buffers.append((i, buf))
+        return buffers
+
+    def _set_out(self, out):
+        """
+        Put views of the `out` buffers in the output storage, and take them
+        out of the containers the VM clears at the start of a call. Return
+        the views and the changes to undo after the call.
+
+        """
+        pre_call_clear = getattr(self.fn, 'pre_call_clear', None)
+        views = []
+        changes = []
+        for i, buf in out:
+            storage = self.output_storage[i].storage
+            if pre_call_clear is not None:
+                for j, cell in enumerate(pre_call_clear):
+                    if cell is storage:
+                        pre_call_clear[j] = [None]
+                        changes.append((j, cell))
+            # Some Ops resize their output storage inplace when it has the
+            # wrong shape, they can't do it with a view.
+            views.append(buf.view())
+            storage[0] = views[-1]
+        return views, changes
+
+    def _unset_out(self, out, changes):
+        pre_call_clear = self.fn.pre_call_clear if changes else None
+        for j, cell in changes:
+            pre_call_clear[j] = cell
+        # The VM must not reuse them at the next calls.
+        for i, buf in out:
+            self.output_storage[i].storage[0] = None
+
+    def _run_fn(self, output_subset, t0, out=None):
+        """
+        Run the VM on the values set in the input storage and return the
+        outputs. This is the part of __call__ common with fast_call.
+
+        """
+        restore_defaults = self._restore_defaults
+        profile = self.profile
+        if profile:
+            sampled = profile.sample_call()
+            self.fn.time_thunks = profile.flag_time_thunks and sampled
+
+        if out:
+            out_views, out_changes = self._set_out(out)
+
         # Do the actual work
         t0_fn = time.time()
         try:
@@ -904,20 +1380,9 @@ class Function(object):
                 self.fn(output_subset=output_subset)
         except Exception:
             restore_defaults()
-            if hasattr(self.fn, 'position_of_error'):
-                # this is a new vm-provided function or c linker
-                # they need this because the exception manipulation
-                # done by raise_with_op is not implemented in C.
-                thunk = None
-                if hasattr(self.fn, 'thunks'):
-                    thunk = self.fn.thunks[self.fn.position_of_error]
-                gof.link.raise_with_op(
-                    node=self.fn.nodes[self.fn.position_of_error],
-                    thunk=thunk,
-                    storage_map=getattr(self.fn, 'storage_map', None))
-            else:
-                # old-style linkers raise their own exceptions
-                raise
+            if out:
+                self._unset_out(out, out_changes)
+            self._raise_fn_error()
 
         dt_fn = time.time() - t0_fn
         self.maker.mode.fn_time += dt_fn
@@ -929,6 +1394,26 @@ class Function(object):
             outputs = [x.data for x in self.output_storage]
         assert len(outputs) == len(self.output_storage)
 
+        out_error = None
+        if out:
+            self._unset_out(out, out_changes)
+            for (i, buf), view in zip(out, out_views):
+                if outputs[i] is view:
+                    outputs[i] = buf
+                    continue
+                if getattr(outputs[i], 'shape', None) != buf.shape:
+                    # The call is finished before raising, so that the
+                    # updates are applied whatever the linker.
+                    out_error = (
+                        "out for output %d has shape %s, but the output has "
+                        "shape %s. The call took effect: the updates were "
+                        "applied." % (i, buf.shape,
+                                      getattr(outputs[i], 'shape', None)))
+                    break
+                # The Op did not compute it in buf.
+                np.copyto(buf, outputs[i])
+                outputs[i] = buf
+
         # Remove internal references to required inputs.
         # These cannot be re-used anyway.
         for c in self.input_storage:
@@ -957,6 +1442,8 @@ class Function(object):
 
         # Put default values back in the storage
         restore_defaults()
+        if out_error is not None:
+            raise ValueError(out_error)
         #
         # NOTE: This logic needs to be replicated in
         #       scan.
@@ -969,11 +1456,14 @@ class Function(object):
         if profile:
             profile.fct_callcount += 1
             profile.fct_call_time += dt_call
-            if hasattr(self.fn, 'update_profile'):
-                self.fn.update_profile(profile)
+            if sampled:
+                profile.sampled_callcount += 1
+                if hasattr(self.fn, 'update_profile'):
+                    self.fn.update_profile(profile)
             if profile.ignore_first_call:
                 profile.reset()
                 profile.ignore_first_call = False
+            profile.export_if_due()
         if self.return_none:
             return None
         elif self.unpack_single and len(outputs) == 1 and\
@@ -1179,6 +1669,223 @@ def insert_deepcopy(fgraph, wrapped_inputs, wrapped_outputs):
                                             reason="insert_deepcopy")
                         break
 
+
+class _NoGraphKey(Exception):
+    """
+    Raised when a graph has no stable structural description.
+
+    """
+
+    pass
+
+
+def _graph_key_value(value, depth=0):
+    # Return a string that describes `value` by its content and not by
+    # the identity of the objects, so that it is the same in all processes.
+    if depth > 20:
+        raise _NoGraphKey()
+    depth += 1
+    if (value is None or
+            isinstance(value, (bool, float, complex) + integer_types +
+                       string_types)):
+        return repr(value)
+    if isinstance(value, (np.generic, np.dtype)):
+        return '%s(%s)' % (type(value).__name__, value)
+    if isinstance(value, np.ndarray):
+        return 'ndarray(%s, %s, %s)' % (value.dtype, value.shape,
+                                        hash_from_code(
+                                            np.ascontiguousarray(value)))
+    if isinstance(value, (tuple, list)):
+        return '%s(%s)' % (type(value).__name__,
+                           ', '.join(_graph_key_value(v, depth)
+                                     for v in value))
+    if isinstance(value, (set, frozenset)):
+        return '%s(%s)' % (type(value).__name__,
+                           ', '.join(sorted(_graph_key_value(v, depth)
+                                            for v in value)))
+    if isinstance(value, dict):
+        return 'dict(%s)' % ', '.join(sorted(
+            '%s: %s' % (_graph_key_value(k, depth),
+                        _graph_key_value(v, depth))
+            for k, v in iteritems(value)))
+    if isinstance(value, (types.FunctionType, types.BuiltinFunctionType,
+                          type)):
+        name = getattr(value, '__qualname__', value.__name__)
+        if '<' in name:
+            # Lambdas and functions defined inside other functions.
+            raise _NoGraphKey()
+        return '%s.%s' % (value.__module__, name)
+    if isinstance(value, (gof.Variable, gof.Apply, gof.FunctionGraph)):
+        # Inner graphs are not described.
+        raise _NoGraphKey()
+    props = getattr(value, '__props__', None)
+    if props is not None:
+        items = [(p, getattr(value, p)) for p in props]
+    elif hasattr(value, '__dict__'):
+        items = sorted(iteritems(value.__dict__))
+    else:
+        raise _NoGraphKey()
+    return '%s{%s}' % (_graph_key_value(type(value), depth),
+                       ', '.join('%s=%s' % (k, _graph_key_value(v, depth))
+                                 for k, v in items))
+
+
+def graph_cache_key(fgraph, input_specs, optimizer):
+    """
+    Return the key of the optimization of `fgraph` by `optimizer`.
+
+    The key is a hash of the structure of the graph (the ops, the types,
+    the constants and how they are connected, but not the names of the
+    variables nor the values of the shared variables), of the optimizer
+    and of the Theano version and config. Two graphs with the same key
+    are optimized to the same graph.
+
+    Parameters
+    ----------
+    fgraph : FunctionGraph
+        The graph to optimize, as returned by `std_fgraph`.
+    input_specs : list of SymbolicInput
+        The inputs of `fgraph`.
+    optimizer : Query or Optimizer
+        The optimizer provided to the mode.
+
+    Returns
+    -------
+    str or None
+        None if an op, type or constant of the graph, or the optimizer,
+        has no stable description. Such graphs are not cached.
+
+    """
+    ids = {}
+    lines = ['theano %s' % theano.__version__,
+             'config %s' % theano.configparser.get_config_hash(
+                 in_c_key_only=False)]
+
+    def ref(var):
+        if var not in ids:
+            if not isinstance(var, gof.Constant):
+                raise _NoGraphKey()
+            ids[var] = 'c%d' % len(lines)
+            lines.append('%s = constant(%s, %s)' % (
+                ids[var], _graph_key_value(var.type),
+                _graph_key_value(var.data)))
+        return ids[var]
+
+    try:
+        if isinstance(optimizer, gof.Query):
+            lines.append('optimizer %s' % optimizer)
+        else:
+            lines.append('optimizer %s' % _graph_key_value(optimizer))
+        for i, (spec, var) in enumerate(izip(input_specs, fgraph.inputs)):
+            ids[var] = 'i%d' % i
+            lines.append('%s = input(%s, mutable=%s, shared=%s)' % (
+                ids[var], _graph_key_value(var.type), spec.mutable,
+                isinstance(var, theano.compile.sharedvalue.SharedVariable)))
+        for i, node in enumerate(fgraph.toposort()):
+            inputs = ', '.join(ref(var) for var in node.inputs)
+            for j, var in enumerate(node.outputs):
+                ids[var] = 'n%d_%d' % (i, j)
+            lines.append('%s = %s(%s)' % (
+                ', '.join('%s:%s' % (ids[var], _graph_key_value(var.type))
+                          for var in node.outputs),
+                _graph_key_value(node.op), inputs))
+        lines.append('outputs %s' % ', '.join(ref(var)
+                                              for var in fgraph.outputs))
+    except _NoGraphKey:
+        return None
+    return hash_from_code('\n'.join(lines))
+
+
+# The builders of the inner functions to compile, inherited by the workers
+# forked by compile_inner_functions, which holds _inner_function_lock while
+# it uses them.
+_inner_function_builders = []
+_inner_function_lock = threading.Lock()
+# Pickling deep inner graphs needs more than the default recursion limit.
+_min_recursion = 3000
+
+
+def _compile_inner_function(i):
+    # Run in the workers, which must not start workers again.
+    theano.config.compile.inner_workers = 1
+    if sys.getrecursionlimit() < _min_recursion:
+        sys.setrecursionlimit(_min_recursion)
+    try:
+        fn = _inner_function_builders[i]()
+        return pickle.dumps(fn, protocol=pickle.HIGHEST_PROTOCOL), None
+    except Exception:
+        return None, traceback.format_exc()
+
+
+def compile_inner_functions(fgraph, n_workers):
+    """
+    Compile the inner functions of the nodes of `fgraph` in worker processes.
+
+    The ops of the types in `ops_with_inner_function` that have an
+    `inner_function_builder` method and no inner function yet get it from
+    `n_workers` forked processes, which optimize and link them and pickle
+    them back. As the C code is shared through the compiledir, unpickling
+    them does not optimize or compile them again. An inner function that
+    fails in a worker is compiled as usual when its node is linked.
+
+    No worker is used while other threads run, as a process forked while
+    another thread holds a lock (logging, compilation, import) can
+    deadlock.
+
+    """
+    ops = []
+    seen = set()
+    for node in fgraph.toposort():
+        attr = ops_with_inner_function.get(type(node.op))
+        if (attr is not None and id(node.op) not in seen and
+                hasattr(node.op, 'inner_function_builder') and
+                getattr(node.op, attr, None) is None):
+            seen.add(id(node.op))
+            ops.append(node.op)
+    if len(ops) < 2:
+        return
+    gpuarray = sys.modules.get('theano.gpuarray')
+    if (not hasattr(os, 'fork') or
+            threading.active_count() > 1 or
+            getattr(gpuarray, 'pygpu_activated', False) or
+            # The profiles would stay in the workers.
+            config.profile or any(getattr(op, 'profile', None)
+                                  for op in ops)):
+        return
+
+    if hasattr(multiprocessing, 'get_context'):
+        context = multiprocessing.get_context('fork')
+    else:
+        context = multiprocessing
+    with _inner_function_lock:
+        _inner_function_builders[:] = [op.inner_function_builder()
+                                       for op in ops]
+        pool = context.Pool(min(n_workers, len(ops)))
+        try:
+            results = pool.map(_compile_inner_function, range(len(ops)))
+        finally:
+            pool.close()
+            pool.join()
+            del _inner_function_builders[:]
+
+    recursion_limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(recursion_limit, _min_recursion))
+    try:
+        for op, (data, error) in izip(ops, results):
+            if data is not None:
+                try:
+                    setattr(op, ops_with_inner_function[type(op)],
+                            pickle.loads(data))
+                    continue
+                except Exception:
+                    error = traceback.format_exc()
+            _logger.warning('The inner function of %s could not be compiled '
+                            'by a worker, it will be compiled by this '
+                            'process.\n%s', op, error)
+    finally:
+        sys.setrecursionlimit(recursion_limit)
+
+
 NODEFAULT = ['NODEFAULT']
 
 
@@ -1259,170 +1966,77 @@ class FunctionMaker(object):
             raise TypeError("Unknown output type: %s (%s)", type(output),
                             output)
 
-    def optimize_graph_with_cache(self, optimizer, inputs, outputs):
-        # This function is not finished
-        from theano.gof.compilelock import get_lock, release_lock
-        import os.path
-
-        graph_db_file = os.path.join(theano.config.compiledir,
-                                     'optimized_graphs.pkl')
-
-        # the inputs, outputs, and size of the graph to be optimized
-        inputs_new = [inp.variable for inp in inputs]
-        outputs_new = [out.variable for out in outputs]
-        size_new = len(self.fgraph.apply_nodes)
-        get_lock()
-        # Beginning of cache optimizations.
-        # Could be refactored in different functions.
-
-        def load_graph_db():
-            if os.path.isfile(graph_db_file):
-                print('graph_db already exists')
-            else:
-                # create graph_db
-                with open(graph_db_file, 'wb') as f:
-                    print('create new graph_db in %s' % graph_db_file)
-            # load the graph_db dictionary
+    def optimize_graph_with_cache(self, optimizer, inputs, outputs,
+                                  provided_optimizer=None):
+        """
+        Optimize self.fgraph, reusing an earlier optimization of that graph.
+
+        The optimized graphs are saved in the ``optimized_graphs`` directory
+        of the compiledir, one file per `graph_cache_key`. When a graph with
+        the same key was already optimized, by this process or by an earlier
+        one, the saved graph is loaded and plugged on the inputs of
+        self.fgraph instead of running `optimizer`.
+
+        Returns the profile of `optimizer`, or None if the optimized graph
+        was loaded from the cache.
+
+        """
+        fgraph = self.fgraph
+        if provided_optimizer is None:
+            provided_optimizer = optimizer
+        key = graph_cache_key(fgraph, inputs, provided_optimizer)
+        if key is None:
+            _logger.debug('The graph can not be cached, optimizing it')
+            return optimizer(fgraph)
+
+        cache_dir = os.path.join(theano.config.compiledir, 'optimized_graphs')
+        cache_file = os.path.join(cache_dir, key + '.pkl')
+        cached = None
+        if os.path.exists(cache_file):
             try:
-                with open(graph_db_file, 'rb') as f:
-                    # Temporary hack to allow
-                    # theano.scan_module.tests.test_scan.T_Scan to
-                    # finish. Should be changed in definitive version.
-                    tmp = theano.config.unpickle_function
-                    theano.config.unpickle_function = False
-                    graph_db = pickle.load(f)
-                print('graph_db loaded and it is not empty')
-            except EOFError as e:
-                # the file has nothing in it
-                print(e)
-                print('graph_db loaded and it is empty')
-                graph_db = {}
-            finally:
-                theano.config.unpickle_function = tmp
-
-            return graph_db
-
-        def find_same_graph_in_db(graph_db):
-            # If found_graph_in_db is None, then need to optimize.
-            # Otherwise, return the graph found.
-            found_graph_in_db = None
-            # The sole purpose of this loop is to set 'need_optimize' by
-            # going through graph_db, looking for graph that has the same
-            # computation performed.
-            for graph_old, graph_optimized in iteritems(graph_db):
-                inputs_old = graph_old.inputs
-                outputs_old = graph_old.outputs
-                size_old = len(graph_old.apply_nodes)
-                # Some heuristics to check is the same graphs have
-                # already been optimized before.
-                if len(inputs_new) != len(inputs_old):
-                    # If the inputs are of different size,
-                    # two graphs are for sure different
-                    print('need to optimize, because input size is different')
-                    continue
-                elif len(outputs_new) != len(outputs_old):
-                    # If the inputs are of different size,
-                    # two graphs are for sure different
-                    print('need to optimize, because output size is different')
-                    continue
-                elif not all(input_new.type == input_old.type
-                             for input_new, input_old in
-                             zip(inputs_new, inputs_old)):
-                    print('need to optimize, because inputs are of different '
-                          'types')
-                    continue
-                elif not all(output_new.type == output_old.type
-                             for output_new, output_old in
-                             zip(outputs_new, outputs_old)):
-                    print('need to optimize, because outputs are of different '
-                          'types')
-                    continue
-                elif not size_old == size_new:
-                    print('need to optimize, because numbers of nodes in graph'
-                          ' are different')
-                    continue
-                else:
-                    flags = []
-                    for i, (output_new, output_old) in enumerate(
-                            zip(outputs_new, outputs_old)):
-                        print('loop through outputs node for both graphs')
-                        graph_old.variables = set(gof.graph.variables(
-                            graph_old.inputs, graph_old.outputs))
-
-                        # using clone allowed to avoid a lot of errors
-                        # deep copy seemed to had.
-                        f2 = graph_old.clone(check_integrity=False)
-                        t1 = output_new
-                        t2 = f2.outputs[i]
-
-                        # Used to remove "already used by another graph error
-                        def removeAllFgraph(remove):
-                            if hasattr(remove, 'fgraph'):
-                                del remove.fgraph
-                            if hasattr(remove, 'owner'):
-                                if remove.owner is None:
-                                    pass
-                                else:
-                                    if hasattr(remove.owner, 'fgraph'):
-                                        del remove.owner.fgraph
-                                    if hasattr(remove.owner, 'inputs'):
-                                        remove.owner.inputs = [removeAllFgraph(
-                                            i) for i in remove.owner.inputs]
-                                        for o in remove.owner.outputs:
-                                            if hasattr(o, 'fgraph'):
-                                                del o.fgraph
-                            return remove
-
-                        t2 = removeAllFgraph(t2)
-
-                        givens = dict(izip(gof.graph.inputs([t1]),
-                                           gof.graph.inputs([t2])))
-
-                        temp = dict(izip(gof.graph.inputs([t1]),
-                                         gof.graph.inputs([t2])))
-
-                        # hack to remove inconstent entry in givens
-                        # seems to work that but source of inconsistency
-                        # could be worth investigating.
-                        for key, value in iteritems(temp):
-                            if key.type != value.type:
-                                del givens[key]
-
-                        flag = is_same_graph(t1, t2, givens=givens)
-
-                        flags.append(flag)
-
-                    is_same = all(flags)
-                    if is_same:
-                        # found the match
-                        print('found a match, no need to optimize')
-                        found_graph_in_db = graph_optimized
-                        break
-            return found_graph_in_db
-
-        graph_db = load_graph_db()
-        print('loaded graph_db from %s, size=%d' % (graph_db_file,
-                                                    len(graph_db)))
-        found_graph = find_same_graph_in_db(graph_db)
-        if found_graph:
-            self.fgraph = found_graph
-            optimizer_profile = None
-        else:
-            # this is a brand new graph, optimize it, save it to graph_db
-            print('graph not found in graph_db, optimizing the graph')
-            self.fgraph.variables = set(gof.graph.variables(
-                self.fgraph.inputs, self.fgraph.outputs))
-            # check_integrity parameters was added to ignore
-            # "excess cached variables" errors. Works that way
-            # but once again the error couldbe worth
-            # investigating.
-            before_opt = self.fgraph.clone(check_integrity=False)
-            optimizer_profile = optimizer(self.fgraph)
-            graph_db.update({before_opt: self.fgraph})
-            with open(graph_db_file, 'wb') as f:
-                pickle.dump(graph_db, f, -1)
-            print('new graph saved into graph_db')
-        release_lock()
+                with open(cache_file, 'rb') as f:
+                    cached = pickle.load(f)
+            except Exception:
+                _logger.warning('Could not load the optimized graph %s',
+                                cache_file, exc_info=True)
+        if cached is not None:
+            _logger.debug('Loaded the optimized graph %s', cache_file)
+            cached_inputs, cached_outputs = cached
+            equiv = graph.clone_get_equiv(
+                cached_inputs, cached_outputs,
+                memo=dict(izip(cached_inputs, fgraph.inputs)))
+            for i, out in enumerate(cached_outputs):
+                fgraph.change_input('output', i, equiv[out],
+                                    reason='optimize_graph_with_cache')
+            if (not hasattr(fgraph, 'destroyers') and
+                    any(getattr(node.op, 'destroy_map', None)
+                        for node in fgraph.apply_nodes)):
+                fgraph.attach_feature(gof.DestroyHandler())
+            return None
+
+        optimizer_profile = optimizer(fgraph)
+
+        # The inputs are replaced by new variables so that the values of the
+        # shared variables are not saved.
+        cached_inputs = [var.type() for var in fgraph.inputs]
+        equiv = graph.clone_get_equiv(
+            fgraph.inputs, fgraph.outputs,
+            memo=dict(izip(fgraph.inputs, cached_inputs)))
+        cached_outputs = [equiv[out] for out in fgraph.outputs]
+        tmp_file = '%s.%d.tmp' % (cache_file, os.getpid())
+        try:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            with open(tmp_file, 'wb') as f:
+                pickle.dump((cached_inputs, cached_outputs), f, -1)
+            # Readers only see complete files.
+            os.rename(tmp_file, cache_file)
+            _logger.debug('Saved the optimized graph %s', cache_file)
+        except Exception:
+            _logger.warning('Could not save the optimized graph %s',
+                            cache_file, exc_info=True)
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
         return optimizer_profile
 
     def __init__(self, inputs, outputs,
@@ -1449,7 +2063,10 @@ class FunctionMaker(object):
             #    too much execution time during testing as we compile
             #    much more functions then the number of compile c
             #    module.
-            theano.gof.cc.get_module_cache().refresh()
+            # 3) A lazy cache only reads the modules it needs.
+            cache = theano.gof.cc.get_module_cache()
+            if not cache.lazy:
+                cache.refresh()
         # Handle the case where inputs and/or outputs is a single
         # Variable (not in a list)
         unpack_single = False
@@ -1514,7 +2131,8 @@ class FunctionMaker(object):
                 # now optimize the graph
                 if theano.config.cache_optimizations:
                     optimizer_profile = self.optimize_graph_with_cache(
-                        optimizer, inputs, outputs)
+                        optimizer, inputs, outputs,
+                        getattr(mode, 'provided_optimizer', None))
                 else:
                     optimizer_profile = optimizer(fgraph)
 
@@ -1708,13 +2326,21 @@ class FunctionMaker(object):
         # Get a function instance
         start_linker = time.time()
         start_import_time = theano.gof.cmodule.import_time
+        module_times = []
+        if self.profile:
+            theano.gof.cmodule.module_time_listeners.append(module_times)
         limit_orig = theano.config.traceback.limit
         try:
             theano.config.traceback.limit = theano.config.traceback.compile_limit
+            if theano.config.compile.inner_workers > 1:
+                compile_inner_functions(self.fgraph,
+                                        theano.config.compile.inner_workers)
             _fn, _i, _o = self.linker.make_thunk(
                 input_storage=input_storage_lists, storage_map=storage_map)
         finally:
             theano.config.traceback.limit = limit_orig
+            if self.profile:
+                theano.gof.cmodule.module_time_listeners.remove(module_times)
 
         end_linker = time.time()
 
@@ -1726,6 +2352,7 @@ class FunctionMaker(object):
             _fn.time_thunks = self.profile.flag_time_thunks
             import_time = theano.gof.cmodule.import_time - start_import_time
             self.profile.import_time += import_time
+            self.profile.linker_module_times.extend(module_times)
 
         fn = self.function_builder(_fn, _i, _o, self.indices, self.outputs,
                                    defaults, self.unpack_single,
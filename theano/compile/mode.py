@@ -25,6 +25,7 @@ predefined_linkers = {
     'c': gof.CLinker(),  # Don't support gc. so don't check allow_gc
     'c|py': gof.OpWiseCLinker(),  # Use allow_gc Theano flag
     'c|py_nogc': gof.OpWiseCLinker(allow_gc=False),
+    'c|py_segments': gof.SegmentCLinker(),  # Use allow_gc Theano flag
     'vm': gof.vm.VM_Linker(use_cloop=False),  # Use allow_gc Theano flag
     'cvm': gof.vm.VM_Linker(use_cloop=True),  # Use allow_gc Theano flag
     'vm_nogc': gof.vm.VM_Linker(allow_gc=False, use_cloop=False),
@@ -11,10 +11,13 @@ from __future__ import absolute_import, print_function, division
 
 import atexit
 import copy
+import json
 import logging
 import operator
 import os
+import random
 import sys
+import threading
 import time
 from collections import defaultdict
 from six import iteritems
@@ -69,7 +72,7 @@ def _atexit_print_fn():
                            n_ops_to_print=config.profiling.n_ops,
                            n_apply_to_print=config.profiling.n_apply)
                 if not isinstance(ps, ScanProfileStats):
-                    to_sum.append(ps)
+                    to_sum.append(ps.extrapolated())
             else:
                 # TODO print the name if there is one!
                 print('Skipping empty Profile')
@@ -81,10 +84,13 @@ def _atexit_print_fn():
             cum.message = msg
             for ps in to_sum[1:]:
                 for attr in ["compile_time", "fct_call_time", "fct_callcount",
+                             "sampled_callcount",
                              "vm_call_time", "optimizer_time", "linker_time",
                              "validate_time", "import_time",
                              "linker_node_make_thunks"]:
                     setattr(cum, attr, getattr(cum, attr) + getattr(ps, attr))
+                cum.linker_module_times = (cum.linker_module_times +
+                                           ps.linker_module_times)
 
                 # merge dictonary
                 for attr in ["apply_time", "apply_callcount",
@@ -167,6 +173,17 @@ class ProfileStats(object):
     atexit_print : bool
         True means that this object will be printed to stderr (using .summary())
         at the end of the program.
+    sample_every : int
+        Time the thunks in only one call out of that many. If None, use the
+        Theano flag profiling.sample_every.
+    sample_fraction : float
+        Time the thunks in only a random fraction of the calls (among the
+        ones selected by `sample_every`). If None, use the Theano flag
+        profiling.sample_fraction.
+    export_to : None, str or callable
+        If not None, every `export_every` seconds the statistics returned
+        by `export` are written in JSON to this file, or given to this
+        callable. This allows to watch a long running process.
     **kwargs : misc initializers
         These should (but need not) match the names of the class vars declared
         in this class.
@@ -180,6 +197,7 @@ class ProfileStats(object):
         self.vm_call_time = 0.
         self.apply_time = {}
         self.apply_callcount = {}
+        self.sampled_callcount = 0
         # self.apply_cimpl = None
         # self.message = None
     #
@@ -252,6 +270,10 @@ class ProfileStats(object):
 
     linker_make_thunk_time = {}
 
+    linker_module_times = []
+    # list of (module description, code generation time, cache lookup time,
+    # compilation time, import time) of the C modules loaded by the linker.
+
     line_width = config.profiling.output_line_width
 
     nb_nodes = -1
@@ -262,10 +284,27 @@ class ProfileStats(object):
     optimizer_profile = None
     # None or tuple (the optimizer, the profile it returned)
 
+    vm_arena_size = 0
+    # Size in bytes of the buffer storing the intermediate results when
+    # the VM uses a memory planner (Theano flag vm.memory_planner).
+
+    vm_peak_memory = 0
+    # Peak in bytes of the memory used by the intermediate results planned
+    # in that buffer.
+
+    sampled_callcount = 0
+    # Number of calls to Function.__call__ whose thunks were timed. When
+    # it is lower than fct_callcount, the statistics of the thunks are
+    # extrapolated from these calls.
+
+    export_every = 60.0
+    # Number of seconds between two exports to export_to.
+
     # param is called flag_time_thunks because most other attributes with time
     # in the name are times *of* something, rather than configuration flags.
     def __init__(self, atexit_print=True, flag_time_thunks=None,
-                 gpu_checks=True, **kwargs):
+                 gpu_checks=True, sample_every=None, sample_fraction=None,
+                 export_to=None, **kwargs):
         if (gpu_checks and
             (hasattr(theano, 'gpuarray') and
              theano.gpuarray.pygpu_activated) and
@@ -298,10 +337,21 @@ class ProfileStats(object):
         self.variable_shape = {}
         self.variable_strides = {}
         self.variable_offset = {}
+        self.linker_module_times = []
         if flag_time_thunks is None:
             self.flag_time_thunks = config.profiling.time_thunks
         else:
             self.flag_time_thunks = flag_time_thunks
+        if sample_every is None:
+            sample_every = config.profiling.sample_every
+        self.sample_every = sample_every
+        if sample_fraction is None:
+            sample_fraction = config.profiling.sample_fraction
+        self.sample_fraction = sample_fraction
+        # The first call is timed.
+        self.calls_to_next_sample = 0
+        self.export_to = export_to
+        self.last_export = time.time()
         self.__dict__.update(kwargs)
         if atexit_print:
             global _atexit_print_list
@@ -312,6 +362,83 @@ class ProfileStats(object):
                 _atexit_registered = True
         self.ignore_first_call = theano.config.profiling.ignore_first_call
 
+    def sample_call(self):
+        """
+        Return True if the thunks of the next call must be timed, according
+        to sample_every and sample_fraction.
+
+        """
+        if self.calls_to_next_sample > 0:
+            self.calls_to_next_sample -= 1
+            return False
+        self.calls_to_next_sample = self.sample_every - 1
+        return (self.sample_fraction >= 1 or
+                random.random() < self.sample_fraction)
+
+    def extrapolated(self):
+        """
+        Return a copy of this profile where the statistics of the thunks,
+        measured in the sampled calls, are extrapolated to all the calls.
+        Return self if all the calls were timed.
+
+        """
+        if (not self.sampled_callcount or
+                self.sampled_callcount == self.fct_callcount):
+            return self
+        scale = float(self.fct_callcount) / self.sampled_callcount
+        ps = copy.copy(self)
+        ps.apply_time = dict((node, t * scale)
+                             for node, t in iteritems(self.apply_time))
+        ps.apply_callcount = dict(
+            (node, int(round(c * scale)))
+            for node, c in iteritems(self.apply_callcount))
+        ps.sampled_callcount = self.fct_callcount
+        ps.message = '%s (thunks timed in %d calls, extrapolated)' % (
+            self.message, self.sampled_callcount)
+        return ps
+
+    def export(self):
+        """
+        Return a dict with the extrapolated time and number of calls of
+        the Ops and Apply nodes, sorted by decreasing time, that can be
+        serialized in JSON.
+
+        """
+        ps = self.extrapolated()
+        op_callcount = ps.op_callcount()
+        ops = sorted(iteritems(ps.op_time()), key=operator.itemgetter(1),
+                     reverse=True)
+        applies = sorted(iteritems(ps.apply_time),
+                         key=operator.itemgetter(1), reverse=True)
+        return {
+            'message': str(self.message),
+            'fct_callcount': self.fct_callcount,
+            'sampled_callcount': self.sampled_callcount,
+            'fct_call_time': self.fct_call_time,
+            'vm_call_time': self.vm_call_time,
+            'ops': [{'op': str(op), 'time': t, 'callcount': op_callcount[op]}
+                    for op, t in ops],
+            'applies': [{'apply': str(node), 'time': t,
+                         'callcount': ps.apply_callcount.get(node, 0)}
+                        for node, t in applies]}
+
+    def export_if_due(self):
+        """
+        Export the statistics to export_to if export_every seconds passed
+        since the last export.
+
+        """
+        now = time.time()
+        if self.export_to is None or now - self.last_export < self.export_every:
+            return
+        self.last_export = now
+        stats = self.export()
+        if callable(self.export_to):
+            self.export_to(stats)
+        else:
+            with open(self.export_to, 'w') as f:
+                json.dump(stats, f)
+
     def class_time(self):
         """
         dict op -> total time on thunks
@@ -755,12 +882,43 @@ class ProfileStats(object):
                               key=operator.itemgetter(1))[::-1][:5]:
             print('           Node %s time %es' % (node, t),
                   file=file)
+        if self.linker_module_times:
+            self.summary_module_times(file)
+        if self.vm_arena_size:
+            print('  Memory planner: peak of intermediate results %dKB, '
+                  'arena %dKB' % (int(round(self.vm_peak_memory / 1024.)),
+                                  int(round(self.vm_arena_size / 1024.))),
+                  file=file)
         print('', file=file)
 
         # The validation time is a subset of optimizer_time
         if self.optimizer_time > 0:
             assert self.validate_time < self.optimizer_time
 
+    def summary_module_times(self, file, N=5):
+        """
+        Print the time spent getting the C modules used by the linker,
+        and the slowest modules to compile.
+
+        """
+        totals = [sum(t[i] for t in self.linker_module_times)
+                  for i in range(1, 5)]
+        print('       C modules (%d): code generation %es, cache lookup %es, '
+              'compilation %es, import %es' % (
+                  (len(self.linker_module_times),) + tuple(totals)),
+              file=file)
+        module_times = sorted(self.linker_module_times,
+                              key=lambda t: sum(t[1:]), reverse=True)[:N]
+        print('       Slowest modules to compile:', file=file)
+        print('         %9s %9s %9s %9s %9s  %s' % (
+            '<total>', '<codegen>', '<lookup>', '<compile>', '<import>',
+            '<module>'), file=file)
+        for name, code_gen, lookup, compile_time, imp in module_times:
+            total = code_gen + lookup + compile_time + imp
+            print('         %8.3fs %8.3fs %8.3fs %8.3fs %8.3fs  %s' % (
+                total, code_gen, lookup, compile_time, imp,
+                name[:max(0, self.line_width - 61)]), file=file)
+
     def summary_globals(self, file):
         print('Time in all call to theano.grad() %es' %
               theano.gradient.grad_time, file=file)
@@ -1310,6 +1468,9 @@ class ProfileStats(object):
 
     def summary(self, file=sys.stderr, n_ops_to_print=20,
                 n_apply_to_print=20):
+        ps = self.extrapolated()
+        if ps is not self:
+            return ps.summary(file, n_ops_to_print, n_apply_to_print)
         self.summary_function(file)
         self.summary_globals(file)
         local_time = sum(self.apply_time.values())
@@ -1531,3 +1692,154 @@ class ScanProfileStats(ProfileStats):
         print('  Total overhead (computing slices..) %es (%.3f%%)' % (
             self.call_time - self.vm_call_time, val), file=file)
         print('', file=file)
+
+
+_global_tracer = None
+
+
+def global_tracer():
+    """
+    Return the Tracer used by the vm linkers when the Theano flag
+    profiling.trace is set. It is saved to that file at exit.
+
+    """
+    global _global_tracer
+    if _global_tracer is None:
+        _global_tracer = Tracer()
+        atexit.register(_atexit_save_trace)
+    return _global_tracer
+
+
+def _atexit_save_trace():
+    if config.profiling.trace:
+        _global_tracer.save(config.profiling.trace)
+
+
+class Tracer(object):
+    """
+    Record when each node runs, in the Chrome trace-event format.
+
+    Give it to the vm linkers with ``VM_Linker(tracer=tracer)``, or set
+    the Theano flag profiling.trace to trace all the functions, then open
+    the saved file in chrome://tracing or https://ui.perfetto.dev.
+
+    Each run of a node is a complete event, in the row of the thread that
+    ran it, with the shapes of its inputs and the size in bytes of its
+    outputs. The results freed by the garbage collection are instant
+    events, and the "memory" counter follows the size of the results
+    allocated by the nodes and not freed yet. The nodes of the functions
+    called inside a node (e.g. the inner function of Scan) are shown
+    inside it when they use the same tracer.
+
+    Attributes
+    ----------
+    events : list of dict
+        The trace events, with times in microseconds since the creation
+        of the tracer.
+
+    """
+
+    def __init__(self):
+        self.events = []
+        self.start = time.time()
+        self.pid = os.getpid()
+        # Variable -> size of the memory its value was allocated.
+        self.allocated = {}
+        self.allocated_bytes = 0
+
+    def _ts(self, t):
+        return (t - self.start) * 1e6
+
+    def _counter(self, t):
+        self.events.append({'name': 'memory', 'ph': 'C', 'ts': self._ts(t),
+                            'pid': self.pid,
+                            'args': {'bytes': self.allocated_bytes}})
+
+    def node(self, node, thunk, t0, t1, tid=None):
+        """
+        Record that `thunk` ran `node` from time `t0` to `t1`.
+
+        The sizes are read from the storage of the thunk, so this must be
+        called before its outputs are freed.
+
+        """
+        if tid is None:
+            tid = threading.current_thread().ident
+        view_map = getattr(node.op, 'view_map', {})
+        destroy_map = getattr(node.op, 'destroy_map', {})
+        output_bytes = []
+        delta = 0
+        for i, (var, cell) in enumerate(zip(node.outputs, thunk.outputs)):
+            nbytes = _nbytes(var, cell[0])
+            output_bytes.append(nbytes)
+            if i in destroy_map:
+                # The output takes over the memory of the destroyed input.
+                nbytes = 0
+                for j in destroy_map[i]:
+                    moved = self.allocated.pop(node.inputs[j], 0)
+                    nbytes += moved
+                    delta -= moved
+            elif i in view_map:
+                nbytes = 0
+            delta += nbytes - self.allocated.get(var, 0)
+            self.allocated[var] = nbytes
+        self.events.append({
+            'name': str(node.op), 'cat': 'node', 'ph': 'X',
+            'ts': self._ts(t0), 'dur': (t1 - t0) * 1e6,
+            'pid': self.pid, 'tid': tid,
+            'args': {
+                'input_shapes': [
+                    _shape(cell[0]) for cell in thunk.inputs],
+                'output_bytes': output_bytes}})
+        if delta:
+            self.allocated_bytes += delta
+            self._counter(t1)
+
+    def free(self, var, t):
+        """
+        Record that the garbage collection freed the value of `var` at
+        time `t`.
+
+        """
+        nbytes = self.allocated.pop(var, 0)
+        self.allocated_bytes -= nbytes
+        self.events.append({
+            'name': 'free', 'cat': 'gc', 'ph': 'i', 's': 't',
+            'ts': self._ts(t), 'pid': self.pid,
+            'tid': threading.current_thread().ident,
+            'args': {'variable': str(var), 'bytes': nbytes}})
+        if nbytes:
+            self._counter(t)
+
+    def dump(self, file):
+        """
+        Write the trace in JSON to the file object `file`.
+
+        """
+        json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'},
+                  file)
+
+    def save(self, filename):
+        """
+        Write the trace in JSON to the file `filename`.
+
+        """
+        with open(filename, 'w') as f:
+            self.dump(f)
+
+
+def _shape(value):
+    shape = getattr(value, 'shape', None)
+    if shape is None:
+        return None
+    return [int(s) for s in shape]
+
+
+def _nbytes(var, value):
+    if value is None or not hasattr(var.type, 'get_shape_info'):
+        return 0
+    try:
+        return int(var.type.get_size(var.type.get_shape_info(value)))
+    except Exception:
+        # Some types can't give the size of their values.
+        return 0
@@ -384,3 +384,16 @@ class T_OpFromGraph(unittest_tools.InferShapeTester):
         f = op(y)
         grad_f = T.grad(f, y)
         assert grad_f.tag.test_value is not None
+
+    @theano.change_flags(**{'compile.inner_workers': 2})
+    def test_inner_workers(self):
+        x, y = T.vectors('xy')
+        op1 = OpFromGraph([x, y], [x + y * 2])
+        op2 = OpFromGraph([x, y], [T.exp(x) - y])
+        z = T.vector('z')
+        fn = function([z], [op1(z, z), op2(z, z)])
+        assert op1.fn.trust_input and op2.fn.trust_input
+        zv = np.arange(3).astype(config.floatX)
+        o1, o2 = fn(zv)
+        unittest_tools.assert_allclose(o1, zv * 3)
+        unittest_tools.assert_allclose(o2, np.exp(zv) - zv)
@@ -616,6 +616,214 @@ class T_function(unittest.TestCase):
 
             assert f._check_for_aliased_inputs, d
 
+    def test_fast_call(self):
+        x = T.dmatrix('x')
+        r = T.row('r', dtype='float64')
+        a = T.dscalar('a')
+        s = theano.shared(np.float64(0), name='s')
+        f = theano.function([x, r, theano.In(a, value=2.)], (x + r) * a,
+                            updates=[(s, s + 1)])
+        xv = np.ones((3, 2))
+        rv = np.arange(2.).reshape(1, 2)
+        for i in range(3):
+            assert np.allclose(f.fast_call(xv, rv, 3.), (xv + rv) * 3)
+        assert len(f._fast_call_specs) == 1
+        assert s.get_value() == 3
+        # The arrays are used as is, the scalar is filtered at each call.
+        spec = list(f._fast_call_specs.values())[0]
+        assert [bcast_axes for c, bcast_axes in spec] == [[], [0], None]
+
+        # A new signature is filtered, with the same errors as __call__.
+        assert np.allclose(f.fast_call([[1., 2.]], rv, 1), [[1., 3.]])
+        self.assertRaises(TypeError, f.fast_call, xv.astype('complex128'), rv, 1.)
+        self.assertRaises(TypeError, f.fast_call, xv.astype('int32')[0], rv, 1.)
+        # The broadcastable dimensions are still checked.
+        self.assertRaises(TypeError, f.fast_call, xv, np.ones((2, 2)), 1.)
+        assert len(f._fast_call_specs) == 2
+        assert s.get_value() == 4
+
+        # A bad argument does not run the function, even with trust_input.
+        f.trust_input = True
+        try:
+            f.fast_call(xv.astype('complex128'), rv, 1.)
+        except TypeError as e:
+            assert 'Bad input argument to theano function' in str(e)
+        else:
+            assert False
+        assert s.get_value() == 4
+        f.trust_input = False
+
+        # Incomplete arguments go through __call__.
+        assert np.allclose(f.fast_call(xv, rv), (xv + rv) * 2)
+        assert np.allclose(f(xv, rv), (xv + rv) * 2)
+
+    def test_map(self):
+        x = T.dvector('x')
+        a = T.dscalar('a')
+        s = theano.shared(np.float64(0), name='s')
+        args_list = [(np.arange(3.) + i, float(i)) for i in range(4)]
+        linkers = ['py', 'vm', 'cvm'] if theano.config.cxx else ['py', 'vm']
+        for linker in linkers:
+            s.set_value(0.)
+            f = theano.function([x, a], [x * a + s, (x + s).sum()],
+                                updates=[(s, s + 1)],
+                                mode=theano.Mode(linker=linker))
+            res = f.map(args_list)
+            assert len(res) == 4
+            # The updates are applied between the calls.
+            for i, (xv, av) in enumerate(args_list):
+                assert np.allclose(res[i][0], xv * av + i)
+                assert np.allclose(res[i][1], (xv + i).sum())
+            assert s.get_value() == 4
+            # The results do not share memory.
+            assert not np.may_share_memory(res[0][0], res[1][0])
+
+            out, total = f.map(args_list, stack=True)
+            assert out.shape == (4, 3)
+            assert np.allclose(out[:, 0], [i * i + 4 + i for i in range(4)])
+            assert np.allclose(total, [res[i][1] + 12 for i in range(4)])
+            assert s.get_value() == 8
+
+            # One returned output and an update.
+            g = theano.function([x], x * 2, updates=[(s, s + 1)],
+                                mode=theano.Mode(linker=linker))
+            res = g.map([(np.arange(3.),)] * 2, stack=True)
+            assert res.shape == (2, 3)
+            assert np.allclose(res, [[0, 2, 4]] * 2)
+            assert s.get_value() == 10
+
+        # Bad arguments raise the error of __call__.
+        self.assertRaises(TypeError, f.map, [(np.ones(3), 1.), (np.ones(3),)])
+        self.assertRaises(TypeError, f.map, [(np.ones((3, 3)), 1.)])
+
+        # Borrowed outputs are copied.
+        g = theano.function([x], theano.Out(x * 2, borrow=True))
+        res = g.map([(np.ones(3),), (np.zeros(3),)], stack=True)
+        assert np.allclose(res, [[2, 2, 2], [0, 0, 0]])
+        g = theano.function([x], {'y': x * 2})
+        assert np.allclose(g.map([(np.ones(3),)], stack=True)['y'], [[2] * 3])
+
+    def test_call_async(self):
+        try:
+            import concurrent.futures  # noqa
+        except ImportError:
+            raise SkipTest("concurrent.futures not available")
+        x = T.dvector('x')
+        s = theano.shared(np.float64(0), name='s')
+        f = theano.function([x], theano.Out(x + s, borrow=True),
+                            updates=[(s, s + 1)])
+        futures = [f.call_async(np.ones(2) * i) for i in range(5)]
+        # The calls are done in order, and the borrowed outputs are copied.
+        for i, fut in enumerate(futures):
+            assert np.allclose(fut.result(), [2 * i, 2 * i])
+        assert s.get_value() == 5
+        assert f(np.zeros(2))[0] == 5
+
+        fut = f.call_async(np.ones(3), output_subset=[0])
+        assert np.allclose(fut.result()[0], [7, 7, 7])
+        # Errors are raised by the future.
+        fut = f.call_async(np.ones((2, 2)))
+        self.assertRaises(TypeError, fut.result)
+        assert s.get_value() == 7
+
+    def test_thread_safe(self):
+        import threading
+
+        x = T.dvector('x')
+        a = T.dscalar('a')
+        s = theano.shared(np.float64(0), name='s')
+        w = theano.shared(np.float64(3), name='w')
+        f = theano.function([x, theano.In(a, value=2.)],
+                            T.tanh(x * w) * a + T.exp(x).sum())
+        g = theano.function([x], x.sum() + s, updates=[(s, s + 1)])
+        f.thread_safe = True
+        g.thread_safe = True
+        n_modules = len(theano.gof.cc.get_module_cache().module_from_name)
+        errors = []
+
+        def run(i):
+            try:
+                xv = np.arange(5.) * i
+                for j in range(20):
+                    assert np.allclose(f(xv), np.tanh(xv * 3) * 2 +
+                                       np.exp(xv).sum())
+                    assert np.allclose(f.fast_call(xv, 1.),
+                                       np.tanh(xv * 3) + np.exp(xv).sum())
+                    g(xv)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert not errors, errors
+        # The updates were serialized.
+        assert s.get_value() == 80
+        # The threads used their own storage, with the modules already
+        # compiled.
+        assert f.input_storage[1].storage[0] == 2
+        assert f._threads[1] is None and g._threads[1] is not None
+        assert (len(theano.gof.cc.get_module_cache().module_from_name) ==
+                n_modules)
+        w.set_value(1.)
+        assert np.allclose(f(np.zeros(2)), 2 * 1)
+
+    def test_out(self):
+        x = T.dmatrix('x')
+        s = theano.shared(0.)
+        v = np.random.rand(3, 3)
+        for linker in ['cvm', 'vm', 'py']:
+            s.set_value(0.)
+            f = function([x], [T.exp(x) * 2, T.dot(x, x), x.sum()],
+                         updates=[(s, s + 1)],
+                         mode=theano.Mode(linker=linker,
+                                          optimizer='fast_run'))
+            # Computed in the buffer by an Op or copied, the outputs are
+            # written in the buffers given.
+            out = [np.empty((3, 3)), np.empty((3, 3)), None]
+            r = f(v, out=out)
+            assert r[0] is out[0] and r[1] is out[1]
+            assert np.allclose(r[0], np.exp(v) * 2)
+            assert np.allclose(r[1], np.dot(v, v))
+            assert np.allclose(r[2], v.sum())
+            # The next calls don't reuse them.
+            r2 = f(v)
+            assert r2[0] is not out[0] and r2[1] is not out[1]
+            assert np.allclose(r2[0], out[0])
+            r3 = f(v + 1, out=[None, out[1], None])
+            assert np.allclose(r3[0], np.exp(v + 1) * 2)
+            assert np.allclose(out[1], np.dot(v + 1, v + 1))
+            assert s.get_value() == 3
+
+            self.assertRaises(TypeError, f, v,
+                              out=[np.empty((3, 3), 'float32'), None, None])
+            self.assertRaises(TypeError, f, v,
+                              out=[np.empty(3), None, None])
+            self.assertRaises(ValueError, f, v, out=[None, None])
+            # Shares memory with the input.
+            self.assertRaises(ValueError, f, v, out=[v, None, None])
+            self.assertRaises(ValueError, f, v, out=[out[0], out[0], None])
+            wrong = np.empty((2, 3))
+            self.assertRaises(ValueError, f, v, out=[wrong, None, None])
+            assert wrong.shape == (2, 3)
+            # The call took effect, whatever the linker.
+            assert s.get_value() == 4
+            assert np.allclose(f(v, out=[out[0], None, None])[0],
+                               np.exp(v) * 2)
+
+        f = function([x], [x + 1, x * 2],
+                     mode=theano.Mode(linker='cvm', optimizer='fast_run'))
+        out = np.empty((3, 3))
+        r = f(v, output_subset=[1], out=[out])
+        assert r[0] is out and np.allclose(out, v * 2)
+        f = function([x], x + 1)
+        assert f(v, out=out) is out and np.allclose(out, v + 1)
+        f = function([x], {'a': x + 1, 'b': x * 2})
+        r = f(v, out={'b': out})
+        assert r['b'] is out and np.allclose(out, v * 2)
+
 
 class T_picklefunction(unittest.TestCase):
 
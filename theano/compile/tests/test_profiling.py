@@ -1,14 +1,16 @@
 # Test of memory profiling
 from __future__ import absolute_import, print_function, division
 
+import json
 import unittest
 
 import numpy as np
+from nose.plugins.skip import SkipTest
 
 import theano
 from six.moves import StringIO
 import theano.tensor as T
-from theano.ifelse import ifelse
+from theano.ifelse import ifelse, IfElse
 
 
 class Test_profiling(unittest.TestCase):
@@ -103,6 +105,120 @@ class Test_profiling(unittest.TestCase):
             theano.config.profile = config1
             theano.config.profile_memory = config2
 
+    def test_module_times(self):
+        if not theano.config.cxx:
+            raise SkipTest("G++ not available, so we need to skip this test.")
+        x = T.dvector('x')
+        p = theano.ProfileStats(False, gpu_checks=False)
+        f = theano.function([x], T.exp(x) * 3, profile=p,
+                            mode=theano.Mode(optimizer=None, linker='cvm'))
+        # One module per node: exp, mul and the DimShuffle of 3.
+        assert len(p.linker_module_times) == 3
+        for name, code_gen, lookup, compile_time, imp in p.linker_module_times:
+            assert min(code_gen, lookup, compile_time, imp) >= 0
+        assert not theano.gof.cmodule.module_time_listeners
+
+        buf = StringIO()
+        f.profile.summary_function(buf)
+        assert "Slowest modules to compile" in buf.getvalue()
+
+    def test_sampling(self):
+        x = T.dvector('x')
+        exports = []
+        p = theano.ProfileStats(False, gpu_checks=False, sample_every=4,
+                                export_to=exports.append)
+        p.ignore_first_call = False
+        p.export_every = 0
+        f = theano.function([x], T.exp(x) * 3, profile=p)
+        for i in range(10):
+            f(np.ones(3))
+        # Calls 0, 4 and 8 are timed.
+        assert p.fct_callcount == 10
+        assert p.sampled_callcount == 3
+        assert all(c == 3 for c in p.apply_callcount.values())
+        ps = p.extrapolated()
+        assert all(c == 10 for c in ps.apply_callcount.values())
+        for node, t in p.apply_time.items():
+            assert np.allclose(ps.apply_time[node], t * 10 / 3.)
+
+        assert len(exports) == 10
+        stats = exports[-1]
+        assert stats['fct_callcount'] == 10
+        assert stats['sampled_callcount'] == 3
+        assert len(stats['applies']) == len(f.maker.fgraph.apply_nodes)
+        assert all(a['callcount'] == 10 for a in stats['applies'])
+        assert json.loads(json.dumps(stats)) == stats
+
+        buf = StringIO()
+        p.summary(buf)
+        assert "extrapolated" in buf.getvalue()
+
+        p = theano.ProfileStats(False, gpu_checks=False,
+                                sample_fraction=0.5)
+        n_sampled = sum(p.sample_call() for i in range(1000))
+        assert 350 < n_sampled < 650
+
+    def test_sampling_lazy(self):
+        # The Stack VM must only count the sampled calls.
+        x = T.dvector('x')
+        p = theano.ProfileStats(False, gpu_checks=False, sample_every=4)
+        p.ignore_first_call = False
+        f = theano.function([x], ifelse(x.sum() > 0, T.exp(x), T.log(x)) * 2,
+                            profile=p,
+                            mode=theano.Mode(optimizer=None, linker='vm'))
+        assert isinstance(f.fn, theano.gof.vm.Stack)
+        for i in range(40):
+            f(np.ones(3))
+        assert p.fct_callcount == 40
+        assert p.sampled_callcount == 10
+        ps = p.extrapolated()
+        for node, c in p.apply_callcount.items():
+            if isinstance(node.op, IfElse):
+                # The lazy thunk asks for the condition, then for the
+                # branch, then computes its output.
+                assert c == 30
+            elif getattr(node.op, 'scalar_op', None) == theano.scalar.log:
+                assert c == 0
+            else:
+                assert c == 10
+            assert ps.apply_callcount[node] == c * 4
+
+    def test_tracer(self):
+        x = T.dmatrix('x')
+        y = T.tanh(T.dot(x, x) + 1).sum() + T.exp(x).sum()
+        val = np.ones((3, 4))[:, :3]
+        linkers = [dict(use_cloop=False), dict(n_threads=2)]
+        if theano.config.cxx:
+            linkers.append(dict(use_cloop=True))
+        for kwargs in linkers:
+            tracer = theano.compile.profiling.Tracer()
+            linker = theano.gof.vm.VM_Linker(allow_gc=True, tracer=tracer,
+                                             **kwargs)
+            f = theano.function([x], y, mode=theano.Mode(
+                linker=linker, optimizer='fast_run'))
+            f(val)
+            f(val)
+            nodes = f.maker.fgraph.toposort()
+            runs = [e for e in tracer.events if e['ph'] == 'X']
+            assert len(runs) == 2 * len(nodes), kwargs
+            assert (sorted(e['name'] for e in runs[:len(nodes)]) ==
+                    sorted(str(n.op) for n in nodes))
+            for e in runs:
+                assert e['dur'] >= 0
+                assert all(s in ([3, 3], [], [1, 1])
+                           for s in e['args']['input_shapes'])
+            # The Dot output is freed by the gc.
+            dot = [e for e in runs if 'Dot' in e['name']][0]
+            assert dot['args']['output_bytes'] == [3 * 3 * 8]
+            assert [e for e in tracer.events if e['ph'] == 'i']
+            assert max(e['args']['bytes'] for e in tracer.events
+                       if e['ph'] == 'C') >= 3 * 3 * 8
+
+            buf = StringIO()
+            tracer.dump(buf)
+            trace = json.loads(buf.getvalue())
+            assert len(trace['traceEvents']) == len(tracer.events)
+
 
 if __name__ == '__main__':
     unittest.main()
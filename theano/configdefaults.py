@@ -565,7 +565,7 @@ if rc == 0 and config.cxx != "":
     AddConfigVar('linker',
                  "Default linker used if the theano flags mode is Mode",
                  EnumStr('cvm', 'c|py', 'py', 'c', 'c|py_nogc',
-                         'vm', 'vm_nogc', 'cvm_nogc'),
+                         'c|py_segments', 'vm', 'vm_nogc', 'cvm_nogc'),
                  in_c_key=False)
 else:
     # g++ is not present or the user disabled it,
@@ -1000,11 +1000,13 @@ AddConfigVar(
 
 AddConfigVar(
     'cache_optimizations',
-    "WARNING: work in progress, does not work yet. "
-    "Specify if the optimization cache should be used. This cache will "
-    "any optimized graph and its optimization. Actually slow downs a lot "
-    "the first optimization, and could possibly still contains some bugs. "
-    "Use at your own risks.",
+    "Specify if the optimization cache should be used. This cache saves "
+    "the optimized graphs in the compiledir, keyed by the structure of the "
+    "graph before optimization, the optimizer, the Theano version and the "
+    "config, so that compiling the same graph again skips the optimizer. "
+    "Graphs with ops that have no stable description are not cached. "
+    "Changes to user-defined optimizations are not detected: clear the "
+    "compiledir after changing them.",
     BoolParam(False),
     in_c_key=False)
 
@@ -1181,6 +1183,30 @@ AddConfigVar('profiling.ignore_first_call',
              BoolParam(False),
              in_c_key=False)
 
+AddConfigVar('profiling.sample_every',
+             """
+             Time the thunks in only one call of each profiled function
+             out of that many, and extrapolate their statistics
+             """,
+             IntParam(1, lambda i: i > 0),
+             in_c_key=False)
+
+AddConfigVar('profiling.sample_fraction',
+             """
+             Time the thunks in only this random fraction of the calls of
+             each profiled function, and extrapolate their statistics
+             """,
+             FloatParam(1.0, lambda f: 0 < f <= 1),
+             in_c_key=False)
+
+AddConfigVar('profiling.trace',
+             """
+             If not empty, the vm linkers record when each node runs, and
+             write it at exit to this file in the Chrome trace-event format
+             """,
+             StrParam(''),
+             in_c_key=False)
+
 AddConfigVar('optdb.position_cutoff',
              'Where to stop eariler during optimization. It represent the'
              ' position of the optimizer where to stop.',
@@ -1192,6 +1218,13 @@ AddConfigVar('optdb.max_use_ratio',
              FloatParam(8),
              in_c_key=False)
 
+AddConfigVar('optdb.worklist',
+             'If True, after a first pass over the whole graph, the local '
+             'optimizers of EquilibriumOptimizer only visit the nodes that '
+             'were changed and their neighbors.',
+             BoolParam(True),
+             in_c_key=False)
+
 AddConfigVar('gcc.cxxflags',
              "Extra compiler flags for gcc",
              StrParam(""),
@@ -1238,6 +1271,61 @@ AddConfigVar('cmodule.debug',
              BoolParam(False),
              in_c_key=True)
 
+AddConfigVar('cmodule.use_index',
+             "If True, keep an index of the compiled modules in the "
+             "compiledir, so that the modules compiled by other processes "
+             "can be found without walking the whole cache directory.",
+             BoolParam(True),
+             in_c_key=False)
+
+AddConfigVar('cmodule.lazy_refresh',
+             "If True, the compiledir is not walked when the module cache "
+             "is created or at exit. A cached module is only read when "
+             "it is needed, using the module index. Expired and broken "
+             "modules are then only deleted by theano-cache cleanup and "
+             "clear. Requires cmodule.use_index.",
+             BoolParam(False),
+             in_c_key=False)
+
+AddConfigVar('cmodule.compile_jobs',
+             "Maximum number of C modules compiled at the same time when a "
+             "function is linked. If greater than 1, the C code of all the "
+             "nodes is generated first and the modules missing from the "
+             "cache are compiled concurrently. 0 means the number of CPUs.",
+             IntParam(1, lambda i: i >= 0),
+             in_c_key=False)
+
+AddConfigVar('cmodule.per_module_lock',
+             "If True, a module is compiled while holding a lock on that "
+             "module only, instead of the lock on the whole compiledir. "
+             "Processes compiling different modules then do not wait for "
+             "each other.",
+             BoolParam(False),
+             in_c_key=False)
+
+AddConfigVar('cmodule.precompiled_header',
+             "If True, the headers that most modules include first "
+             "(Python, NumPy and Theano's helpers) are precompiled once "
+             "per compiler and set of flags, in the pch directory of the "
+             "compiledir, to speed up the compilation of the modules. "
+             "Only used with g++.",
+             BoolParam(False),
+             in_c_key=False)
+
+AddConfigVar('cmodule.max_cache_size',
+             "In bytes. When the compiled modules in the compiledir take "
+             "more space than this, the least recently used ones are "
+             "deleted at exit. 0 means no limit.",
+             IntParam(0, lambda i: i >= 0),
+             in_c_key=False)
+
+AddConfigVar('cmodule.max_cache_entries',
+             "When the compiledir contains more compiled modules than "
+             "this, the least recently used ones are deleted at exit. "
+             "0 means no limit.",
+             IntParam(0, lambda i: i >= 0),
+             in_c_key=False)
+
 
 def check_mkl_openmp():
     if not theano.config.blas.check_openmp:
@@ -1589,6 +1677,32 @@ AddConfigVar('vm.lazy',
              ConfigParam('None', filter_vm_lazy),
              in_c_key=False)
 
+AddConfigVar('vm.threads',
+             "Useful only for the vm linkers. If greater than 1, the nodes "
+             "that do not depend on each other are run at the same time in "
+             "that many threads. This is not used for graphs with lazy "
+             "nodes, or when the Stack VM is needed (e.g. for callbacks).",
+             IntParam(1, lambda i: i >= 1),
+             in_c_key=False)
+
+AddConfigVar('vm.memory_planner',
+             "Useful only for the vm linkers. If True, the intermediate "
+             "results are stored in a buffer allocated once, where the "
+             "results that are not alive at the same time share memory. "
+             "This is not used for graphs with lazy nodes, or when "
+             "another VM is needed (e.g. for callbacks or vm.threads).",
+             BoolParam(False),
+             in_c_key=False)
+
+AddConfigVar('vm.incremental',
+             "Useful only for the vm linkers. If True, the results of a call "
+             "are kept, and the next calls only recompute the variables "
+             "that depend on inputs or shared variables whose value "
+             "changed. This uses the Stack VM and disables the garbage "
+             "collection of the intermediate results.",
+             BoolParam(False),
+             in_c_key=False)
+
 AddConfigVar(
     'warn.identify_1pexp_bug',
     'Warn if Theano versions prior to 7987b51 (2011-12-18) could have '
@@ -1686,6 +1800,15 @@ period for running processes.""",
                       allow_override=False),
              in_c_key=False)
 
+AddConfigVar('compile.inner_workers',
+             "Number of worker processes that optimize and link the inner "
+             "functions of the Scan and OpFromGraph nodes of a function in "
+             "parallel, when it has several of them. 1 compiles them one "
+             "after another, while linking the outer function. This has not "
+             "yet been shown to be faster.",
+             IntParam(1, lambda i: i > 0),
+             in_c_key=False)
+
 
 try:
     p_out = output_subprocess_Popen([config.cxx, '-dumpversion'])
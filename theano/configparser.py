@@ -183,7 +183,7 @@ def _config_print(thing, buf, print_doc=True):
         print("", file=buf)
 
 
-def get_config_hash():
+def get_config_hash(in_c_key_only=True):
     """
     Return a string sha256 of the current config options. In the past,
     it was md5.
@@ -191,9 +191,11 @@ def get_config_hash():
     The string should be such that we can safely assume that two different
     config setups will lead to two different strings.
 
-    We only take into account config options for which `in_c_key` is True.
+    By default, we only take into account config options for which
+    `in_c_key` is True.
     """
-    all_opts = sorted([c for c in _config_var_list if c.in_c_key],
+    all_opts = sorted([c for c in _config_var_list
+                       if c.in_c_key or not in_c_key_only],
                       key=lambda cv: cv.fullname)
     return theano.gof.utils.hash_from_code('\n'.join(
         ['%s = %s' % (cv.fullname, cv.__get__(True, None)) for cv in all_opts]))
@@ -38,7 +38,7 @@ e-mail thread "What is gof?".
 from __future__ import absolute_import, print_function, division
 
 from theano.gof.cc import \
-    CLinker, OpWiseCLinker, DualLinker, HideC
+    CLinker, OpWiseCLinker, SegmentCLinker, DualLinker, HideC
 
 from theano.gof.fg import \
     CachedConstantError, InconsistencyError, MissingInputError, FunctionGraph
@@ -112,6 +112,8 @@ typedef struct {
     PyObject * call_times;
     PyObject * call_counts;
     int do_timing;
+    PyObject * trace_thunk; // called with (node_idx, t0, t1) after each thunk
+    PyObject * trace_free; // called with (var_idx, t) before each gc free
     int need_update_inputs;
     int position_of_error; // -1 for no error, otw the index into `thunks` that failed.
 } CLazyLinker;
@@ -172,6 +174,8 @@ CLazyLinker_dealloc(PyObject* _self)
   Py_XDECREF(self->thunks);
   Py_XDECREF(self->call_times);
   Py_XDECREF(self->call_counts);
+  Py_XDECREF(self->trace_thunk);
+  Py_XDECREF(self->trace_free);
   Py_XDECREF(self->pre_call_clear);
   Py_TYPE(self)->tp_free((PyObject*)self);
 }
@@ -219,6 +223,8 @@ CLazyLinker_new(PyTypeObject *type, PyObject *args, PyObject *kwds)
       self->call_times = NULL;
       self->call_counts = NULL;
       self->do_timing = 0;
+      self->trace_thunk = NULL;
+      self->trace_free = NULL;
 
       self->need_update_inputs = 0;
       self->position_of_error = -1;
@@ -477,18 +483,31 @@ static void set_position_of_error(CLazyLinker * self, int owner_idx)
       self->position_of_error = owner_idx;
     }
 }
+static int is_tracing(PyObject * trace)
+{
+  return trace != NULL && trace != Py_None;
+}
+static int call_trace_thunk(CLazyLinker * self, Py_ssize_t node_idx,
+                            double t0, double t1)
+{
+  PyObject * r = PyObject_CallFunction(self->trace_thunk, (char*)"ndd",
+                                       node_idx, t0, t1);
+  if (!r) return -1;
+  Py_DECREF(r);
+  return 0;
+}
 static PyObject * pycall(CLazyLinker * self, Py_ssize_t node_idx, int verbose)
 {
   // call thunk to see which inputs it wants
   PyObject * thunk = PyList_GetItem(self->thunks, node_idx);
   // refcounting - thunk is borrowed
   PyObject * rval = NULL;
-  if (self->do_timing)
+  if (self->do_timing || is_tracing(self->trace_thunk))
     {
       double t0 = pytime(NULL);
       if (verbose) fprintf(stderr, "calling via Python (node %i)\n", (int)node_idx);
       rval = PyObject_CallObject(thunk, NULL);
-      if (rval)
+      if (rval && self->do_timing)
         {
           double t1 = pytime(NULL);
           double ti = PyFloat_AsDouble(
@@ -500,6 +519,14 @@ static PyObject * pycall(CLazyLinker * self, Py_ssize_t node_idx, int verbose)
           PyList_SetItem(self->call_counts, node_idx,
                          PyInt_FromLong(icount + 1));
       }
+      if (rval && is_tracing(self->trace_thunk))
+        {
+          if (call_trace_thunk(self, node_idx, t0, pytime(NULL)))
+            {
+              Py_DECREF(rval);
+              rval = NULL;
+            }
+        }
     }
   else
     {
@@ -517,9 +544,10 @@ static int c_call(CLazyLinker * self, Py_ssize_t node_idx, int verbose)
   int (*fn)(void*) = (int (*)(void*))(ptr_addr);
   if (verbose) fprintf(stderr, "calling non-lazy shortcut (node %i)\n", (int)node_idx);
   int err = 0;
+  double t0 = 0;
   if (self->do_timing)
     {
-      double t0 = pytime(NULL);
+      t0 = pytime(NULL);
       err = fn(self->thunk_cptr_data[node_idx]);
       double t1 = pytime(NULL);
       double ti = PyFloat_AsDouble(PyList_GetItem(self->call_times, node_idx));
@@ -528,6 +556,11 @@ static int c_call(CLazyLinker * self, Py_ssize_t node_idx, int verbose)
       long icount = PyInt_AsLong(count);
       PyList_SetItem(self->call_counts, node_idx, PyInt_FromLong(icount+1));
     }
+  else if (is_tracing(self->trace_thunk))
+    {
+      t0 = pytime(NULL);
+      err = fn(self->thunk_cptr_data[node_idx]);
+    }
   else
     {
       err = fn(self->thunk_cptr_data[node_idx]);
@@ -550,6 +583,8 @@ static int c_call(CLazyLinker * self, Py_ssize_t node_idx, int verbose)
       PyErr_Restore(err_type, err_msg, err_trace); //steals refs to args
     }
   if (err) set_position_of_error(self, node_idx);
+  else if (is_tracing(self->trace_thunk))
+    err = call_trace_thunk(self, node_idx, t0, pytime(NULL));
   return err;
 }
 static
@@ -768,6 +803,17 @@ int lazy_rec_eval(CLazyLinker * self, Py_ssize_t var_idx, PyObject*one, PyObject
             }
           if (!cleanup) continue;
 
+          if (is_tracing(self->trace_free))
+            {
+              PyObject * r = PyObject_CallFunction(
+                  self->trace_free, (char*)"nd", i_idx, pytime(NULL));
+              if (!r)
+                {
+                  err = 1;
+                  goto fail;
+                }
+              Py_DECREF(r);
+            }
           Py_INCREF(Py_None);
           err = PyList_SetItem(self->var_value_cells[i_idx], 0, Py_None);
 //See the Stack gc implementation for why we change it to 2 and not 0.
@@ -792,16 +838,40 @@ CLazyLinker_call(PyObject *_self, PyObject *args, PyObject *kwds)
     (char *)"time_thunks",
     (char *)"n_calls",
     (char *)"output_subset",
+    (char *)"input_cells",
+    (char *)"inputs_seq",
     NULL};
   int n_calls=1;
   PyObject *output_subset_ptr = NULL;
-  if (! PyArg_ParseTupleAndKeywords(args, kwds, "|iiO", kwlist,
+  // When inputs_seq is given, the graph is run once for each of its
+  // elements, a sequence of values to put in the input_cells first, and
+  // the list of the outputs of all the runs is returned.
+  PyObject *input_cells = NULL;
+  PyObject *inputs_seq = NULL;
+  PyObject *results = NULL;
+  if (! PyArg_ParseTupleAndKeywords(args, kwds, "|iiOOO", kwlist,
                                     &self->do_timing,
                                     &n_calls,
-                                    &output_subset_ptr))
+                                    &output_subset_ptr,
+                                    &input_cells,
+                                    &inputs_seq))
     return NULL;
 
   int err = 0;
+  if (inputs_seq != NULL)
+    {
+      if (input_cells == NULL || !PyList_Check(input_cells) ||
+          !PyList_Check(inputs_seq))
+        {
+          PyErr_SetString(PyExc_TypeError,
+                          "inputs_seq and input_cells must be lists");
+          return NULL;
+        }
+      n_calls = PyList_Size(inputs_seq);
+      results = PyList_New(0);
+      if (!results)
+        return NULL;
+    }
   // parse an output_subset list
   // it is stored as a bool list of length n_output_vars: calculate a var or not
   char *output_subset = NULL;
@@ -841,6 +911,33 @@ CLazyLinker_call(PyObject *_self, PyObject *args, PyObject *kwds)
   //clear storage of pre_call_clear elements
   for (int call_i = 0; call_i < n_calls && (!err); ++call_i)
     {
+      if (inputs_seq != NULL)
+        {
+          PyObject * values = PyList_GetItem(inputs_seq, call_i);
+          Py_ssize_t n_cells = PyList_Size(input_cells);
+          if (!PySequence_Check(values) ||
+              PySequence_Size(values) != n_cells)
+            {
+              err = 1;
+              PyErr_SetString(PyExc_TypeError,
+                              "each element of inputs_seq must have one "
+                              "value per input cell");
+              break;
+            }
+          for (Py_ssize_t i = 0; i < n_cells && (!err); ++i)
+            {
+              PyObject * value = PySequence_GetItem(values, i);
+              if (!value)
+                {
+                  err = 1;
+                  break;
+                }
+              // PyList_SetItem steals the reference to value.
+              err = PyList_SetItem(PyList_GetItem(input_cells, i), 0, value);
+            }
+          if (err)
+            break;
+        }
       Py_ssize_t n_pre_call_clear = PyList_Size(self->pre_call_clear);
       assert(PyList_Check(self->pre_call_clear));
       for (int i = 0; i < n_pre_call_clear; ++i)
@@ -909,6 +1006,8 @@ CLazyLinker_call(PyObject *_self, PyObject *args, PyObject *kwds)
               Py_ssize_t dst = self->update_storage[i];
               PyList_SetItem(self->var_value_cells[dst], 0, tmp);
             }
+          if (results != NULL && PyList_Append(results, rval))
+            err = 1;
         }
     }
 
@@ -946,8 +1045,14 @@ CLazyLinker_call(PyObject *_self, PyObject *args, PyObject *kwds)
   if (err)
     {
       Py_DECREF(rval);
+      Py_XDECREF(results);
       return NULL;
     }
+  if (results != NULL)
+    {
+      Py_DECREF(rval);
+      return results;
+    }
   return rval;
 }
 
@@ -1001,6 +1106,10 @@ static PyMemberDef CLazyLinker_members[] = {
      (char*)"position of failed thunk"},
     {(char*)"time_thunks", T_INT, offsetof(CLazyLinker, do_timing), 0,
      (char*)"bool: nonzero means call will time thunks"},
+    {(char*)"trace_thunk", T_OBJECT, offsetof(CLazyLinker, trace_thunk), 0,
+     (char*)"if not None, called with (node_idx, t0, t1) after each thunk"},
+    {(char*)"trace_free", T_OBJECT, offsetof(CLazyLinker, trace_free), 0,
+     (char*)"if not None, called with (var_idx, t) before each gc free"},
     {(char*)"need_update_inputs", T_INT, offsetof(CLazyLinker, need_update_inputs), 0,
      (char*)"bool: nonzero means Function.__call__ must implement update mechanism"},
     {NULL}  /* Sentinel */
@@ -1054,7 +1163,7 @@ static PyTypeObject lazylinker_ext_CLazyLinkerType = {
 
 static PyObject * get_version(PyObject *dummy, PyObject *args)
 {
-  PyObject *result = PyFloat_FromDouble(0.211);
+  PyObject *result = PyFloat_FromDouble(0.213);
   return result;
 }
 
@@ -7,6 +7,7 @@ from __future__ import absolute_import, print_function, division
 
 # Python imports
 from copy import copy
+import itertools
 import os
 import sys
 import logging
@@ -17,7 +18,7 @@ import theano
 from theano import config
 from theano.compat import PY3
 from theano.compat import izip
-from six import string_types, reraise
+from six import string_types, reraise, get_unbound_function
 from six.moves import StringIO, xrange
 
 # gof imports
@@ -27,6 +28,7 @@ from theano.gof import utils
 from theano.gof import cmodule
 from theano.gof.compilelock import get_lock, release_lock
 from theano.gof.callcache import CallCache
+from theano.misc.cpucount import cpuCount
 
 
 _logger = logging.getLogger("theano.gof.cc")
@@ -673,6 +675,7 @@ class CLinker(link.Linker):
 
         failure_var = "__failure"
         id = 1
+        consumed = set(i for node in self.node_order for i in node.inputs)
 
         for variable in self.variables:
             sub = dict(failure_var=failure_var)
@@ -847,6 +850,12 @@ class CLinker(link.Linker):
             # to be merged, I suppose this won't happen...
             behavior = ("// Op class " + node.op.__class__.__name__ + "\n" +
                         behavior)
+            # Ops may use the Python object of their inputs, so the outputs
+            # used by the next nodes are synced now, and not only at the
+            # end of the run.
+            for output, osym in zip(node.outputs, osyms):
+                if output in self.outputs and output in consumed:
+                    behavior += get_c_sync(output, osym, sub)
 
             try:
                 cleanup = op.c_code_cleanup(node, name, isyms, osyms, sub)
@@ -1447,6 +1456,7 @@ class CLinker(link.Linker):
             return (isig, i in no_recycling)
 
         version = []
+        consumed = set(i for node in order for i in node.inputs)
         for node_pos, node in enumerate(order):
             if hasattr(node.op, 'c_code_cache_version_apply'):
                 version.append(node.op.c_code_cache_version_apply(node))
@@ -1458,12 +1468,18 @@ class CLinker(link.Linker):
                 version.append(o.type.c_code_cache_version())
 
             # add the signature for this node
+            out_sig = (1,  # Increment if cmodule change its handling of outputs
+                       tuple(o in no_recycling for o in node.outputs))
+            # Outputs synced before the end of the run (see code_gen).
+            early_sync = tuple(o in fgraph.outputs and o in consumed
+                               for o in node.outputs)
+            if any(early_sync):
+                out_sig += (early_sync,)
             sig.append((
                 node.op,
                 tuple((i.type, in_sig(i, node_pos, ipos))
                       for ipos, i in enumerate(node.inputs)),
-                (1,  # Increment if cmodule change its handling of outputs
-                    tuple(o in no_recycling for o in node.outputs))))
+                out_sig))
 
             if error_on_play[0]:
                 # if one of the signatures is not hashable
@@ -1508,29 +1524,51 @@ class CLinker(link.Linker):
         """
         if location is None:
             location = cmodule.dlimport_workdir(config.compiledir)
+        # We want to compute the code without the lock
+        self.get_src_code()
+        get_lock()
+        try:
+            module = self.build_cmodule(location)
+        finally:
+            release_lock()
+        return module
+
+    def build_cmodule(self, location, py_module=True):
+        """
+        Compile the source code for this linker into `location`.
+
+        Unlike `compile_cmodule`, this does not take the compilation lock,
+        so it can be called from several threads at the same time by a
+        caller that already holds it.
+
+        Parameters
+        ----------
+        location
+            A pre-existing directory where the module will be written.
+        py_module
+            If False, the shared library is compiled but not imported,
+            and None is returned.
+
+        """
         mod = self.get_dynamic_module()
         c_compiler = self.c_compiler()
         libs = self.libraries()
         preargs = self.compile_args()
-        # We want to compute the code without the lock
         src_code = mod.code()
-        get_lock()
         try:
             _logger.debug("LOCATION %s", str(location))
-            module = c_compiler.compile_str(
+            return c_compiler.compile_str(
                 module_name=mod.code_hash,
                 src_code=src_code,
                 location=location,
                 include_dirs=self.header_dirs(),
                 lib_dirs=self.lib_dirs(),
                 libs=libs,
-                preargs=preargs)
+                preargs=preargs,
+                py_module=py_module)
         except Exception as e:
             e.args += (str(self.fgraph),)
             raise
-        finally:
-            release_lock()
-        return module
 
     def get_dynamic_module(self):
         """
@@ -1739,6 +1777,64 @@ class _CThunk(object):
             reraise(exc_type, exc_value, exc_trace)
 
 
+def _uses_c_thunk(node):
+    """
+    Return True if `Op.make_thunk` would try to use the C code of `node`.
+
+    """
+    op = node.op
+    # Ops that build their own thunks may not use their C code.
+    if (not isinstance(op, theano.gof.op.Op) or
+            get_unbound_function(type(op).make_thunk) is not
+            get_unbound_function(theano.gof.op.Op.make_thunk)):
+        return False
+    # make_c_thunk refuses to run unprepared float16 C code.
+    if (not getattr(op, '_f16_ok', False) and
+            any(getattr(v.type, 'dtype', '') == 'float16'
+                for v in node.inputs + node.outputs)):
+        return False
+    return True
+
+
+def precompile_nodes(nodes, no_recycling=(), n_jobs=None):
+    """
+    Compile in parallel the C modules that `Op.make_thunk` will need for
+    `nodes`.
+
+    This only warms the module cache: the thunks still have to be built
+    with `Op.make_thunk`, which will then find their module in the cache.
+
+    Parameters
+    ----------
+    nodes
+        Apply nodes that will be given to `Op.make_thunk`.
+    no_recycling
+        The `no_recycling` argument that will be given to `Op.make_thunk`,
+        as it is part of the module key.
+    n_jobs
+        Maximum number of compilations run at the same time. Defaults to
+        the `cmodule.compile_jobs` flag (0 means the number of CPUs).
+
+    """
+    if n_jobs is None:
+        n_jobs = config.cmodule.compile_jobs
+    if n_jobs == 0:
+        n_jobs = cpuCount()
+    if n_jobs < 2 or not config.cxx:
+        return
+    linkers = []
+    for node in nodes:
+        op = node.op
+        if not _uses_c_thunk(node):
+            continue
+        op.prepare_node(node, storage_map=None, compute_map=None, impl='c')
+        lnk = op.make_c_linker(node, no_recycling)
+        for lnk_node in lnk.node_order:
+            lnk_node.op.prepare_node(lnk_node, None, None, 'c')
+        linkers.append(lnk)
+    get_module_cache().precompile(linkers, n_jobs)
+
+
 class OpWiseCLinker(link.LocalLinker):
     """
     Uses CLinker on the individual Ops that comprise an fgraph and loops
@@ -1823,6 +1919,8 @@ class OpWiseCLinker(link.LocalLinker):
             for k in storage_map:
                 compute_map[k] = [k.owner is None]
 
+            precompile_nodes(order, no_recycling)
+
             thunks = []
             for node in order:
                 # make_thunk will try by default C code, otherwise
@@ -1871,6 +1969,187 @@ class OpWiseCLinker(link.LocalLinker):
                 order)
 
 
+class SegmentCLinker(OpWiseCLinker):
+    """
+    Like OpWiseCLinker, but uses CLinker on each run of consecutive
+    nodes that have C code, so that a whole segment of the fgraph is
+    compiled into a single module.
+
+    A function then loads one shared library and calls one thunk per
+    segment instead of one per node. As for CLinker, the modules are
+    cached by the structural key of the segment, so they are reused by
+    the functions that share it. Nodes without C code are run by their
+    own thunk, as with OpWiseCLinker. If the C code of a segment can't be
+    generated, it is split around the nodes that cause the problem.
+
+    """
+
+    def make_all(self, profiler=None, input_storage=None, output_storage=None,
+                 storage_map=None):
+        orig_n_lock = getattr(get_lock, "n_lock", 0)
+        try:
+            fgraph = self.fgraph
+            order = self.schedule(fgraph)
+            no_recycling = self.no_recycling
+
+            input_storage, output_storage, storage_map = link.map_storage(
+                fgraph, order, input_storage, output_storage, storage_map)
+            compute_map = {}
+            for k in storage_map:
+                compute_map[k] = [k.owner is None]
+
+            groups = []
+            for has_c_code, nodes in itertools.groupby(order,
+                                                       _has_c_code):
+                nodes = list(nodes)
+                if has_c_code and config.cxx:
+                    groups += self.make_segment_thunks(
+                        nodes, storage_map, compute_map, no_recycling)
+                else:
+                    groups += [(self.make_node_thunk(
+                        node, storage_map, compute_map, no_recycling),
+                        [node]) for node in nodes]
+            thunks = [thunk for thunk, nodes in groups]
+            # Errors are reported on the first node of the segment.
+            thunk_order = [nodes[0] for thunk, nodes in groups]
+
+            if self.allow_gc:
+                computed, last_user = link.gc_helper(order)
+                post_thunk_old_storage = []
+                for thunk, nodes in groups:
+                    post_thunk_old_storage.append(
+                        [storage_map[input]
+                         for node in nodes for input in node.inputs
+                         if ((input in computed) and
+                             (input not in fgraph.outputs) and
+                             node == last_user[input])])
+            else:
+                post_thunk_old_storage = None
+
+            if no_recycling is True:
+                no_recycling = list(storage_map.values())
+                no_recycling = utils.difference(no_recycling, input_storage)
+            else:
+                no_recycling = [storage_map[r]
+                                for r in no_recycling if r not in fgraph.inputs]
+
+            f = link.streamline(fgraph, thunks, thunk_order,
+                                post_thunk_old_storage,
+                                no_recycling=no_recycling,
+                                nice_errors=self.nice_errors)
+
+            f.allow_gc = self.allow_gc
+
+        finally:
+            # Release lock on compilation directory.
+            if getattr(get_lock, "n_lock", 0) > orig_n_lock:
+                release_lock()
+                assert get_lock.n_lock == orig_n_lock
+
+        return (f,
+                [link.Container(input, storage)
+                 for input, storage in izip(fgraph.inputs, input_storage)],
+                [link.Container(output, storage, True)
+                 for output, storage in izip(fgraph.outputs, output_storage)],
+                thunks,
+                thunk_order)
+
+    def make_node_thunk(self, node, storage_map, compute_map, no_recycling):
+        """
+        Return the thunk of a single node, as OpWiseCLinker does.
+
+        """
+        thunk = node.op.make_thunk(node, storage_map, compute_map,
+                                   no_recycling)
+        thunk.inputs = [storage_map[v] for v in node.inputs]
+        thunk.outputs = [storage_map[v] for v in node.outputs]
+        return thunk
+
+    def make_segment_thunks(self, nodes, storage_map, compute_map,
+                            no_recycling, split=True):
+        """
+        Return a list of (thunk, nodes) pairs that run `nodes`, a run of
+        consecutive nodes that have C code.
+
+        """
+        if len(nodes) > 1:
+            thunk = self.make_segment_thunk(nodes, storage_map, no_recycling)
+            if thunk is not None:
+                return [(thunk, nodes)]
+        if len(nodes) == 1 or not split:
+            return [(self.make_node_thunk(node, storage_map, compute_map,
+                                          no_recycling), [node])
+                    for node in nodes]
+
+        # Find the nodes whose C code can't be generated.
+        def generates_c_code(node):
+            try:
+                node.op.prepare_node(node, None, None, 'c')
+                node.op.make_c_linker(node, no_recycling).get_src_code()
+                return True
+            except (utils.MethodNotDefined, NotImplementedError):
+                return False
+
+        rval = []
+        for has_c_code, sub_nodes in itertools.groupby(nodes,
+                                                       generates_c_code):
+            sub_nodes = list(sub_nodes)
+            if has_c_code:
+                rval += self.make_segment_thunks(
+                    sub_nodes, storage_map, compute_map, no_recycling,
+                    split=False)
+            else:
+                rval += [(self.make_node_thunk(node, storage_map,
+                                               compute_map, no_recycling),
+                          [node]) for node in sub_nodes]
+        return rval
+
+    def make_segment_thunk(self, nodes, storage_map, no_recycling):
+        """
+        Return a thunk running `nodes` with a single CLinker module, or
+        None if their C code can't be generated.
+
+        """
+        # All the variables computed by the segment are outputs of its
+        # fgraph, as the C code of some Ops needs the Python object of
+        # their inputs, which CLinker does not provide for temporaries.
+        outputs = [o for node in nodes for o in node.outputs]
+        computed = set(outputs)
+        inputs = utils.uniq([i for node in nodes for i in node.inputs
+                             if i not in computed])
+        equiv = graph.clone_get_equiv(inputs, outputs)
+        e = theano.gof.fg.FunctionGraph([equiv[v] for v in inputs],
+                                        [equiv[v] for v in outputs],
+                                        clone=False)
+        e_no_recycling = [new_o
+                          for (new_o, old_o) in zip(e.outputs, outputs)
+                          if old_o in no_recycling]
+        # The segment has no DestroyHandler, so we must keep the order
+        # of the fgraph for the inplace operations to be correct.
+        order = [equiv[node] for node in nodes]
+        cl = CLinker(schedule=lambda fgraph: order).accept(
+            e, no_recycling=e_no_recycling)
+        try:
+            thunk, _, _ = cl.make_thunk(
+                input_storage=[storage_map[v] for v in inputs],
+                output_storage=[storage_map[v] for v in outputs])
+        except (utils.MethodNotDefined, NotImplementedError):
+            return None
+        thunk.inputs = [storage_map[v] for v in inputs]
+        thunk.outputs = [storage_map[v] for v in outputs]
+        return thunk
+
+
+def _has_c_code(node):
+    """
+    Return True if `node` is run by the C code that its Op defines.
+
+    """
+    return (_uses_c_thunk(node) and
+            get_unbound_function(type(node.op).c_code) is not
+            get_unbound_function(theano.gof.op.CLinkerOp.c_code))
+
+
 def _default_checker(x, y):
     """
     Default checker for DualLinker. This checks that the
@@ -15,10 +15,12 @@ import stat
 import subprocess
 import sys
 import tempfile
+import threading
 import time
 import platform
 import distutils.sysconfig
 import warnings
+from multiprocessing.pool import ThreadPool
 
 import numpy.distutils
 
@@ -26,7 +28,7 @@ import theano
 from theano.compat import PY3, decode, decode_iter
 from six import b, BytesIO, StringIO, string_types, iteritems
 from six.moves import xrange
-from theano.gof.utils import flatten
+from theano.gof.utils import flatten, uniq, MethodNotDefined
 from theano import config
 from theano.gof.utils import hash_from_code
 from theano.misc.windows import (subprocess_Popen,
@@ -48,6 +50,36 @@ METH_VARARGS = "METH_VARARGS"
 METH_NOARGS = "METH_NOARGS"
 # global variable that represent the total time spent in importing module.
 import_time = 0
+# Lists to which ModuleCache.module_from_key() appends a tuple
+# (module description, code generation time, cache lookup time,
+# compilation time, import time) for each module it returns. The
+# FunctionMaker registers one while it links a profiled function.
+module_time_listeners = []
+
+
+def module_description(lnk):
+    """
+    Return a short description of the module compiled by `lnk`, for
+    profiling.
+
+    """
+    fgraph = getattr(lnk, 'fgraph', None)
+    if fgraph is None:
+        return str(lnk)
+    return ', '.join(str(node.op) for node in fgraph.toposort())
+
+
+def record_module_time(lnk, code_gen_time, lookup_time, compile_time,
+                       module_import_time):
+    """
+    Append the timings of the module of `lnk` to the registered listeners.
+
+    """
+    if module_time_listeners:
+        rval = (module_description(lnk), code_gen_time, lookup_time,
+                compile_time, module_import_time)
+        for times in module_time_listeners:
+            times.append(rval)
 
 
 class MissingGXX(Exception):
@@ -588,6 +620,195 @@ class KeyData(object):
                     pass
 
 
+def get_key_digest(key):
+    """
+    Return a hash of the pickled `key`, or None if it can't be pickled.
+
+    Equal digests are only a hint that two keys are equal: the keys found
+    through the index are always compared to the requested one.
+
+    """
+    try:
+        # The pickle depends on which objects are shared inside the key,
+        # so we hash the pickle of an unpickled copy, as it shares the same
+        # objects as the keys loaded from key.pkl files.
+        pkl = pickle.dumps(key, protocol=2)
+        pkl = pickle.dumps(pickle.loads(pkl), protocol=2)
+        return hash_from_code(pkl)
+    except Exception:
+        return None
+
+
+class ModuleIndex(object):
+    """
+    Persistent index of the modules stored in a compilation directory.
+
+    The index is a text file with one line per (module hash, key) pair,
+    giving the cache subdirectory that contains the module. Lines are only
+    appended (while holding the compilation lock), so readers can load the
+    index without the lock, and only need to parse the lines added since
+    their last read.
+
+    Entries may be stale (the directory may have been deleted since), so
+    users of the index must check that the directory still exists.
+
+    Parameters
+    ----------
+    dirname
+        The compilation directory.
+
+    """
+
+    filename = 'module_index.txt'
+
+    def __init__(self, dirname):
+        self.dirname = dirname
+        self.path = os.path.join(dirname, self.filename)
+        self.dir_from_hash = {}
+        self.dirs_from_key_digest = {}
+        self.offset = 0
+        self.inode = None
+
+    def _clear(self):
+        self.dir_from_hash = {}
+        self.dirs_from_key_digest = {}
+        self.offset = 0
+        self.inode = None
+
+    def load(self):
+        """
+        Read the lines added to the index file since the last call.
+
+        Returns
+        -------
+        bool
+            False if the index file is missing or corrupt, in which case
+            it should be rebuilt with `rebuild`.
+
+        """
+        try:
+            with open(self.path, 'rb') as f:
+                st = os.fstat(f.fileno())
+                if st.st_ino != self.inode or st.st_size < self.offset:
+                    # The file was rebuilt (and renamed over the old one)
+                    # by another process.
+                    self._clear()
+                    self.inode = st.st_ino
+                f.seek(self.offset)
+                data = f.read()
+        except IOError:
+            self._clear()
+            return False
+        # Only consider complete lines, another process may be in the
+        # middle of appending one.
+        end = data.rfind(b'\n') + 1
+        for line in decode(data[:end]).splitlines():
+            fields = line.split('\t')
+            if (len(fields) != 3 or not fields[0] or
+                    not fields[2].startswith('tmp') or
+                    os.sep in fields[2]):
+                _logger.warning("Corrupt module index %s", self.path)
+                self._clear()
+                return False
+            module_hash, key_digest, subdir = fields
+            self.dir_from_hash[module_hash] = subdir
+            if key_digest:
+                self.dirs_from_key_digest.setdefault(
+                    key_digest, []).append(subdir)
+        self.offset += end
+        return True
+
+    def find(self, key=None, module_hash=None):
+        """
+        Return the cache directories that may contain the module for `key`
+        or `module_hash`.
+
+        """
+        subdirs = []
+        if key is not None:
+            subdirs += self.dirs_from_key_digest.get(get_key_digest(key), [])
+        if module_hash in self.dir_from_hash:
+            subdirs.append(self.dir_from_hash[module_hash])
+        return [os.path.join(self.dirname, subdir)
+                for subdir in uniq(subdirs)]
+
+    def _line(self, module_hash, key, entry):
+        return '%s\t%s\t%s\n' % (module_hash, get_key_digest(key) or '',
+                                 os.path.basename(os.path.dirname(entry)))
+
+    def add(self, module_hash, key, entry):
+        """
+        Record that `key` and `module_hash` map to the module file `entry`.
+
+        This takes the compilation lock, so that lines appended by
+        different processes are not interleaved.
+
+        """
+        line = self._line(module_hash, key, entry)
+        with compilelock.lock_ctx():
+            self._append([line])
+
+    def _append(self, lines):
+        # This must be called while holding the compilation lock.
+        try:
+            with open(self.path, 'a') as f:
+                f.writelines(lines)
+        except IOError as e:
+            _logger.warning("Could not update module index %s: %s",
+                            self.path, e)
+
+    def rebuild(self, key_datas):
+        """
+        Replace the index by one listing the given KeyData objects.
+
+        This must be called while holding the compilation lock.
+
+        """
+        lines = []
+        for key_data in key_datas:
+            entry = key_data.get_entry()
+            for key in key_data.keys:
+                if key[0]:
+                    lines.append(self._line(key_data.module_hash, key,
+                                            entry))
+        self._write(lines)
+
+    def compact(self):
+        """
+        Remove the lines of the index pointing to deleted directories.
+
+        This must be called while holding the compilation lock.
+
+        """
+        try:
+            with open(self.path) as f:
+                lines = f.readlines()
+        except IOError:
+            return
+        kept = [line for line in lines
+                if line.endswith('\n') and os.path.exists(os.path.join(
+                    self.dirname, line.rstrip('\n').split('\t')[-1],
+                    'key.pkl'))]
+        if len(kept) < len(lines):
+            self._write(kept)
+
+    def _write(self, lines):
+        # Write to a temporary file first, so that readers never see a
+        # partially written index.
+        tmp_path = '%s.%s' % (self.path, os.getpid())
+        try:
+            with open(tmp_path, 'w') as f:
+                f.writelines(lines)
+            if os.path.exists(self.path) and sys.platform == 'win32':
+                os.remove(self.path)
+            os.rename(tmp_path, self.path)
+        except (IOError, OSError) as e:
+            _logger.warning("Could not write module index %s: %s",
+                            self.path, e)
+        self._clear()
+        self.load()
+
+
 class ModuleCache(object):
     """
     Interface to the cache of dynamically compiled modules on disk.
@@ -648,6 +869,11 @@ class ModuleCache(object):
     do_refresh : bool
         If True, then the ``refresh`` method will be called
         in the constructor.
+    lazy : bool
+        If True, the cache directory is not walked: a module directory is
+        only read when its key or module hash is requested, using the
+        module index. Defaults to the ``cmodule.lazy_refresh`` flag, and
+        is ignored if the ``cmodule.use_index`` flag is False.
 
     """
 
@@ -687,8 +913,34 @@ class ModuleCache(object):
     Set of all key.pkl files that have been loaded.
 
     """
+    index = None
+    """
+    The ModuleIndex of the cache directory, or None if the
+    ``cmodule.use_index`` flag is False.
+
+    """
+    lazy = False
+    """
+    If True, the cache directory is only walked by maintenance methods
+    (`refresh`, `clear_old`, `clear`), or if the index is corrupt.
 
-    def __init__(self, dirname, check_for_broken_eq=True, do_refresh=True):
+    """
+    used_modules = None
+    """
+    If not None, a set to which module_from_key() adds the file name of
+    every module it returns.
+
+    """
+    precompiled_keys = set()
+    """
+    Keys of the modules whose time precompile() gave to the listeners in
+    `module_time_listeners`, so that module_from_key() does not record
+    them a second time.
+
+    """
+
+    def __init__(self, dirname, check_for_broken_eq=True, do_refresh=True,
+                 lazy=None):
         self.dirname = dirname
         self.module_from_name = dict(self.module_from_name)
         self.entry_from_key = dict(self.entry_from_key)
@@ -697,10 +949,24 @@ class ModuleCache(object):
         self.stats = [0, 0, 0]
         self.check_for_broken_eq = check_for_broken_eq
         self.loaded_key_pkl = set()
+        self.precompiled_keys = set()
         self.time_spent_in_check_key = 0
+        if config.cmodule.use_index:
+            self.index = ModuleIndex(dirname)
+        if lazy is None:
+            lazy = config.cmodule.lazy_refresh
+        self.lazy = lazy and self.index is not None
 
         if do_refresh:
-            self.refresh()
+            if not self.lazy:
+                self.refresh()
+            if self.index is not None and not self.index.load():
+                with compilelock.lock_ctx():
+                    # Another process may have rebuilt it in the meantime.
+                    if not self.index.load():
+                        self.refresh(cleanup=False)
+                        self.index.rebuild(
+                            self.module_hash_to_key_data.values())
 
     age_thresh_use = config.cmodule.age_thresh_use  # default 24 days
     """
@@ -719,6 +985,13 @@ class ModuleCache(object):
             _logger.debug('loading name %s', name)
             self.module_from_name[name] = dlimport(name)
             self.stats[1] += 1
+            # The access time is not always updated by the filesystem
+            # (e.g. when mounted with relatime), but clear_old and
+            # clear_lru rely on it.
+            try:
+                os.utime(name, (time.time(), os.stat(name).st_mtime))
+            except OSError:
+                pass
         else:
             _logger.debug('returning compiled module from cache %s', name)
             self.stats[0] += 1
@@ -770,17 +1043,38 @@ class ModuleCache(object):
 
         # add entries that are not in the entry_from_key dictionary
         time_now = time.time()
-        # Go through directories in alphabetical order to ensure consistent
-        # behavior.
-        try:
-            subdirs = sorted(os.listdir(self.dirname))
-        except OSError:
-            # This can happen if the dir don't exist.
-            subdirs = []
+        # The snapshot of the last walk can be used instead of looking
+        # into every directory if no module was added or removed since.
+        # We check this with the index file, which is appended to for
+        # every new module and compacted when modules are deleted.
+        index_stat = self._index_stat()
+        snapshot = None
+        if index_stat is not None:
+            snapshot = self._load_snapshot()
+            if snapshot is not None and snapshot['index_stat'] != index_stat:
+                snapshot = None
+        if snapshot is not None:
+            entries = snapshot['entries']
+            subdirs = sorted(list(entries) + snapshot['others'])
+            new_snapshot = None
+        else:
+            entries = {}
+            # Go through directories in alphabetical order to ensure
+            # consistent behavior.
+            try:
+                subdirs = sorted(os.listdir(self.dirname))
+            except OSError:
+                # This can happen if the dir don't exist.
+                subdirs = []
+            new_snapshot = None
+            if index_stat is not None and not self.loaded_key_pkl:
+                new_snapshot = dict(index_stat=index_stat, entries={},
+                                    others=[])
+        to_load = []
         files, root = None, None  # To make sure the "del" below works
         for subdirs_elem in subdirs:
-            # Never clean/remove lock_dir
-            if subdirs_elem == 'lock_dir':
+            # Never clean/remove the lock, staging and pch directories
+            if subdirs_elem in ('lock_dir', 'module_locks', 'staging', 'pch'):
                 continue
             root = os.path.join(self.dirname, subdirs_elem)
             # Don't delete the gpuarray kernel cache
@@ -789,18 +1083,34 @@ class ModuleCache(object):
             key_pkl = os.path.join(root, 'key.pkl')
             if key_pkl in self.loaded_key_pkl:
                 continue
-            if not os.path.isdir(root):
-                continue
-            files = os.listdir(root)
-            if not files:
-                rmtree_empty(root, ignore_nocleanup=True,
-                             msg="empty dir")
-                continue
-            if 'delete.me' in files:
-                rmtree(root, ignore_nocleanup=True,
-                       msg="delete.me found in dir")
-                continue
-            elif 'key.pkl' in files:
+            if subdirs_elem in entries:
+                entry_name, atime = entries[subdirs_elem]
+                entry = os.path.join(root, entry_name)
+                if (time_now - atime) >= age_thresh_use:
+                    # It may have been used since the snapshot.
+                    try:
+                        atime = last_access_time(entry)
+                    except OSError:
+                        continue
+            else:
+                if not os.path.isdir(root):
+                    continue
+                files = os.listdir(root)
+                if 'key.pkl' not in files and new_snapshot is not None:
+                    new_snapshot['others'].append(subdirs_elem)
+                if not files:
+                    rmtree_empty(root, ignore_nocleanup=True,
+                                 msg="empty dir")
+                    continue
+                if 'delete.me' in files:
+                    rmtree(root, ignore_nocleanup=True,
+                           msg="delete.me found in dir")
+                    continue
+                elif 'key.pkl' not in files:
+                    # If the compilation failed, no key.pkl is in that
+                    # directory, but a mod.* should be there.
+                    # We do nothing here.
+                    continue
                 try:
                     entry = module_name_from_dir(root, files=files)
                 except ValueError:  # there is a key but no dll!
@@ -814,159 +1124,156 @@ class ModuleCache(object):
                     rmtree(root, ignore_nocleanup=True,
                            msg="missing module file", level=logging.INFO)
                     continue
-                if (time_now - last_access_time(entry)) < age_thresh_use:
-                    _logger.debug('refresh adding %s', key_pkl)
+                atime = last_access_time(entry)
+                if new_snapshot is not None:
+                    new_snapshot['entries'][subdirs_elem] = (
+                        os.path.basename(entry), atime)
+            if (time_now - atime) < age_thresh_use:
+                to_load.append((root, key_pkl, entry))
+            else:
+                too_old_to_use.append(entry)
 
-                    def unpickle_failure():
-                        _logger.info("ModuleCache.refresh() Failed to "
-                                     "unpickle cache file %s", key_pkl)
+        # Clean up the name space to prevent bug.
+        del root, files, subdirs
 
-                    try:
-                        with open(key_pkl, 'rb') as f:
-                            key_data = pickle.load(f)
-                    except EOFError:
-                        # Happened once... not sure why (would be worth
-                        # investigating if it ever happens again).
-                        unpickle_failure()
-                        rmtree(root, ignore_nocleanup=True,
-                               msg='broken cache directory [EOF]',
-                               level=logging.WARNING)
-                        continue
-                    except Exception:
-                        unpickle_failure()
-                        if delete_if_problem:
-                            rmtree(root, ignore_nocleanup=True,
-                                   msg='broken cache directory',
-                                   level=logging.INFO)
-                        else:
-                            # This exception is often triggered by keys
-                            # that contain references to classes that have
-                            # not yet been imported (e.g. when running two
-                            # different Theano-based scripts). They are not
-                            # necessarily broken, but we cannot load them
-                            # now. They will be loaded later if needed.
-                            pass
-                        continue
+        # Reading the key.pkl files is mostly spent waiting for the disk,
+        # so we read them concurrently.
+        def load(key_pkl):
+            try:
+                with open(key_pkl, 'rb') as f:
+                    return pickle.load(f)
+            except Exception as e:
+                return e
 
-                    if not isinstance(key_data, KeyData):
-                        # This is some old cache data, that does not fit
-                        # the new cache format. It would be possible to
-                        # update it, but it is not entirely safe since we
-                        # do not know the config options that were used.
-                        # As a result, we delete it instead (which is also
-                        # simpler to implement).
-                        rmtree(root, ignore_nocleanup=True,
-                               msg=(
-                                   'invalid cache entry format -- this '
-                                   'should not happen unless your cache '
-                                   'was really old'),
-                               level=logging.WARN)
-                        continue
+        key_pkls = [key_pkl for _, key_pkl, _ in to_load]
+        if len(to_load) > 1 and self.load_threads > 1:
+            pool = ThreadPool(min(self.load_threads, len(to_load)))
+            try:
+                key_datas = pool.map(load, key_pkls)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            key_datas = [load(key_pkl) for key_pkl in key_pkls]
 
-                    # Check the path to the module stored in the KeyData
-                    # object matches the path to `entry`. There may be
-                    # a mismatch e.g. due to symlinks, or some directory
-                    # being renamed since last time cache was created.
-                    kd_entry = key_data.get_entry()
-                    if kd_entry != entry:
-                        if is_same_entry(entry, kd_entry):
-                            # Update KeyData object. Note that we also need
-                            # to update the key_pkl field, because it is
-                            # likely to be incorrect if the entry itself
-                            # was wrong.
-                            key_data.entry = entry
-                            key_data.key_pkl = key_pkl
-                        else:
-                            # This is suspicious. Better get rid of it.
-                            rmtree(root, ignore_nocleanup=True,
-                                   msg='module file path mismatch',
-                                   level=logging.INFO)
-                            continue
+        loaded = set()
+        for (root, key_pkl, entry), key_data in zip(to_load, key_datas):
+            _logger.debug('refresh adding %s', key_pkl)
 
-                    # Find unversioned keys from other processes.
-                    # TODO: check if this can happen at all
-                    to_del = [key for key in key_data.keys if not key[0]]
-                    if to_del:
-                        _logger.warning(
-                            "ModuleCache.refresh() Found unversioned "
-                            "key in cache, removing it. %s", key_pkl)
-                        # Since the version is in the module hash, all
-                        # keys should be unversioned.
-                        if len(to_del) != len(key_data.keys):
-                            _logger.warning(
-                                'Found a mix of unversioned and '
-                                'versioned keys for the same '
-                                'module %s', key_pkl)
-                        rmtree(root, ignore_nocleanup=True,
-                               msg="unversioned key(s) in cache",
-                               level=logging.INFO)
-                        continue
+            def unpickle_failure():
+                _logger.info("ModuleCache.refresh() Failed to "
+                             "unpickle cache file %s", key_pkl)
 
-                    mod_hash = key_data.module_hash
-                    if mod_hash in self.module_hash_to_key_data:
-                        # This may happen when two processes running
-                        # simultaneously compiled the same module, one
-                        # after the other. We delete one once it is old
-                        # enough (to be confident there is no other process
-                        # using it), or if `delete_if_problem` is True.
-                        # Note that it is important to walk through
-                        # directories in alphabetical order so as to make
-                        # sure all new processes only use the first one.
-                        if cleanup:
-                            age = time.time() - last_access_time(entry)
-                            if delete_if_problem or age > self.age_thresh_del:
-                                rmtree(root, ignore_nocleanup=True,
-                                       msg='duplicated module',
-                                       level=logging.DEBUG)
-                            else:
-                                _logger.debug('Found duplicated module not '
-                                              'old enough yet to be deleted '
-                                              '(age: %s): %s',
-                                              age, entry)
-                        continue
+            if isinstance(key_data, EOFError):
+                # Happened once... not sure why (would be worth
+                # investigating if it ever happens again).
+                unpickle_failure()
+                rmtree(root, ignore_nocleanup=True,
+                       msg='broken cache directory [EOF]',
+                       level=logging.WARNING)
+                continue
+            elif isinstance(key_data, Exception):
+                unpickle_failure()
+                if delete_if_problem:
+                    rmtree(root, ignore_nocleanup=True,
+                           msg='broken cache directory',
+                           level=logging.INFO)
+                else:
+                    # This exception is often triggered by keys
+                    # that contain references to classes that have
+                    # not yet been imported (e.g. when running two
+                    # different Theano-based scripts). They are not
+                    # necessarily broken, but we cannot load them
+                    # now. They will be loaded later if needed.
+                    pass
+                continue
 
-                    # Remember the map from a module's hash to the KeyData
-                    # object associated with it.
-                    self.module_hash_to_key_data[mod_hash] = key_data
-
-                    for key in key_data.keys:
-                        if key not in self.entry_from_key:
-                            self.entry_from_key[key] = entry
-                            # Assert that we have not already got this
-                            # entry somehow.
-                            assert entry not in self.module_from_name
-                            # Store safe part of versioned keys.
-                            if key[0]:
-                                self.similar_keys.setdefault(
-                                    get_safe_part(key),
-                                    []).append(key)
-                        else:
-                            dir1 = os.path.dirname(self.entry_from_key[key])
-                            dir2 = os.path.dirname(entry)
-                            _logger.warning(
-                                "The same cache key is associated to "
-                                "different modules (%s and %s). This "
-                                "is not supposed to happen! You may "
-                                "need to manually delete your cache "
-                                "directory to fix this.",
-                                dir1, dir2)
-                    # Clean up the name space to prevent bug.
-                    if key_data.keys:
-                        del key
-                    self.loaded_key_pkl.add(key_pkl)
+            if not isinstance(key_data, KeyData):
+                # This is some old cache data, that does not fit
+                # the new cache format. It would be possible to
+                # update it, but it is not entirely safe since we
+                # do not know the config options that were used.
+                # As a result, we delete it instead (which is also
+                # simpler to implement).
+                rmtree(root, ignore_nocleanup=True,
+                       msg=(
+                           'invalid cache entry format -- this '
+                           'should not happen unless your cache '
+                           'was really old'),
+                       level=logging.WARN)
+                continue
+
+            # Check the path to the module stored in the KeyData
+            # object matches the path to `entry`. There may be
+            # a mismatch e.g. due to symlinks, or some directory
+            # being renamed since last time cache was created.
+            kd_entry = key_data.get_entry()
+            if kd_entry != entry:
+                if is_same_entry(entry, kd_entry):
+                    # Update KeyData object. Note that we also need
+                    # to update the key_pkl field, because it is
+                    # likely to be incorrect if the entry itself
+                    # was wrong.
+                    key_data.entry = entry
+                    key_data.key_pkl = key_pkl
                 else:
-                    too_old_to_use.append(entry)
+                    # This is suspicious. Better get rid of it.
+                    rmtree(root, ignore_nocleanup=True,
+                           msg='module file path mismatch',
+                           level=logging.INFO)
+                    continue
+
+            # Find unversioned keys from other processes.
+            # TODO: check if this can happen at all
+            to_del = [key for key in key_data.keys if not key[0]]
+            if to_del:
+                _logger.warning(
+                    "ModuleCache.refresh() Found unversioned "
+                    "key in cache, removing it. %s", key_pkl)
+                # Since the version is in the module hash, all
+                # keys should be unversioned.
+                if len(to_del) != len(key_data.keys):
+                    _logger.warning(
+                        'Found a mix of unversioned and '
+                        'versioned keys for the same '
+                        'module %s', key_pkl)
+                rmtree(root, ignore_nocleanup=True,
+                       msg="unversioned key(s) in cache",
+                       level=logging.INFO)
+                continue
 
-            # If the compilation failed, no key.pkl is in that
-            # directory, but a mod.* should be there.
-            # We do nothing here.
+            mod_hash = key_data.module_hash
+            if mod_hash in self.module_hash_to_key_data:
+                # This may happen when two processes running
+                # simultaneously compiled the same module, one
+                # after the other. We delete one once it is old
+                # enough (to be confident there is no other process
+                # using it), or if `delete_if_problem` is True.
+                # Note that it is important to walk through
+                # directories in alphabetical order so as to make
+                # sure all new processes only use the first one.
+                if cleanup:
+                    age = time.time() - last_access_time(entry)
+                    if delete_if_problem or age > self.age_thresh_del:
+                        rmtree(root, ignore_nocleanup=True,
+                               msg='duplicated module',
+                               level=logging.DEBUG)
+                    else:
+                        _logger.debug('Found duplicated module not '
+                                      'old enough yet to be deleted '
+                                      '(age: %s): %s',
+                                      age, entry)
+                continue
 
-        # Clean up the name space to prevent bug.
-        del root, files, subdirs
+            self._register_key_data(key_data, entry, key_pkl)
+            loaded.add(mod_hash)
 
         # Remove entries that are not in the filesystem.
         items_copy = list(self.module_hash_to_key_data.items())
         for module_hash, key_data in items_copy:
+            if module_hash in loaded:
+                # We just found it.
+                continue
             entry = key_data.get_entry()
             try:
                 # Test to see that the file is [present and] readable.
@@ -1015,12 +1322,146 @@ class ModuleCache(object):
                     files = os.listdir(a[0])
                     if not files:
                         _rmtree(*a, **kw)
+                if self.index is not None:
+                    self.index.compact()
+        elif new_snapshot is not None:
+            self._save_snapshot(new_snapshot)
 
         _logger.debug('Time needed to refresh cache: %s',
                       (time.time() - start_time))
 
         return too_old_to_use
 
+    load_threads = 8
+    """
+    The number of threads used by `refresh` to read key.pkl files.
+
+    """
+
+    def _index_stat(self):
+        """
+        Return the (size, mtime, inode) of the index file, or None if
+        there is no index.
+
+        """
+        if self.index is None:
+            return None
+        try:
+            st = os.stat(self.index.path)
+        except OSError:
+            return None
+        return (st.st_size, st.st_mtime, st.st_ino)
+
+    def _snapshot_path(self):
+        return os.path.join(self.dirname, 'module_index.snapshot')
+
+    def _load_snapshot(self):
+        """
+        Return the result of the last walk of the cache directory saved
+        by `refresh`, or None if it is missing or unreadable.
+
+        """
+        try:
+            with open(self._snapshot_path(), 'rb') as f:
+                snapshot = pickle.load(f)
+        except Exception:
+            return None
+        if not isinstance(snapshot, dict) or 'index_stat' not in snapshot:
+            return None
+        return snapshot
+
+    def _save_snapshot(self, snapshot):
+        path = self._snapshot_path()
+        # Write to a temporary file first, so that readers never see a
+        # partially written snapshot.
+        tmp_path = '%s.%s' % (path, os.getpid())
+        try:
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+            if os.path.exists(path) and sys.platform == 'win32':
+                os.remove(path)
+            os.rename(tmp_path, path)
+        except (IOError, OSError) as e:
+            _logger.debug("Could not write %s: %s", path, e)
+
+    def _register_key_data(self, key_data, entry, key_pkl):
+        """
+        Make the keys of a KeyData loaded from `key_pkl` point to `entry`.
+
+        """
+        # Remember the map from a module's hash to the KeyData
+        # object associated with it.
+        self.module_hash_to_key_data[key_data.module_hash] = key_data
+
+        for key in key_data.keys:
+            if key not in self.entry_from_key:
+                self.entry_from_key[key] = entry
+                # Assert that we have not already got this
+                # entry somehow.
+                assert entry not in self.module_from_name
+                # Store safe part of versioned keys.
+                if key[0]:
+                    self.similar_keys.setdefault(
+                        get_safe_part(key),
+                        []).append(key)
+            else:
+                dir1 = os.path.dirname(self.entry_from_key[key])
+                dir2 = os.path.dirname(entry)
+                _logger.warning(
+                    "The same cache key is associated to "
+                    "different modules (%s and %s). This "
+                    "is not supposed to happen! You may "
+                    "need to manually delete your cache "
+                    "directory to fix this.",
+                    dir1, dir2)
+        self.loaded_key_pkl.add(key_pkl)
+
+    def _load_from_index(self, key=None, module_hash=None):
+        """
+        Load the cache entries that the index associates to `key` or
+        `module_hash`, without walking the whole cache directory.
+
+        This does not take the compilation lock. Entries that cannot be
+        read safely are ignored, a full `refresh` will deal with them.
+
+        Returns
+        -------
+        bool
+            True if at least one new entry was loaded.
+
+        """
+        if self.index is None:
+            return False
+        self.index.load()
+        loaded = False
+        for root in self.index.find(key=key, module_hash=module_hash):
+            key_pkl = os.path.join(root, 'key.pkl')
+            if key_pkl in self.loaded_key_pkl:
+                continue
+            try:
+                files = os.listdir(root)
+                if 'delete.me' in files or 'key.pkl' not in files:
+                    continue
+                entry = module_name_from_dir(root, files=files)
+                if (time.time() - last_access_time(entry) >=
+                        self.age_thresh_use):
+                    continue
+                with open(key_pkl, 'rb') as f:
+                    key_data = pickle.load(f)
+            except Exception:
+                # The entry is being written or removed by another
+                # process, or refers to classes we can't import yet.
+                continue
+            if (not isinstance(key_data, KeyData) or
+                    key_data.module_hash in self.module_hash_to_key_data or
+                    not all(k[0] for k in key_data.keys)):
+                continue
+            key_data.entry = entry
+            key_data.key_pkl = key_pkl
+            self._register_key_data(key_data, entry, key_pkl)
+            loaded = True
+        return loaded
+
     def _get_from_key(self, key, key_data=None):
         """
         Returns a module if the passed-in key is found in the cache
@@ -1050,7 +1491,7 @@ class ModuleCache(object):
         if module_hash in self.module_hash_to_key_data:
             key_data = self.module_hash_to_key_data[module_hash]
             module = self._get_from_key(None, key_data)
-            with compilelock.lock_ctx(keep_lock=keep_lock):
+            with self._module_lock_ctx(module_hash, keep_lock=keep_lock):
                 try:
                     key_data.add_key(key, save_pkl=bool(key[0]))
                     key_broken = False
@@ -1063,11 +1504,61 @@ class ModuleCache(object):
                 if (key[0] and not key_broken and
                         self.check_for_broken_eq):
                     self.check_key(key, key_data.key_pkl)
+                if key[0] and not key_broken and self.index is not None:
+                    self.index.add(module_hash, key, key_data.get_entry())
             self._update_mappings(key, key_data, module.__file__, check_in_keys=not key_broken)
             return module
         else:
             return None
 
+    def _module_lock_ctx(self, module_hash, keep_lock=False):
+        """
+        Return the lock to hold while the module `module_hash` is
+        compiled or its key.pkl file updated.
+
+        This is the lock on the whole compilation directory, unless the
+        ``cmodule.per_module_lock`` flag is True.
+
+        """
+        if config.cmodule.per_module_lock:
+            return compilelock.module_lock_ctx(
+                module_hash, lock_dir=os.path.join(self.dirname,
+                                                   'module_locks'))
+        return compilelock.lock_ctx(keep_lock=keep_lock)
+
+    def _build_module(self, lnk):
+        """
+        Compile the module of `lnk` without holding the compilation lock.
+
+        The module is built in the 'staging' directory, where `refresh`
+        does not look, then moved into the cache directory. It has no
+        key.pkl file yet, so other processes ignore it until
+        `_add_to_cache` publishes it.
+
+        """
+        staging = os.path.join(self.dirname, 'staging')
+        if not os.path.isdir(staging):
+            try:
+                os.makedirs(staging)
+            except OSError:
+                # Someone else was probably trying to create it at the
+                # same time.
+                assert os.path.isdir(staging)
+        tmp_location = dlimport_workdir(staging)
+        location = None
+        try:
+            lnk.build_cmodule(tmp_location, py_module=False)
+            location = os.path.join(self.dirname,
+                                    os.path.basename(tmp_location))
+            os.rename(tmp_location, location)
+            open(os.path.join(location, "__init__.py"), 'w').close()
+            module = dlimport(module_name_from_dir(location))
+        except Exception:
+            _rmtree(location or tmp_location, ignore_if_missing=True,
+                    msg='exception during compilation')
+            raise
+        return module
+
     def _update_mappings(self, key, key_data, name, check_in_keys):
         all_keys = key_data.keys
         if not all_keys:
@@ -1085,7 +1576,7 @@ class ModuleCache(object):
 
     def _add_to_cache(self, module, key, module_hash):
         """
-        This function expects the compile lock to be held.
+        This function expects the lock of `module_hash` to be held.
 
         """
         name = module.__file__
@@ -1115,6 +1606,8 @@ class ModuleCache(object):
                 key_data.save_pkl()
             if not key_broken and self.check_for_broken_eq:
                 self.check_key(key, key_pkl)
+            if not key_broken and self.index is not None:
+                self.index.add(module_hash, key, name)
             self.loaded_key_pkl.add(key_pkl)
         elif config.cmodule.warn_no_version:
             key_flat = flatten(key)
@@ -1139,24 +1632,64 @@ class ModuleCache(object):
             Usually a CLinker instance, but it can be any object that defines
             the `get_src_code()` and `compile_cmodule(location)` functions. The
             first one returns the source code of the module to load/compile and
-            the second performs the actual compilation.
+            the second performs the actual compilation. When the
+            ``cmodule.per_module_lock`` flag is True, `lnk` must define
+            `build_cmodule(location, py_module)` instead of
+            `compile_cmodule(location)`.
         keep_lock : bool
             If True, the compilation lock will not be released if taken.
 
         """
+        times = {}
+        t0 = time.time()
+        start_import_time = import_time
+        module = self._module_from_key(key, lnk, keep_lock, times)
+        if self.used_modules is not None:
+            self.used_modules.add(module.__file__)
+        if key in self.precompiled_keys:
+            # precompile() already recorded its time.
+            self.precompiled_keys.discard(key)
+        elif module_time_listeners:
+            total_time = time.time() - t0
+            module_import_time = import_time - start_import_time
+            code_gen_time = times.get('code_gen', 0.)
+            # The import is done at the end of the compilation.
+            compile_time = max(0., times.get('compile', 0.) -
+                               module_import_time)
+            record_module_time(
+                lnk, code_gen_time,
+                total_time - code_gen_time - compile_time -
+                module_import_time,
+                compile_time, module_import_time)
+        return module
+
+    def _module_from_key(self, key, lnk, keep_lock, times):
         # Is the module in the cache?
         module = self._get_from_key(key)
         if module is not None:
             return module
+        # Maybe another process compiled it since we last looked.
+        if self._load_from_index(key=key):
+            module = self._get_from_key(key)
+            if module is not None:
+                return module
 
+        t0 = time.time()
         src_code = lnk.get_src_code()
+        times['code_gen'] = time.time() - t0
         # Is the source code already in the cache?
         module_hash = get_module_hash(src_code, key)
+        if (module_hash not in self.module_hash_to_key_data and
+                self._load_from_index(module_hash=module_hash)):
+            # The loaded module may already know this key.
+            module = self._get_from_key(key)
+            if module is not None:
+                return module
         module = self._get_from_hash(module_hash, key, keep_lock=keep_lock)
         if module is not None:
             return module
 
-        with compilelock.lock_ctx(keep_lock=keep_lock):
+        with self._module_lock_ctx(module_hash, keep_lock=keep_lock):
             # 1) Maybe somebody else compiled it for us while we
             #    where waiting for the lock. Try to load it again.
             # 2) If other repo that import Theano have Theano ops defined,
@@ -1171,7 +1704,12 @@ class ModuleCache(object):
             #    compilation to skip them, but not for future
             #    compilations. So reloading the cache here
             #    compilation fixes this problem. (we could do that only once)
-            self.refresh(cleanup=False)
+            # The index gives us the modules compiled by other processes
+            # without walking the whole cache.
+            if self.index is None or not self.index.load():
+                self.refresh(cleanup=False)
+            else:
+                self._load_from_index(key=key, module_hash=module_hash)
 
             module = self._get_from_key(key)
             if module is not None:
@@ -1184,9 +1722,15 @@ class ModuleCache(object):
             hash_key = hash(key)
 
             nocleanup = False
+            location = None
+            t0 = time.time()
             try:
-                location = dlimport_workdir(self.dirname)
-                module = lnk.compile_cmodule(location)
+                if config.cmodule.per_module_lock:
+                    module = self._build_module(lnk)
+                    location = os.path.dirname(module.__file__)
+                else:
+                    location = dlimport_workdir(self.dirname)
+                    module = lnk.compile_cmodule(location)
                 name = module.__file__
                 assert name.startswith(location)
                 assert name not in self.module_from_name
@@ -1200,7 +1744,8 @@ class ModuleCache(object):
                                   config.compiledir)
                 raise
             finally:
-                if not nocleanup:
+                times['compile'] = time.time() - t0
+                if not nocleanup and location is not None:
                     _rmtree(location, ignore_if_missing=True,
                             msg='exception during compilation')
 
@@ -1214,6 +1759,112 @@ class ModuleCache(object):
         self.stats[2] += 1
         return module
 
+    def precompile(self, linkers, n_jobs):
+        """
+        Compile the modules of `linkers` that are missing from the cache,
+        running up to `n_jobs` compilations at the same time.
+
+        The source code of every linker is generated first. The missing
+        modules are then compiled concurrently while we hold the
+        compilation lock, and added to the cache so that the following
+        calls to `module_from_key` are cache hits.
+
+        Parameters
+        ----------
+        linkers
+            Objects that define `cmodule_key()`, `get_src_code()` and
+            `build_cmodule(location, py_module)` (usually CLinker instances).
+        n_jobs : int
+            Maximum number of compilations run at the same time.
+
+        Notes
+        -----
+        Compilation errors are not raised here: the module is skipped
+        and the error will be raised when `module_from_key` tries to
+        compile it again.
+
+        """
+        todo = {}
+        code_gen_times = {}
+        for lnk in linkers:
+            try:
+                key = lnk.cmodule_key()
+            except KeyError:
+                continue
+            if key is None or key in self.entry_from_key:
+                continue
+            if self._load_from_index(key=key) and key in self.entry_from_key:
+                continue
+            t0 = time.time()
+            try:
+                src_code = lnk.get_src_code()
+            except (NotImplementedError, MethodNotDefined):
+                continue
+            code_gen_times[id(lnk)] = time.time() - t0
+            module_hash = get_module_hash(src_code, key)
+            if module_hash not in self.module_hash_to_key_data:
+                self._load_from_index(module_hash=module_hash)
+            if module_hash not in self.module_hash_to_key_data:
+                todo.setdefault(module_hash, (key, lnk))
+        if len(todo) < 2:
+            # Nothing to gain, module_from_key will compile it.
+            return
+
+        with compilelock.lock_ctx():
+            # Somebody else may have compiled some of them while we
+            # were generating the code.
+            if self.index is None or not self.index.load():
+                self.refresh(cleanup=False)
+            else:
+                for module_hash, (key, lnk) in iteritems(todo):
+                    self._load_from_index(key=key, module_hash=module_hash)
+            jobs = [(module_hash, key, lnk)
+                    for module_hash, (key, lnk) in sorted(iteritems(todo))
+                    if (key not in self.entry_from_key and
+                        module_hash not in self.module_hash_to_key_data)]
+            if not jobs:
+                return
+            locations = [dlimport_workdir(self.dirname) for job in jobs]
+
+            def build(args):
+                lnk, location = args
+                t0 = time.time()
+                try:
+                    lnk.build_cmodule(location, py_module=False)
+                    return time.time() - t0
+                except Exception as e:
+                    _logger.debug('Parallel compilation failed in %s: %s',
+                                  location, e)
+                    return None
+
+            pool = ThreadPool(min(n_jobs, len(jobs)))
+            try:
+                built = pool.map(
+                    build, [(lnk, location)
+                            for (_, _, lnk), location in zip(jobs, locations)])
+            finally:
+                pool.close()
+                pool.join()
+
+            for (module_hash, key, lnk), location, compile_time in zip(
+                    jobs, locations, built):
+                if compile_time is None:
+                    _rmtree(location, ignore_if_missing=True,
+                            msg='exception during compilation')
+                    continue
+                open(os.path.join(location, "__init__.py"), 'w').close()
+                start_import_time = import_time
+                module = dlimport(module_name_from_dir(location))
+                record_module_time(lnk, code_gen_times[id(lnk)], 0.,
+                                   compile_time,
+                                   import_time - start_import_time)
+                if module_time_listeners:
+                    self.precompiled_keys.add(key)
+                self.module_from_name[module.__file__] = module
+                key_data = self._add_to_cache(module, key, module_hash)
+                self.module_hash_to_key_data[module_hash] = key_data
+                self.stats[2] += 1
+
     def check_key(self, key, key_pkl):
         """
         Perform checks to detect broken __eq__ / __hash__ implementations.
@@ -1340,6 +1991,102 @@ class ModuleCache(object):
                 assert parent.startswith(os.path.join(self.dirname, 'tmp'))
                 _rmtree(parent, msg='old cache directory', level=logging.INFO,
                         ignore_nocleanup=True)
+            if self.index is not None:
+                self.index.compact()
+
+    age_thresh_lru = 60 * 60  # 1 hour
+    """
+    Modules accessed more recently than this (in seconds) are never
+    deleted by `clear_lru`, as other processes may be using them.
+
+    """
+
+    def clear_lru(self, max_size=None, max_entries=None):
+        """Delete the least recently used modules until the cache fits
+        in the given budget.
+
+        The last access time of the module files is used to order the
+        modules, and it is shared by all processes using the cache. Modules
+        loaded by this process or accessed less than ``age_thresh_lru``
+        seconds ago are kept, even if this means the budget is exceeded.
+
+        Parameters
+        ----------
+        max_size
+            Maximum total size in bytes of the versioned modules.
+            Defaults to ``config.cmodule.max_cache_size``.
+        max_entries
+            Maximum number of versioned modules.
+            Defaults to ``config.cmodule.max_cache_entries``.
+
+        Returns
+        -------
+        int
+            The number of deleted modules.
+
+        """
+        if max_size is None:
+            max_size = config.cmodule.max_cache_size
+        if max_entries is None:
+            max_entries = config.cmodule.max_cache_entries
+        if max_size <= 0 and max_entries <= 0:
+            return 0
+
+        def over_budget():
+            return ((max_size > 0 and total_size > max_size) or
+                    (max_entries > 0 and n_entries > max_entries))
+
+        hash_from_entry = dict((key_data.get_entry(), module_hash)
+                               for module_hash, key_data in
+                               iteritems(self.module_hash_to_key_data))
+        n_deleted = 0
+        with compilelock.lock_ctx():
+            entries = []
+            for subdir in os.listdir(self.dirname):
+                if not subdir.startswith('tmp'):
+                    continue
+                root = os.path.join(self.dirname, subdir)
+                try:
+                    files = os.listdir(root)
+                    # Unversioned modules (without key.pkl) are handled by
+                    # clear_unversioned.
+                    if 'key.pkl' not in files or 'delete.me' in files:
+                        continue
+                    entry = module_name_from_dir(root, files=files)
+                    size = sum(os.path.getsize(os.path.join(root, f))
+                               for f in files)
+                    entries.append((last_access_time(entry), size, entry))
+                except (OSError, ValueError):
+                    # Broken entries are deleted by refresh().
+                    continue
+            total_size = sum(e[1] for e in entries)
+            n_entries = len(entries)
+            if not over_budget():
+                return 0
+            time_now = time.time()
+            for atime, size, entry in sorted(entries):
+                if not over_budget():
+                    break
+                if (entry in self.module_from_name or
+                        time_now - atime < self.age_thresh_lru):
+                    continue
+                module_hash = hash_from_entry.get(entry)
+                if module_hash is not None:
+                    key_data = self.module_hash_to_key_data.pop(module_hash)
+                    key_data.delete_keys_from(self.entry_from_key)
+                    self.loaded_key_pkl.discard(key_data.key_pkl)
+                _rmtree(os.path.dirname(entry), msg='least recently used',
+                        level=logging.INFO, ignore_nocleanup=True)
+                total_size -= size
+                n_entries -= 1
+                n_deleted += 1
+            if n_deleted and self.index is not None:
+                self.index.compact()
+        if over_budget():
+            _logger.info("The compilation cache %s does not fit in its "
+                         "budget, as too many modules are in use.",
+                         self.dirname)
+        return n_deleted
 
     def clear(self, unversioned_min_age=None, clear_base_files=False,
               delete_if_problem=False):
@@ -1397,7 +2144,7 @@ class ModuleCache(object):
                         _logger.warning('Could not move %s to %s',
                                         to_rename, to_delete)
 
-    def clear_unversioned(self, min_age=None):
+    def clear_unversioned(self, min_age=None, only_loaded=False):
         """Delete unversioned dynamic modules.
 
         They are deleted both from the internal dictionaries and from the
@@ -1414,6 +2161,10 @@ class ModuleCache(object):
         min_age
             Minimum age to be deleted, in seconds. Defaults to
             7-day age if not provided.
+        only_loaded : bool
+            If True, only delete the unversioned modules of this cache,
+            without looking for the ones left in the cache directory by
+            processes that crashed.
 
         """
         if min_age is None:
@@ -1458,6 +2209,9 @@ class ModuleCache(object):
         for key in self.entry_from_key:
             assert key[0]
 
+        if only_loaded:
+            return
+
         to_del = []
         time_now = time.time()
         for filename in os.listdir(self.dirname):
@@ -1518,8 +2272,13 @@ class ModuleCache(object):
 
         # Note: for clear_old(), as this happen unfrequently, we only
         # take the lock when it happen.
-        self.clear_old()
-        self.clear_unversioned()
+
+        # Note: a lazy cache leaves the walk of the cache directory to
+        # maintenance commands like "theano-cache cleanup".
+        if not self.lazy:
+            self.clear_old()
+        self.clear_unversioned(only_loaded=self.lazy)
+        self.clear_lru()
         _logger.debug('Time spent checking keys: %s',
                       self.time_spent_in_check_key)
 
@@ -1770,6 +2529,93 @@ def gcc_llvm():
 gcc_llvm.is_llvm = None
 
 
+precompiled_includes = ('<Python.h>', '<iostream>', '"theano_mod_helper.h"',
+                        '<math.h>', '<numpy/arrayobject.h>',
+                        '<numpy/arrayscalars.h>')
+"""
+The headers that most modules include first, in this order. The ones a
+module starts with are put in a precompiled header when the
+``cmodule.precompiled_header`` flag is True.
+
+"""
+
+_pch_lock = threading.Lock()
+_pch_failed = set()
+
+
+def get_precompiled_header(src_code, flags, dirname=None):
+    """
+    Return the path of a header to pass to ``-include`` when compiling
+    `src_code` with g++, or None.
+
+    The header includes the first headers of `src_code` that are in
+    `precompiled_includes`. It is precompiled the first time it is
+    needed, into a subdirectory of ``dirname/pch`` that depends on the
+    compiler version, the compilation flags and the included headers,
+    as g++ ignores a precompiled header built with different options.
+
+    Parameters
+    ----------
+    src_code : str
+        The source code of the module.
+    flags : list of str
+        The compilation flags (without the input and output files).
+    dirname
+        Defaults to the compiledir.
+
+    """
+    if dirname is None:
+        dirname = config.compiledir
+    headers = []
+    for line in src_code.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if (not line.startswith('#include') or
+                len(headers) == len(precompiled_includes) or
+                line[len('#include'):].strip() !=
+                precompiled_includes[len(headers)]):
+            break
+        headers.append(precompiled_includes[len(headers)])
+    if not headers:
+        return None
+    pch_hash = hash_from_code('\n'.join(
+        [GCC_compiler.version_str()] + list(flags) + headers))
+    location = os.path.join(dirname, 'pch', pch_hash)
+    header = os.path.join(location, 'theano_pch.h')
+    if os.path.exists(header + '.gch'):
+        return header
+    with _pch_lock:
+        if os.path.exists(header + '.gch'):
+            return header
+        if pch_hash in _pch_failed:
+            return None
+        # Other processes may build it at the same time, so we write
+        # to temporary files and rename them.
+        suffix = '.%s' % os.getpid()
+        try:
+            if not os.path.isdir(location):
+                os.makedirs(location)
+            with open(header + suffix, 'w') as f:
+                for h in headers:
+                    print('#include', h, file=f)
+            os.rename(header + suffix, header)
+            cmd = ([theano.config.cxx, '-x', 'c++-header'] + list(flags) +
+                   ['-o', header + '.gch' + suffix, header])
+            _logger.debug('Running cmd: %s', ' '.join(cmd))
+            out, err, status = output_subprocess_Popen(cmd)
+            if status:
+                raise Exception(decode(err))
+            os.rename(header + '.gch' + suffix, header + '.gch')
+        except Exception as e:
+            _logger.warning("Could not build the precompiled header %s, "
+                            "modules will be compiled without it: %s",
+                            header, e)
+            _pch_failed.add(pch_hash)
+            return None
+    return header
+
+
 class Compiler(object):
     """
     Meta compiler that offer some generic function.
@@ -2350,6 +3196,13 @@ class GCC_compiler(Compiler):
             # improved loading times on most platforms (win32 is
             # different, as usual).
             cmd.append('-fvisibility=hidden')
+        if (config.cmodule.precompiled_header and not gcc_llvm() and
+                'clang' not in theano.config.cxx):
+            header = get_precompiled_header(
+                src_code, [c for c in cmd[2:] if not c.startswith('-L')])
+            if header is not None:
+                cmd.extend(['-Winvalid-pch', '-include',
+                            '%s%s%s' % (path_wrapper, header, path_wrapper)])
         cmd.extend(['-o', '%s%s%s' % (path_wrapper, lib_filename, path_wrapper)])
         cmd.append('%s%s%s' % (path_wrapper, cppfilename, path_wrapper))
         cmd.extend(['-l%s' % l for l in libs])
@@ -3,12 +3,18 @@ import six.moves.cPickle as pickle
 import logging
 import os
 import shutil
+import tarfile
 
 import numpy as np
+import six
 
 import theano
 from six import string_types, iteritems
 from theano import config
+from theano.configdefaults import default_compiledirname
+from theano.gof import compilelock
+from theano.gof.cc import get_module_cache
+from theano.gof.cmodule import dlimport_workdir, module_name_from_dir
 from theano.gof.utils import flatten
 
 
@@ -30,6 +36,9 @@ def cleanup():
     """
     compiledir = theano.config.compiledir
     for directory in os.listdir(compiledir):
+        if not os.path.isdir(os.path.join(compiledir, directory)):
+            # e.g. the module index.
+            continue
         file = None
         try:
             try:
@@ -245,3 +254,140 @@ def basecompiledir_ls():
 
 def basecompiledir_purge():
     shutil.rmtree(config.base_compiledir)
+
+
+def export_modules(filename, archive):
+    """
+    Compile the C modules needed by a pickled function and write them,
+    with their KeyData, to a gzipped tar archive.
+
+    Parameters
+    ----------
+    filename : str
+        File containing a pickled `Function` or `FunctionGraph`. A
+        `FunctionGraph` is linked as is with the linker of the default
+        mode, without being optimized.
+    archive : str
+        Path of the archive to write, to be loaded with `import_modules`.
+
+    Returns
+    -------
+    int
+        The number of exported modules. Modules whose key is not versioned
+        cannot be reused by another process and are skipped.
+
+    """
+    cache = get_module_cache()
+    cache.used_modules = set()
+    try:
+        with open(filename, 'rb') as f:
+            obj = pickle.load(f)
+        if isinstance(obj, theano.gof.FunctionGraph):
+            linker = theano.compile.mode.get_default_mode().linker
+            linker.accept(obj).make_thunk()
+        used_modules = cache.used_modules
+    finally:
+        cache.used_modules = None
+
+    key_data_from_entry = dict(
+        (key_data.get_entry(), key_data)
+        for key_data in cache.module_hash_to_key_data.values())
+    n_exported = 0
+    with tarfile.open(archive, 'w:gz') as tar:
+        info = tarfile.TarInfo('compiledir_name')
+        name = default_compiledirname().encode('utf-8')
+        info.size = len(name)
+        tar.addfile(info, six.BytesIO(name))
+        for entry in sorted(used_modules):
+            key_data = key_data_from_entry.get(entry)
+            if key_data is None or not os.path.exists(key_data.key_pkl):
+                _logger.warning("Module %s has no versioned key, it is not "
+                                "exported.", entry)
+                continue
+            location = os.path.dirname(entry)
+            for f in sorted(os.listdir(location)):
+                if f != 'delete.me':
+                    tar.add(os.path.join(location, f),
+                            arcname='%s/%s' % (os.path.basename(location), f),
+                            recursive=False)
+            n_exported += 1
+    return n_exported
+
+
+def import_modules(archive, cache=None):
+    """
+    Add the C modules of an archive written by `export_modules` to the
+    compiledir.
+
+    The modules already present in the cache are skipped. The archive
+    must come from a machine with the same platform, Python and numpy
+    versions (see `config.compiledir_format`), a warning is printed
+    otherwise.
+
+    Parameters
+    ----------
+    archive : str
+        Path of the archive.
+    cache : ModuleCache
+        The cache in which to import the modules (default: the one of
+        `config.compiledir`).
+
+    Returns
+    -------
+    int
+        The number of imported modules.
+
+    """
+    if cache is None:
+        cache = get_module_cache()
+    n_imported = 0
+    with tarfile.open(archive, 'r:*') as tar:
+        members = {}
+        for member in tar.getmembers():
+            parts = member.name.split('/')
+            if member.name == 'compiledir_name':
+                name = tar.extractfile(member).read().decode('utf-8')
+                if name != default_compiledirname():
+                    _logger.warning(
+                        "The archive %s was exported for the compiledir "
+                        "%s, its modules may not load here (%s).",
+                        archive, name, default_compiledirname())
+            elif (len(parts) == 2 and member.isfile() and
+                    parts[0].startswith('tmp') and
+                    parts[1] not in ('', '.', '..')):
+                members.setdefault(parts[0], []).append(member)
+            else:
+                raise ValueError("Unexpected member in module archive %s: %s"
+                                 % (archive, member.name))
+
+        # The lock of the compiledir of the cache, which may not be
+        # config.compiledir.
+        with compilelock.lock_ctx(os.path.join(cache.dirname, 'lock_dir')):
+            for module_dir in sorted(members):
+                files = dict((m.name.split('/')[1], m)
+                             for m in members[module_dir])
+                if 'key.pkl' not in files:
+                    continue
+                key_data = pickle.load(tar.extractfile(files['key.pkl']))
+                # A lazy cache only knows the modules it loaded so far, look
+                # for the others in its index.
+                cache._load_from_index(module_hash=key_data.module_hash)
+                if key_data.module_hash in cache.module_hash_to_key_data:
+                    continue
+                location = dlimport_workdir(cache.dirname)
+                for f, member in iteritems(files):
+                    with open(os.path.join(location, f), 'wb') as out:
+                        shutil.copyfileobj(tar.extractfile(member), out)
+                # Make the KeyData point to its new location.
+                key_data.entry = module_name_from_dir(location)
+                key_data.key_pkl = os.path.join(location, 'key.pkl')
+                key_data.save_pkl()
+                cache._register_key_data(key_data, key_data.entry,
+                                         key_data.key_pkl)
+                if cache.index is not None:
+                    cache.index._append([
+                        cache.index._line(key_data.module_hash, key,
+                                          key_data.entry)
+                        for key in key_data.keys])
+                n_imported += 1
+    return n_imported
@@ -43,6 +43,50 @@ def lock_ctx(lock_dir=None, keep_lock=False, **kw):
         release_lock()
 
 
+# Number of times each module lock is currently held by this process.
+_module_lock_count = {}
+
+
+@contextmanager
+def module_lock_ctx(name, lock_dir=None, **kw):
+    """
+    Obtain the lock of a single module of the compilation directory.
+
+    Unlike `lock_ctx`, this only prevents other processes from working on
+    the module identified by `name` (usually its module hash), so that
+    unrelated modules can be compiled at the same time. Taking the same
+    module lock several times in a process is allowed.
+
+    Parameters
+    ----------
+    name : str
+        Identifier of the module to lock.
+    lock_dir : str
+        Directory containing the module locks (default
+        'compiledir/module_locks').
+    kw
+        Additional arguments to be forwarded to the `lock` function when
+        acquiring the lock.
+
+    """
+    if lock_dir is None:
+        lock_dir = os.path.join(config.compiledir, 'module_locks')
+    tmp_dir = os.path.join(lock_dir, name)
+    lock_is_enabled = getattr(get_lock, 'lock_is_enabled', True)
+    n_lock = _module_lock_count.get(tmp_dir, 0)
+    if lock_is_enabled and n_lock == 0:
+        lock(tmp_dir, **kw)
+    _module_lock_count[tmp_dir] = n_lock + 1
+    try:
+        yield
+    finally:
+        _module_lock_count[tmp_dir] -= 1
+        if _module_lock_count[tmp_dir] == 0:
+            del _module_lock_count[tmp_dir]
+            if lock_is_enabled:
+                Unlocker(tmp_dir).unlock(force=False)
+
+
 # We define this name with an underscore so that python shutdown
 # deletes this before non-underscore names (like os).  We need to do
 # it this way to avoid errors on shutdown.
@@ -239,7 +283,7 @@ def lock(tmp_dir, timeout=notset, min_wait=None, max_wait=None, verbosity=1):
                         msg = "process '%s'" % read_owner.split('_')[0]
                         _logger.warning("Overriding existing lock by dead %s "
                                         "(I am process '%s')", msg, my_pid)
-                    get_lock.unlocker.unlock(force=True)
+                    Unlocker(tmp_dir).unlock(force=True)
                     continue
                 if last_owner == read_owner:
                     if (timeout is not None and
@@ -252,7 +296,7 @@ def lock(tmp_dir, timeout=notset, min_wait=None, max_wait=None, verbosity=1):
                                 msg = "process '%s'" % read_owner.split('_')[0]
                             _logger.warning("Overriding existing lock by %s "
                                             "(I am process '%s')", msg, my_pid)
-                        get_lock.unlocker.unlock(force=True)
+                        Unlocker(tmp_dir).unlock(force=True)
                         continue
                 else:
                     last_owner = read_owner
@@ -182,6 +182,151 @@ def _contains_cycle(fgraph, orderings):
     return visited != len(parent_counts)
 
 
+class _IncrementalToposort(object):
+    """
+    Keep a topological order of the Apply nodes of a graph while edges are
+    added and removed (Pearce and Kelly, "A Dynamic Topological Sort
+    Algorithm for Directed Acyclic Graphs", 2006).
+
+    An edge (u, v) means that u must run before v. Adding an edge that
+    agrees with the current order is free. Otherwise, only the nodes whose
+    position is between the ones of v and u are visited, to find a cycle or
+    to reorder them. Removing an edge never changes the order.
+
+    The edges of the graph that would create a cycle are kept apart in
+    `cycle_edges` until they can be added. The extra edges given by
+    `set_orderings` are only kept if they do not create a cycle.
+
+    """
+
+    def __init__(self):
+        # Apply -> position in the order
+        self.position = {}
+        # Apply -> {Apply: number of edges}
+        self.succ = {}
+        self.pred = {}
+        # (u, v) -> number of edges
+        self.cycle_edges = {}
+        # The (u, v) edges given by set_orderings that were added.
+        self.orderings = set()
+        self.next_position = 0
+
+    def add_node(self, app):
+        # A new node has no clients yet, so it can go last.
+        self.position[app] = self.next_position
+        self.next_position += 1
+        self.succ[app] = {}
+        self.pred[app] = {}
+
+    def remove_node(self, app):
+        for u in self.pred.pop(app):
+            del self.succ[u][app]
+            self.orderings.discard((u, app))
+        for v in self.succ.pop(app):
+            del self.pred[v][app]
+            self.orderings.discard((app, v))
+        del self.position[app]
+        if self.cycle_edges:
+            for edge in list(self.cycle_edges):
+                if app in edge:
+                    del self.cycle_edges[edge]
+
+    def add_edge(self, u, v):
+        if not self._insert(u, v):
+            self.cycle_edges[(u, v)] = self.cycle_edges.get((u, v), 0) + 1
+
+    def remove_edge(self, u, v):
+        if (u, v) in self.cycle_edges:
+            self.cycle_edges[(u, v)] -= 1
+            if not self.cycle_edges[(u, v)]:
+                del self.cycle_edges[(u, v)]
+        elif u in self.succ:
+            # Else u was already pruned, with its edges.
+            self._delete(u, v)
+
+    def set_orderings(self, edges):
+        """
+        Replace the extra edges by `edges`.
+
+        Return False if one of them creates a cycle.
+
+        """
+        for u, v in self.orderings - edges:
+            self._delete(u, v)
+        self.orderings &= edges
+        for (u, v), count in list(self.cycle_edges.items()):
+            if self._insert(u, v):
+                del self.cycle_edges[(u, v)]
+                self.succ[u][v] += count - 1
+                self.pred[v][u] += count - 1
+        if self.cycle_edges:
+            return False
+        for u, v in edges - self.orderings:
+            if not self._insert(u, v):
+                return False
+            self.orderings.add((u, v))
+        return True
+
+    def _insert(self, u, v):
+        succ_u = self.succ[u]
+        if v in succ_u:
+            succ_u[v] += 1
+            self.pred[v][u] += 1
+            return True
+        if self.position[u] >= self.position[v] and not self._reorder(u, v):
+            return False
+        succ_u[v] = 1
+        self.pred[v][u] = 1
+        return True
+
+    def _delete(self, u, v):
+        succ_u = self.succ[u]
+        succ_u[v] -= 1
+        if succ_u[v]:
+            self.pred[v][u] -= 1
+        else:
+            del succ_u[v]
+            del self.pred[v][u]
+
+    def _reorder(self, u, v):
+        # Move v and the nodes it reaches before u and the nodes reaching
+        # u, using the positions they already take. Fail if v reaches u.
+        if u is v:
+            return False
+        position = self.position
+        lower = position[v]
+        upper = position[u]
+
+        forward = [v]
+        seen = set(forward)
+        stack = [v]
+        while stack:
+            for w in self.succ[stack.pop()]:
+                if w is u:
+                    return False
+                if w not in seen and position[w] < upper:
+                    seen.add(w)
+                    forward.append(w)
+                    stack.append(w)
+
+        backward = [u]
+        seen = set(backward)
+        stack = [u]
+        while stack:
+            for w in self.pred[stack.pop()]:
+                if w not in seen and position[w] > lower:
+                    seen.add(w)
+                    backward.append(w)
+                    stack.append(w)
+
+        backward.sort(key=position.__getitem__)
+        forward.sort(key=position.__getitem__)
+        nodes = backward + forward
+        for app, p in zip(nodes, sorted(position[app] for app in nodes)):
+            position[app] = p
+        return True
+
+
 def _build_droot_impact(destroy_handler):
     droot = {}   # destroyed view + nonview variables -> foundation
     impact = {}  # destroyed nonview variable -> it + all views of it
@@ -291,7 +436,7 @@ class DestroyHandler(toolbox.Bookkeeper):  # noqa
 
     It is a work in progress. The following data structures have been
     converted to use the incremental strategy:
-        <none>
+        the topological order used to detect cycles (regular algo)
 
     The following data structures remain to be converted:
         <unknown>
@@ -380,6 +525,10 @@ class DestroyHandler(toolbox.Bookkeeper):  # noqa
         # clients: how many times does an apply use a given variable
         self.clients = OrderedDict()  # variable -> apply -> ninputs
         self.stale_droot = True
+        if self.algo != 'fast':
+            # Topological order of the apply nodes with the orderings, kept
+            # up to date so that validate() does not sort the whole graph.
+            self.toposort = _IncrementalToposort()
 
         self.debug_all_apps = set()
         if self.do_imports_on_attach:
@@ -449,6 +598,8 @@ class DestroyHandler(toolbox.Bookkeeper):  # noqa
         del self.view_o
         del self.clients
         del self.stale_droot
+        if self.algo != 'fast':
+            del self.toposort
         assert self.fgraph.destroyer_handler is self
         delattr(self.fgraph, 'destroyers')
         delattr(self.fgraph, 'has_destroyers')
@@ -536,6 +687,12 @@ class DestroyHandler(toolbox.Bookkeeper):  # noqa
         for i, output in enumerate(app.outputs):
             self.clients.setdefault(output, OrderedDict())
 
+        if self.algo != 'fast':
+            self.toposort.add_node(app)
+            for input in app.inputs:
+                if input.owner is not None:
+                    self.toposort.add_edge(input.owner, app)
+
         self.stale_droot = True
 
     def on_prune(self, fgraph, app, reason):
@@ -573,6 +730,9 @@ class DestroyHandler(toolbox.Bookkeeper):  # noqa
             if not self.view_o[i]:
                 del self.view_o[i]
 
+        if self.algo != 'fast':
+            self.toposort.remove_node(app)
+
         self.stale_droot = True
         if app in self.fail_validate:
             del self.fail_validate[app]
@@ -622,6 +782,12 @@ class DestroyHandler(toolbox.Bookkeeper):  # noqa
                 if app in self.fail_validate:
                     del self.fail_validate[app]
                 self.fast_destroy(app, reason)
+            else:
+                # The owner of old_r can already be pruned.
+                if old_r.owner is not None:
+                    self.toposort.remove_edge(old_r.owner, app)
+                if new_r.owner is not None:
+                    self.toposort.add_edge(new_r.owner, app)
         self.stale_droot = True
 
     def validate(self, fgraph):
@@ -653,8 +819,16 @@ class DestroyHandler(toolbox.Bookkeeper):  # noqa
                         raise app_err_pairs[app]
             else:
                 ords = self.orderings(fgraph, ordered=False)
-                if _contains_cycle(fgraph, ords):
+                edges = set((u, app) for app, us in iteritems(ords)
+                            for u in us)
+                if not self.toposort.set_orderings(edges):
                     raise InconsistencyError("Dependency graph contains cycles")
+        elif self.algo != 'fast' and (self.toposort.orderings or
+                                      self.toposort.cycle_edges):
+            # Drop the orderings of the removed destroyers. The cycles
+            # made by the changes of the graph are known for free here.
+            if not self.toposort.set_orderings(set()):
+                raise InconsistencyError("Dependency graph contains cycles")
         else:
             # James's Conjecture:
             # If there are no destructive ops, then there can be no cycles.
@@ -823,6 +823,17 @@ class Op(utils.object2, PureOp, CLinkerOp):
         """
         pass
 
+    def make_c_linker(self, node, no_recycling):
+        """Return the CLinker used by make_c_thunk to compile `node`.
+
+        """
+        e = FunctionGraph(node.inputs, node.outputs)
+        e_no_recycling = [new_o
+                          for (new_o, old_o) in zip(e.outputs, node.outputs)
+                          if old_o in no_recycling]
+        return theano.gof.cc.CLinker().accept(e,
+                                              no_recycling=e_no_recycling)
+
     def make_c_thunk(self, node, storage_map, compute_map, no_recycling):
         """Like make_thunk, but will only try to make a C thunk.
 
@@ -830,12 +841,7 @@ class Op(utils.object2, PureOp, CLinkerOp):
         node_input_storage = [storage_map[r] for r in node.inputs]
         node_output_storage = [storage_map[r] for r in node.outputs]
 
-        e = FunctionGraph(node.inputs, node.outputs)
-        e_no_recycling = [new_o
-                          for (new_o, old_o) in zip(e.outputs, node.outputs)
-                          if old_o in no_recycling]
-        cl = theano.gof.cc.CLinker().accept(e,
-                                            no_recycling=e_no_recycling)
+        cl = self.make_c_linker(node, no_recycling)
         # float16 gets special treatment since running
         # unprepared C code will get bad results.
         if not getattr(self, '_f16_ok', False):
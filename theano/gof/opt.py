@@ -1091,6 +1091,9 @@ class LocalOptimizer(object):
         """
         Return the list of op classes that this opt applies to.
 
+        Ops and, for the ops with a `scalar_op` like Elemwise, scalar op
+        classes and scalar ops can also be given.
+
         Return None to apply to all nodes.
 
         """
@@ -1301,9 +1304,147 @@ def local_optimizer(tracks, inplace=False, requirements=()):
     return decorator
 
 
+class LocalOptDispatch(object):
+    """
+    Map the ops to the local optimizers to try on their nodes.
+
+    The candidates of an op are the local optimizers that track its type
+    or the op itself and, for the ops with a `scalar_op` like Elemwise,
+    the type of the scalar op or the scalar op itself. They are followed
+    by the local optimizers that do not track anything. The part that
+    depends on the types is computed once per type.
+
+    Use `local_opt_dispatch` to get the table of a list of local
+    optimizers, which is shared by all the optimizers built from the same
+    list, like the ones built by each query of a DB.
+
+    When profiling, `record` counts the calls of each local optimizer on
+    each type of op and how many of them were wasted, i.e. did not change
+    the graph.
+
+    Parameters
+    ----------
+    optimizers
+        The local optimizers, in the order they must be tried.
+    untracked_first : bool
+        If True, the local optimizers that do not track anything are tried
+        before the others.
+
+    """
+
+    def __init__(self, optimizers, untracked_first=False):
+        self.optimizers = tuple(optimizers)
+        self.untracked_first = untracked_first
+        self.untracked = []
+        # The optimizers tracking types, and the ones tracking instances.
+        self.type_map = defaultdict(list)
+        self.op_map = defaultdict(list)
+        for o in self.optimizers:
+            tracks = o.tracks()
+            if tracks is None:
+                self.untracked.append(o)
+            else:
+                for c in tracks:
+                    if isinstance(c, type):
+                        self.type_map[c].append(o)
+                    else:
+                        self.op_map[c].append(o)
+        self.type_cache = {}
+        self.calls = {}
+
+    def _candidates(self, tracked):
+        # An optimizer can track several keys of the same op.
+        tracked = list(OrderedSet(tracked))
+        if self.untracked_first:
+            return tuple(self.untracked + tracked)
+        return tuple(tracked + self.untracked)
+
+    def candidates(self, op):
+        """Return the local optimizers to try on the nodes of `op`."""
+        scalar_op = getattr(op, 'scalar_op', None)
+        key = (type(op), type(scalar_op))
+        cached = self.type_cache.get(key)
+        if cached is None:
+            tracked = list(self.type_map.get(type(op), []))
+            if scalar_op is not None:
+                tracked += self.type_map.get(type(scalar_op), [])
+            cached = self.type_cache[key] = (tracked,
+                                             self._candidates(tracked))
+        if self.op_map:
+            tracked = self.op_map.get(op, [])
+            if scalar_op is not None:
+                tracked = tracked + self.op_map.get(scalar_op, [])
+            if tracked:
+                return self._candidates(cached[0] + tracked)
+        return cached[1]
+
+    def record(self, opt, op, applied):
+        """Count a call of `opt` on a node of `op`."""
+        key = (opt, type(op), type(getattr(op, 'scalar_op', None)))
+        count = self.calls.get(key)
+        if count is None:
+            count = self.calls[key] = [0, 0]
+        count[0] += 1
+        if not applied:
+            count[1] += 1
+
+    def print_wasted_calls(self, stream=sys.stdout, level=0, n=20):
+        """Print the `n` optimizers and ops with the most wasted calls."""
+        wasted = []
+        for (o, op_type, scalar_op_type), (nb_calls, nb_wasted) in \
+                iteritems(self.calls):
+            if not nb_wasted:
+                continue
+            op_name = op_type.__name__
+            if scalar_op_type is not type(None):
+                op_name += '{%s}' % scalar_op_type.__name__
+            wasted.append((nb_wasted, nb_calls, str(o), op_name))
+        if not wasted:
+            return
+        wasted.sort(reverse=True)
+        blanc = ('    ' * level)
+        print(blanc, '  wasted calls (of all the graphs optimized with '
+              'these local optimizers):', file=stream)
+        print(blanc, '  wasted - calls - name - op', file=stream)
+        for (nb_wasted, nb_calls, o, op_name) in wasted[:n]:
+            print(blanc, '  %d - %d - %s - %s' % (
+                nb_wasted, nb_calls, o, op_name), file=stream)
+        if len(wasted) > n:
+            print(blanc, '  ...', file=stream)
+        print(file=stream)
+
+
+# The dispatch tables by list of local optimizers. Each query of a DB
+# builds new optimizers from the same lists, so they are kept between the
+# compilations.
+_dispatch_tables = {}
+_max_dispatch_tables = 512
+
+
+def local_opt_dispatch(optimizers, untracked_first=False):
+    """
+    Return the LocalOptDispatch of these local optimizers.
+
+    It is shared by all the calls with the same optimizers.
+
+    """
+    key = (tuple(optimizers), untracked_first)
+    table = _dispatch_tables.get(key)
+    if table is None:
+        if len(_dispatch_tables) >= _max_dispatch_tables:
+            # Lists built on the fly by user code should not grow it
+            # without limit.
+            _dispatch_tables.clear()
+        table = _dispatch_tables[key] = LocalOptDispatch(*key)
+    return table
+
+
 class LocalOptGroup(LocalOptimizer):
     """Takes a list of LocalOptimizer and applies them to the node.
 
+    Only the optimizers that track the op of the node, or that do not track
+    anything, are tried on it (see LocalOptDispatch).
+
     Parameters
     ----------
     optimizers :
@@ -1334,7 +1475,6 @@ class LocalOptGroup(LocalOptimizer):
 
         self.apply_all_opts = kwargs.pop('apply_all_opts', False)
         self.profile = kwargs.pop('profile', False)
-        self.track_map = defaultdict(lambda: [])
         assert len(kwargs) == 0
         if self.profile:
             self.time_opts = {}
@@ -1348,12 +1488,7 @@ class LocalOptGroup(LocalOptimizer):
                 self.process_count.setdefault(o, 0)
                 self.applied_true.setdefault(o, 0)
                 self.node_created.setdefault(o, 0)
-            tracks = o.tracks()
-            if tracks is None:
-                self.track_map[None].append(o)
-            else:
-                for c in tracks:
-                    self.track_map[c].append(o)
+        self.dispatch = local_opt_dispatch(self.opts)
 
     def __str__(self):
         return getattr(self, '__name__',
@@ -1374,15 +1509,15 @@ class LocalOptGroup(LocalOptimizer):
         fgraph = node.fgraph
         repl = None
         while True:
-            opts = self.track_map[type(node.op)] + self.track_map[node.op] + self.track_map[None]
             new_repl = None
-            for opt in opts:
+            for opt in self.dispatch.candidates(node.op):
                 opt_start = time.time()
                 new_repl = opt.transform(node)
                 opt_finish = time.time()
                 if self.profile:
                     self.time_opts[opt] += opt_start - opt_finish
                     self.process_count[opt] += 1
+                    self.dispatch.record(opt, node.op, new_repl)
                 if not new_repl:
                     continue
                 if isinstance(new_repl, (tuple, list)):
@@ -1480,14 +1615,14 @@ class GraphToGPULocalOptGroup(LocalOptGroup):
         if len(self.opts) == 0:
             return
         fgraph = outputs[0].fgraph
-        opts = self.track_map[type(op)] + self.track_map[op] + self.track_map[None]
-        for opt in opts:
+        for opt in self.dispatch.candidates(op):
             opt_start = time.time()
             new_repl = opt.transform(op, context_name, inputs, outputs)
             opt_finish = time.time()
             if self.profile:
                 self.time_opts[opt] += opt_start - opt_finish
                 self.process_count[opt] += 1
+                self.dispatch.record(opt, op, new_repl)
             if not new_repl:
                 continue
             if self.profile:
@@ -2129,6 +2264,8 @@ class TopoOptimizer(NavigatorOptimizer):
 
         u = self.attach_updater(fgraph, importer, None,
                                 name=getattr(self, 'name', None))
+        # Skip the nodes that no optimizer of a LocalOptGroup would try.
+        dispatch = getattr(self.local_opt, 'dispatch', None)
         nb = 0
         try:
             t0 = time.time()
@@ -2139,6 +2276,9 @@ class TopoOptimizer(NavigatorOptimizer):
                     node = q.popleft()
                 if node not in fgraph.apply_nodes:
                     continue
+                if (dispatch is not None and
+                        not dispatch.candidates(node.op)):
+                    continue
                 current_node = node
                 nb += self.process_node(fgraph, node)
             loop_t = time.time() - t0
@@ -2177,6 +2317,7 @@ class TopoOptimizer(NavigatorOptimizer):
                                             lopt.node_created,
                                             lopt.profile),
                                    level=level + 1)
+                lopt.dispatch.print_wasted_calls(stream, level=level + 1)
 
     def __str__(self):
         return getattr(self, '__name__',
@@ -2331,6 +2472,14 @@ class EquilibriumOptimizer(NavigatorOptimizer):
         They must not traverse the graph as they are called very frequently.
         The MergeOptimizer is one example of optimization that respect this.
         They are applied after all global optimizer, then when one local optimizer is applied, then after all final optimizer.
+    worklist
+        If True, the local optimizers only visit all the nodes during the
+        first iteration. Afterwards, they only visit the nodes that were
+        imported or whose inputs changed, with the owners of their inputs
+        and the clients of their outputs up to two levels. This is done
+        during the same iteration for the changes made by the local
+        optimizers and during the next one for the other changes. This
+        overrides `ignore_newtrees` and `tracks_on_change_inputs`.
 
     """
 
@@ -2341,7 +2490,8 @@ class EquilibriumOptimizer(NavigatorOptimizer):
                  tracks_on_change_inputs=False,
                  max_use_ratio=None,
                  final_optimizers=None,
-                 cleanup_optimizers=None):
+                 cleanup_optimizers=None,
+                 worklist=False):
         super(EquilibriumOptimizer, self).__init__(
             None,
             ignore_newtrees=ignore_newtrees,
@@ -2352,6 +2502,7 @@ class EquilibriumOptimizer(NavigatorOptimizer):
         self.final_optimizers = []
         self.cleanup_optimizers = []
         self.tracks_on_change_inputs = tracks_on_change_inputs
+        self.worklist = worklist
         for opt in optimizers:
             if isinstance(opt, LocalOptimizer):
                 if opt.tracks() is None:
@@ -2361,6 +2512,9 @@ class EquilibriumOptimizer(NavigatorOptimizer):
                         self.local_optimizers_map.setdefault(c, []).append(opt)
             else:
                 self.global_optimizers.append(opt)
+        self.dispatch = local_opt_dispatch(
+            [opt for opt in optimizers if isinstance(opt, LocalOptimizer)],
+            untracked_first=True)
         if final_optimizers:
             self.final_optimizers = final_optimizers
         if cleanup_optimizers:
@@ -2425,6 +2579,44 @@ class EquilibriumOptimizer(NavigatorOptimizer):
             global_process_count.setdefault(opt, 0)
             time_opts.setdefault(opt, 0)
             node_created.setdefault(opt, 0)
+        record_calls = config.profile_optimizer
+        current_node = None
+
+        # In worklist mode, the nodes to give again to the local optimizers.
+        pending = []
+        worklist_u = None
+        if self.worklist:
+            def enqueue(node):
+                if node is not None and node is not current_node:
+                    pending.append(node)
+
+            def touch(node):
+                # The optimizers of a node look at the nodes around it, and
+                # some of them at the inputs of its inputs.
+                enqueue(node)
+                for var in node.inputs:
+                    enqueue(var.owner)
+                for var in node.outputs:
+                    for client, i in var.clients:
+                        if isinstance(client, str):
+                            continue
+                        enqueue(client)
+                        for c_var in client.outputs:
+                            for c_client, j in c_var.clients:
+                                if not isinstance(c_client, str):
+                                    enqueue(c_client)
+
+            def touch_inputs(node):
+                for var in node.inputs:
+                    enqueue(var.owner)
+
+            def touch_changed(node, i, r, new_r, reason):
+                if not isinstance(node, str):
+                    touch(node)
+                enqueue(r.owner)
+            worklist_u = Updater(touch, touch_inputs, touch_changed,
+                                 name=getattr(self, 'name', None))
+            fgraph.attach_feature(worklist_u)
 
         def apply_cleanup(profs_dict):
             changed = False
@@ -2443,130 +2635,172 @@ class EquilibriumOptimizer(NavigatorOptimizer):
                     node_created[copt] += change_tracker.nb_imported - nb
             return changed
 
-        while changed and not max_use_abort:
-            process_count = {}
-            t0 = time.time()
-            changed = False
-            iter_cleanup_sub_profs = {}
-            for copt in self.cleanup_optimizers:
-                iter_cleanup_sub_profs[copt] = []
-
-            # apply global optimizers
-            sub_profs = []
-            for gopt in self.global_optimizers:
-                change_tracker.reset()
-                nb = change_tracker.nb_imported
-                t_opt = time.time()
-                sub_prof = gopt.apply(fgraph)
-                time_opts[gopt] += time.time() - t_opt
-                sub_profs.append(sub_prof)
-                if change_tracker.changed:
-                    process_count.setdefault(gopt, 0)
-                    process_count[gopt] += 1
-                    global_process_count[gopt] += 1
-                    changed = True
-                    node_created[gopt] += change_tracker.nb_imported - nb
-                    if global_process_count[gopt] > max_use:
-                        max_use_abort = True
-                        opt_name = (getattr(gopt, "name", None) or
-                                    getattr(gopt, "__name__", ""))
-            global_sub_profs.append(sub_profs)
-
-            global_opt_timing.append(float(time.time() - t0))
-
-            # apply clean up as global opt can have done changes that
-            # request that
-            changed |= apply_cleanup(iter_cleanup_sub_profs)
-
-            # apply local optimizer
-            topo_t0 = time.time()
-            q = deque(graph.io_toposort(fgraph.inputs, start_from))
-            io_toposort_timing.append(time.time() - topo_t0)
-
-            nb_nodes.append(len(q))
-            max_nb_nodes = max(max_nb_nodes, len(q))
-            max_use = max_nb_nodes * self.max_use_ratio
-
-            def importer(node):
-                if node is not current_node:
-                    q.append(node)
-
-            chin = None
-            if self.tracks_on_change_inputs:
-                def chin(node, i, r, new_r, reason):
-                    if node is not current_node and not isinstance(node, str):
-                        q.append(node)
-            u = self.attach_updater(fgraph, importer, None,
-                                    chin=chin,
-                                    name=getattr(self, 'name', None))
-            try:
-                while q:
-                    node = q.pop()
-                    if node not in fgraph.apply_nodes:
-                        continue
-                    current_node = node
-                    for lopt in (self.local_optimizers_all +
-                                 self.local_optimizers_map.get(type(node.op), []) +
-                                 self.local_optimizers_map.get(node.op, [])):
-                        nb = change_tracker.nb_imported
-                        t_opt = time.time()
-                        lopt_change = self.process_node(fgraph, node, lopt)
-                        time_opts[lopt] += time.time() - t_opt
-                        if not lopt_change:
-                            continue
-                        process_count.setdefault(lopt, 0)
-                        process_count[lopt] += 1
-                        global_process_count[lopt] += 1
+        try:
+            while changed and not max_use_abort:
+                process_count = {}
+                t0 = time.time()
+                changed = False
+                iter_cleanup_sub_profs = {}
+                for copt in self.cleanup_optimizers:
+                    iter_cleanup_sub_profs[copt] = []
+
+                # apply global optimizers
+                sub_profs = []
+                for gopt in self.global_optimizers:
+                    change_tracker.reset()
+                    nb = change_tracker.nb_imported
+                    t_opt = time.time()
+                    sub_prof = gopt.apply(fgraph)
+                    time_opts[gopt] += time.time() - t_opt
+                    sub_profs.append(sub_prof)
+                    if change_tracker.changed:
+                        process_count.setdefault(gopt, 0)
+                        process_count[gopt] += 1
+                        global_process_count[gopt] += 1
                         changed = True
-                        node_created[lopt] += change_tracker.nb_imported - nb
-                        changed |= apply_cleanup(iter_cleanup_sub_profs)
-                        if global_process_count[lopt] > max_use:
+                        node_created[gopt] += change_tracker.nb_imported - nb
+                        if global_process_count[gopt] > max_use:
                             max_use_abort = True
-                            opt_name = (getattr(lopt, "name", None) or
-                                        getattr(lopt, "__name__", ""))
+                            opt_name = (getattr(gopt, "name", None) or
+                                        getattr(gopt, "__name__", ""))
+                global_sub_profs.append(sub_profs)
+
+                global_opt_timing.append(float(time.time() - t0))
+
+                # apply clean up as global opt can have done changes that
+                # request that
+                changed |= apply_cleanup(iter_cleanup_sub_profs)
+
+                # apply local optimizer
+                topo_t0 = time.time()
+                if self.worklist and loop_timing:
+                    # Only the nodes changed since the last local pass, in the
+                    # same order as a full pass.
+                    dirty = set(pending)
+                    if dirty:
+                        q = deque(node for node in
+                                  graph.io_toposort(fgraph.inputs, start_from)
+                                  if node in dirty)
+                    else:
+                        q = deque()
+                    max_nb_nodes = max(max_nb_nodes, len(fgraph.apply_nodes))
+                else:
+                    q = deque(graph.io_toposort(fgraph.inputs, start_from))
+                    max_nb_nodes = max(max_nb_nodes, len(q))
+                del pending[:]
+                # In worklist mode, the nodes in q, to not queue them twice.
+                queued = set(q) if self.worklist else None
+                io_toposort_timing.append(time.time() - topo_t0)
+
+                nb_nodes.append(len(q))
+                max_use = max_nb_nodes * self.max_use_ratio
+
+                def importer(node):
+                    if node is not current_node:
+                        q.append(node)
+
+                def flush_pending():
+                    for node in pending:
+                        if node not in queued:
+                            queued.add(node)
+                            q.append(node)
+                    del pending[:]
+
+                chin = None
+                if self.tracks_on_change_inputs:
+                    def chin(node, i, r, new_r, reason):
+                        if (node is not current_node and
+                                not isinstance(node, str)):
+                            q.append(node)
+                u = None
+                if not self.worklist:
+                    # Else worklist_u already follows the changes.
+                    u = self.attach_updater(fgraph, importer, None,
+                                            chin=chin,
+                                            name=getattr(self, 'name', None))
+                try:
+                    while q:
+                        node = q.pop()
+                        if queued is not None:
+                            queued.discard(node)
                         if node not in fgraph.apply_nodes:
-                            # go to next node
+                            continue
+                        current_node = node
+                        for lopt in self.dispatch.candidates(node.op):
+                            nb = change_tracker.nb_imported
+                            t_opt = time.time()
+                            lopt_change = self.process_node(fgraph, node, lopt)
+                            time_opts[lopt] += time.time() - t_opt
+                            if record_calls:
+                                self.dispatch.record(lopt, node.op,
+                                                     lopt_change)
+                            if pending:
+                                flush_pending()
+                            if not lopt_change:
+                                continue
+                            process_count.setdefault(lopt, 0)
+                            process_count[lopt] += 1
+                            global_process_count[lopt] += 1
+                            changed = True
+                            node_created[lopt] += (
+                                change_tracker.nb_imported - nb)
+                            changed |= apply_cleanup(iter_cleanup_sub_profs)
+                            if global_process_count[lopt] > max_use:
+                                max_use_abort = True
+                                opt_name = (getattr(lopt, "name", None) or
+                                            getattr(lopt, "__name__", ""))
+                            if pending:
+                                flush_pending()
+                            if node not in fgraph.apply_nodes:
+                                # go to next node
+                                break
+                        if self.worklist and max_use_abort:
+                            # The worklist could otherwise never get empty.
                             break
-            finally:
-                self.detach_updater(fgraph, u)
-
-            # Apply final optimizers
-            sub_profs = []
-            t_before_final_opt = time.time()
-            for gopt in self.final_optimizers:
-                change_tracker.reset()
-                nb = change_tracker.nb_imported
-                t_opt = time.time()
-                sub_prof = gopt.apply(fgraph)
-                time_opts[gopt] += time.time() - t_opt
-                sub_profs.append(sub_prof)
-                if change_tracker.changed:
-                    process_count.setdefault(gopt, 0)
-                    process_count[gopt] += 1
-                    global_process_count[gopt] += 1
-                    changed = True
-                    node_created[gopt] += change_tracker.nb_imported - nb
-                    if global_process_count[gopt] > max_use:
-                        max_use_abort = True
-                        opt_name = (getattr(gopt, "name", None) or
-                                    getattr(gopt, "__name__", ""))
-            final_sub_profs.append(sub_profs)
-
-            global_opt_timing[-1] += time.time() - t_before_final_opt
-            # apply clean up as final opt can have done changes that
-            # request that
-            changed |= apply_cleanup(iter_cleanup_sub_profs)
-            # merge clean up profiles during that iteration.
-            c_sub_profs = []
-            for copt, sub_profs in iteritems(iter_cleanup_sub_profs):
-                sub_prof = sub_profs[0]
-                for s_p in sub_profs[1:]:
-                    sub_prof = copt.merge_profile(sub_prof, s_p)
-                c_sub_profs.append(sub_prof)
-            cleanup_sub_profs.append(c_sub_profs)
-
-            loop_process_count.append(process_count)
-            loop_timing.append(float(time.time() - t0))
+                finally:
+                    current_node = None
+                    self.detach_updater(fgraph, u)
+
+                # Apply final optimizers
+                sub_profs = []
+                t_before_final_opt = time.time()
+                for gopt in self.final_optimizers:
+                    change_tracker.reset()
+                    nb = change_tracker.nb_imported
+                    t_opt = time.time()
+                    sub_prof = gopt.apply(fgraph)
+                    time_opts[gopt] += time.time() - t_opt
+                    sub_profs.append(sub_prof)
+                    if change_tracker.changed:
+                        process_count.setdefault(gopt, 0)
+                        process_count[gopt] += 1
+                        global_process_count[gopt] += 1
+                        changed = True
+                        node_created[gopt] += change_tracker.nb_imported - nb
+                        if global_process_count[gopt] > max_use:
+                            max_use_abort = True
+                            opt_name = (getattr(gopt, "name", None) or
+                                        getattr(gopt, "__name__", ""))
+                final_sub_profs.append(sub_profs)
+
+                global_opt_timing[-1] += time.time() - t_before_final_opt
+                # apply clean up as final opt can have done changes that
+                # request that
+                changed |= apply_cleanup(iter_cleanup_sub_profs)
+                # merge clean up profiles during that iteration.
+                c_sub_profs = []
+                for copt, sub_profs in iteritems(iter_cleanup_sub_profs):
+                    sub_prof = sub_profs[0]
+                    for s_p in sub_profs[1:]:
+                        sub_prof = copt.merge_profile(sub_prof, s_p)
+                    c_sub_profs.append(sub_prof)
+                cleanup_sub_profs.append(c_sub_profs)
+
+                loop_process_count.append(process_count)
+                loop_timing.append(float(time.time() - t0))
+        finally:
+            if worklist_u is not None:
+                fgraph.remove_feature(worklist_u)
 
         end_nb_nodes = len(fgraph.apply_nodes)
 
@@ -2681,6 +2915,7 @@ class EquilibriumOptimizer(NavigatorOptimizer):
                     # Skip opt that have 0 times, they probably wasn't even tried.
                     print(blanc + "  ", '  %.3fs - %s' % (t, o), file=stream)
             print(file=stream)
+        opt.dispatch.print_wasted_calls(stream, level=level)
         gf_opts = [o for o in (opt.global_optimizers +
                                list(opt.final_optimizers) +
                                list(opt.cleanup_optimizers))
@@ -250,6 +250,9 @@ class EquilibriumDB(DB):
         result in less fgraph iterations, but this doesn't mean it
         will be faster globally.
 
+    The ``optdb.worklist`` flag makes the local optimizers only visit the
+    nodes changed since their last pass, which overrides both parameters.
+
     Notes
     -----
     We can put LocalOptimizer and Optimizer as EquilibriumOptimizer
@@ -294,7 +297,8 @@ class EquilibriumDB(DB):
             tracks_on_change_inputs=self.tracks_on_change_inputs,
             failure_callback=opt.NavigatorOptimizer.warn_inplace,
             final_optimizers=final_opts,
-            cleanup_optimizers=cleanup_opts)
+            cleanup_optimizers=cleanup_opts,
+            worklist=config.optdb.worklist)
 
 
 class SequenceDB(DB):
@@ -6,11 +6,12 @@ import numpy as np
 
 import theano
 from theano.gof.link import PerformLinker
-from theano.gof.cc import CLinker, DualLinker, OpWiseCLinker
+from theano.gof.cc import (CLinker, DualLinker, OpWiseCLinker,
+                           SegmentCLinker, get_module_cache, precompile_nodes)
 from theano.gof.type import Type
 from theano.gof.graph import Variable, Apply, Constant
 from theano.gof.op import Op
-from theano.gof import fg
+from theano.gof import cmodule, fg
 
 
 def as_variable(x):
@@ -301,6 +302,78 @@ def test_opwiseclinker_constant():
     assert res == 15.3
 
 
+class PyMul(Binary):
+    # No C code.
+    def impl(self, x, y):
+        return x * y
+py_mul = PyMul()
+
+
+def test_segmentclinker():
+    if not theano.config.cxx:
+        raise SkipTest("G++ not available, so we need to skip this test.")
+    x, y, z = inputs()
+    e = add(py_mul(add(x, y), div(x, y)), bad_sub(bad_sub(x, y), z))
+    fgraph = Env([x, y, z], [e])
+    lnk = SegmentCLinker().accept(fgraph)
+    fn, i, o, thunks, order = lnk.make_all()
+    # The C nodes before and after py_mul are run by one thunk each.
+    assert len(thunks) == 3
+    assert [node.op for node in order].count(py_mul) == 1
+    fn = lnk.make_function()
+    assert fn(2.0, 2.0, 2.0) == 2.0
+    assert fn(3.0, 1.0, 1.0) == 13.0
+
+
+class ScaledAdd(MyOp):
+    # The scale is inlined in the C code, so every new instance needs
+    # its own module.
+    __props__ = ("nin", "name", "scale")
+
+    def __init__(self, scale):
+        MyOp.__init__(self, 2, self.__class__.__name__)
+        self.scale = scale
+
+    def c_code(self, node, name, inp, out, sub):
+        x, y = inp
+        z, = out
+        scale = repr(self.scale)
+        return "%(z)s = %(x)s + %(scale)s * %(y)s;" % locals()
+
+    def impl(self, x, y):
+        return x + self.scale * y
+
+
+def test_precompile_nodes():
+    if not theano.config.cxx:
+        raise SkipTest("G++ not available, so we need to skip this test.")
+    x, y, z = inputs()
+    ops = [ScaledAdd(s) for s in np.random.rand(4)]
+    e = ops[0](ops[1](x, y), ops[2](ops[3](y, z), x))
+    fgraph = Env([x, y, z], [e])
+    cache = get_module_cache()
+    n_compiled = cache.stats[2]
+    module_times = []
+    cmodule.module_time_listeners.append(module_times)
+    try:
+        precompile_nodes(fgraph.toposort(), n_jobs=2)
+        assert cache.stats[2] == n_compiled + 4
+
+        # The linker now finds all its modules in the cache.
+        lnk = OpWiseCLinker().accept(fgraph)
+        fn = lnk.make_function()
+        assert cache.stats[2] == n_compiled + 4
+    finally:
+        cmodule.module_time_listeners.remove(module_times)
+    # Each module is recorded once, with its compilation time.
+    assert len(module_times) == 4
+    assert all(compile_time > 0
+               for _, _, _, compile_time, _ in module_times)
+    expected = ops[0].impl(ops[1].impl(2.0, 3.0),
+                           ops[2].impl(ops[3].impl(3.0, 4.0), 2.0))
+    assert np.allclose(fn(2.0, 3.0, 4.0), expected)
+
+
 class MyExc(Exception):
     pass
 
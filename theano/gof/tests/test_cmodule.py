@@ -6,10 +6,19 @@ deterministic based on the input type and the op.
 """
 from __future__ import absolute_import, print_function, division
 
+import os
+import shutil
+import tempfile
+import time
+
 import numpy as np
+from nose.plugins.skip import SkipTest
 
 import theano
-from theano.gof.cmodule import GCC_compiler
+from theano.gof.cc import CLinker
+from theano.gof import cmodule
+from theano.gof.cmodule import GCC_compiler, ModuleCache, ModuleIndex
+from theano.gof.fg import FunctionGraph
 
 
 class MyOp(theano.compile.ops.DeepCopyOp):
@@ -67,3 +76,191 @@ def test_flag_detection():
     # but was not detected because that path is not usually taken,
     # so we test it here directly.
     GCC_compiler.try_flags(["-lblas"])
+
+
+def test_module_index():
+    if not theano.config.cxx:
+        raise SkipTest("G++ not available, so we need to skip this test.")
+    dirname = tempfile.mkdtemp()
+    try:
+        x = theano.tensor.dvector()
+        lnk = CLinker().accept(FunctionGraph([x], [x * 2]))
+        key = lnk.cmodule_key()
+        cache = ModuleCache(dirname)
+        cache.module_from_key(key, lnk)
+
+        # Another cache finds the module without walking the directory.
+        other = ModuleCache(dirname, do_refresh=False)
+        assert key not in other.entry_from_key
+        assert other._load_from_index(key=key)
+        assert key in other.entry_from_key
+
+        # A corrupt index is rebuilt when the cache is refreshed.
+        with open(other.index.path, 'a') as f:
+            f.write('corrupt\n')
+        assert not ModuleIndex(dirname).load()
+        ModuleCache(dirname)
+        index = ModuleIndex(dirname)
+        assert index.load()
+        assert index.find(key=key) == [os.path.dirname(
+            cache.entry_from_key[key])]
+    finally:
+        shutil.rmtree(dirname)
+
+
+def test_module_index_rebuilt():
+    dirname = tempfile.mkdtemp()
+    try:
+        index = ModuleIndex(dirname)
+        index._write(['a\t\ttmpa\n'])
+        assert index.load()
+        assert index.find(module_hash='a') == [os.path.join(dirname, 'tmpa')]
+        # Another process rebuilds the index, which is not shorter than the
+        # part already read.
+        ModuleIndex(dirname)._write(['b\t\ttmpb\n', 'c\t\ttmpc\n'])
+        assert index.load()
+        assert index.find(module_hash='a') == []
+        assert index.find(module_hash='c') == [os.path.join(dirname, 'tmpc')]
+    finally:
+        shutil.rmtree(dirname)
+
+
+def test_per_module_lock():
+    if not theano.config.cxx:
+        raise SkipTest("G++ not available, so we need to skip this test.")
+    dirname = tempfile.mkdtemp()
+    try:
+        x = theano.tensor.dvector()
+        lnk = CLinker().accept(FunctionGraph([x], [x * 3]))
+        key = lnk.cmodule_key()
+        with theano.change_flags({'cmodule.per_module_lock': True}):
+            cache = ModuleCache(dirname)
+            module = cache.module_from_key(key, lnk)
+        location = os.path.dirname(module.__file__)
+        assert os.path.dirname(location) == dirname
+        assert os.path.exists(os.path.join(location, 'key.pkl'))
+        # The module was moved out of the staging directory and its lock
+        # was released.
+        assert os.listdir(os.path.join(dirname, 'staging')) == []
+        assert os.listdir(os.path.join(dirname, 'module_locks')) == []
+
+        # The lock and staging directories are not cache entries.
+        other = ModuleCache(dirname)
+        assert other.entry_from_key[key] == module.__file__
+        assert os.path.isdir(os.path.join(dirname, 'staging'))
+    finally:
+        shutil.rmtree(dirname)
+
+
+def test_clear_lru():
+    if not theano.config.cxx:
+        raise SkipTest("G++ not available, so we need to skip this test.")
+    dirname = tempfile.mkdtemp()
+    try:
+        x = theano.tensor.dvector()
+        cache = ModuleCache(dirname)
+        entries = []
+        for out in [x * 2, x + 2, theano.tensor.exp(x), abs(x)]:
+            lnk = CLinker().accept(FunctionGraph([x], [out]))
+            entries.append(
+                cache.module_from_key(lnk.cmodule_key(), lnk).__file__)
+        # Pretend the modules were last used a few days ago, the first one
+        # being the least recently used.
+        for i, entry in enumerate(entries):
+            atime = time.time() - 60 * 60 * 24 * (len(entries) - i)
+            os.utime(entry, (atime, os.stat(entry).st_mtime))
+
+        other = ModuleCache(dirname)
+        other._get_module(entries[0])
+        size = sum(os.path.getsize(os.path.join(os.path.dirname(e), f))
+                   for e in entries[::3]
+                   for f in os.listdir(os.path.dirname(e)))
+        # The module in use is kept, then the oldest ones are deleted.
+        assert other.clear_lru(max_entries=3) == 1
+        assert other.clear_lru(max_size=size) == 1
+        assert ([os.path.exists(e) for e in entries] ==
+                [True, False, False, True])
+        assert len(other.module_hash_to_key_data) == 2
+    finally:
+        shutil.rmtree(dirname)
+
+
+def test_lazy_refresh():
+    if not theano.config.cxx:
+        raise SkipTest("G++ not available, so we need to skip this test.")
+    dirname = tempfile.mkdtemp()
+    try:
+        x = theano.tensor.dvector()
+        lnk = CLinker().accept(FunctionGraph([x], [x * 5]))
+        key = lnk.cmodule_key()
+        ModuleCache(dirname).module_from_key(key, lnk)
+        other_lnk = CLinker().accept(FunctionGraph([x], [x + 5]))
+        ModuleCache(dirname).module_from_key(other_lnk.cmodule_key(),
+                                             other_lnk)
+
+        # Nothing is read until a module is requested.
+        cache = ModuleCache(dirname, lazy=True)
+        assert not cache.module_hash_to_key_data
+        cache.module_from_key(key, lnk)
+        assert len(cache.module_hash_to_key_data) == 1
+        assert cache.stats == [0, 1, 0]
+    finally:
+        shutil.rmtree(dirname)
+
+
+def test_refresh_snapshot():
+    if not theano.config.cxx:
+        raise SkipTest("G++ not available, so we need to skip this test.")
+    dirname = tempfile.mkdtemp()
+    try:
+        x = theano.tensor.dvector()
+        cache = ModuleCache(dirname)
+        for out in [x * 6, x - 6]:
+            lnk = CLinker().accept(FunctionGraph([x], [out]))
+            cache.module_from_key(lnk.cmodule_key(), lnk)
+        # The first refresh walks the directory and saves a snapshot.
+        first = ModuleCache(dirname)
+        snapshot = first._load_snapshot()
+        assert snapshot['index_stat'] == first._index_stat()
+        assert len(snapshot['entries']) == 2
+
+        # The next one uses it, without listing the module directories.
+        orig_listdir = os.listdir
+        listed = []
+
+        def listdir(path):
+            listed.append(path)
+            return orig_listdir(path)
+        os.listdir = listdir
+        try:
+            second = ModuleCache(dirname)
+        finally:
+            os.listdir = orig_listdir
+        assert dirname not in listed
+        assert (set(second.entry_from_key) ==
+                set(first.entry_from_key) == set(cache.entry_from_key))
+    finally:
+        shutil.rmtree(dirname)
+
+
+def test_precompiled_header():
+    if not theano.config.cxx:
+        raise SkipTest("G++ not available, so we need to skip this test.")
+    dirname = tempfile.mkdtemp()
+    try:
+        x = theano.tensor.dvector()
+        src_code = CLinker().accept(
+            FunctionGraph([x], [x * 7])).get_src_code()
+        flags = ['-I' + d for d in cmodule.std_include_dirs()]
+        header = cmodule.get_precompiled_header(src_code, flags, dirname)
+        assert os.path.exists(header + '.gch')
+        with open(header) as f:
+            assert f.read().startswith('#include <Python.h>\n')
+        assert cmodule.get_precompiled_header(src_code, flags,
+                                              dirname) == header
+        # Other flags need another precompiled header.
+        other = cmodule.get_precompiled_header(src_code, flags + ['-O1'],
+                                               dirname)
+        assert os.path.dirname(other) != os.path.dirname(header)
+    finally:
+        shutil.rmtree(dirname)
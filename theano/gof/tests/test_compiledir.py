@@ -1,5 +1,15 @@
 from __future__ import absolute_import, print_function, division
+import os
+import shutil
+import tempfile
+
+import six.moves.cPickle as pickle
+from nose.plugins.skip import SkipTest
+
+import theano
 from theano.configdefaults import short_platform
+from theano.gof.cmodule import ModuleCache
+from theano.gof.compiledir import export_modules, import_modules
 
 
 def test_short_platform():
@@ -19,3 +29,42 @@ def test_short_platform():
     ]:
         o = short_platform(r, p)
         assert o == a, (o, a)
+
+
+def test_export_import_modules():
+    if not theano.config.cxx:
+        raise SkipTest("G++ not available, so we need to skip this test.")
+    tmpdir = tempfile.mkdtemp()
+    try:
+        x = theano.tensor.dvector()
+        f = theano.function([x], theano.tensor.exp(x) * 2 + 1,
+                            mode=theano.Mode(linker='c'))
+        filename = os.path.join(tmpdir, 'f.pkl')
+        with open(filename, 'wb') as fp:
+            pickle.dump(f, fp, -1)
+        archive = os.path.join(tmpdir, 'modules.tar.gz')
+        n = export_modules(filename, archive)
+        assert n > 0
+
+        dirname = os.path.join(tmpdir, 'compiledir')
+        os.mkdir(dirname)
+        cache = ModuleCache(dirname)
+        assert import_modules(archive, cache=cache) == n
+        assert len(cache.module_hash_to_key_data) == n
+        # Modules already in the cache are not imported twice.
+        assert import_modules(archive, cache=cache) == 0
+        # The KeyData point to the new location of the modules.
+        other = ModuleCache(dirname)
+        assert len(other.module_hash_to_key_data) == n
+        for key_data in other.module_hash_to_key_data.values():
+            assert key_data.get_entry().startswith(dirname)
+        # A lazy cache finds them in the index.
+        if other.index is not None:
+            subdirs = sorted(os.listdir(dirname))
+            lazy = ModuleCache(dirname, lazy=True)
+            assert len(lazy.module_hash_to_key_data) == 0
+            assert import_modules(archive, cache=lazy) == 0
+            assert len(lazy.module_hash_to_key_data) == n
+            assert sorted(os.listdir(dirname)) == subdirs
+    finally:
+        shutil.rmtree(tmpdir)
@@ -492,3 +492,43 @@ def test_multiple_inplace():
     OpSubOptimizer(multiple_in_place_1, multiple_in_place_0_1, fail).optimize(g)
     consistent(g)
     assert fail.failures == 1
+
+
+def test_incremental_toposort():
+    t = destroyhandler._IncrementalToposort()
+    a, b, c, d = [object() for i in range(4)]
+    for app in (a, b, c, d):
+        t.add_node(app)
+    pos = t.position
+    t.add_edge(c, a)
+    t.add_edge(d, c)
+    assert pos[d] < pos[c] < pos[a]
+    t.add_edge(a, d)
+    assert t.cycle_edges == {(a, d): 1}
+    assert not t.set_orderings(set())
+    t.remove_edge(a, d)
+    assert t.set_orderings(set())
+
+    assert t.set_orderings(set([(b, d)]))
+    assert pos[b] < pos[d] < pos[c] < pos[a]
+    # An ordering that creates a cycle is not kept.
+    assert not t.set_orderings(set([(b, d), (a, b)]))
+    assert t.orderings == set([(b, d)])
+    assert t.set_orderings(set([(c, b)]))
+    assert pos[d] < pos[c] < pos[b]
+    t.remove_node(b)
+    assert not t.orderings
+
+
+@assertFailure_fast
+def test_cycle_without_destroyers():
+    x, y, z = inputs()
+    e = add(x, y)
+    f = sigmoid(e)
+    g = Env([x, y, z], [f, add(z, z)])
+    consistent(g)
+    g.replace(z, f)
+    consistent(g)
+    # The inputs of e would depend on e.
+    g.replace(y, f)
+    inconsistent(g)
@@ -1,16 +1,20 @@
 from __future__ import absolute_import, print_function, division
 import os
+import shutil
 import numpy as np
 import theano
 import theano.tensor as T
+from theano.compile.function_module import graph_cache_key, std_fgraph
+from theano.compile.io import In, SymbolicOutput
+from theano.compile.mode import OPT_FAST_RUN
 
 floatX = 'float32'
 
 
 def test_graph_opt_caching():
-    opt_db_file = os.path.join(theano.config.compiledir, 'optimized_graphs.pkl')
-    if os.path.exists(opt_db_file):
-        os.remove(opt_db_file)
+    opt_db_dir = os.path.join(theano.config.compiledir, 'optimized_graphs')
+    if os.path.exists(opt_db_dir):
+        shutil.rmtree(opt_db_dir)
 
     mode = theano.config.mode
     if mode in ["DEBUG_MODE", "DebugMode"]:
@@ -24,19 +28,55 @@ def test_graph_opt_caching():
         d = theano.shared(np.ones((10, 10), dtype=floatX))
         e = T.sum(T.sum(T.sum(a ** 2 + b) + c) + d)
         f1 = theano.function([a, b], e, mode=mode)
+        assert len(os.listdir(opt_db_dir)) == 1
 
         m = T.fmatrix('x1')
         n = T.fmatrix('x2')
         p = theano.shared(np.ones((10, 10), dtype=floatX))
-        q = theano.shared(np.ones((10, 10), dtype=floatX))
+        q = theano.shared(2 * np.ones((10, 10), dtype=floatX))
         j = T.sum(T.sum(T.sum(m ** 2 + n) + p) + q)
         f2 = theano.function([m, n], j, mode=mode)
+        # The second graph was loaded from the cache.
+        assert len(os.listdir(opt_db_dir)) == 1
+        assert f2.maker.fgraph.inputs[2] is not f1.maker.fgraph.inputs[2]
 
         in1 = np.ones((10, 10), dtype=floatX)
         in2 = np.ones((10, 10), dtype=floatX)
-        assert f1(in1, in2) == f2(in1, in2)
+        assert f1(in1, in2) == 2010100
+        assert f2(in1, in2) == 2010200
+        q.set_value(np.zeros((10, 10), dtype=floatX))
+        assert f2(in1, in2) == 2010000
+        assert f1(in1, in2) == 2010100
+
+        # A different graph or optimizer is optimized again.
+        theano.function([m, n], j + 1, mode=mode)
+        assert len(os.listdir(opt_db_dir)) == 2
+        theano.function([m, n], j,
+                        mode=theano.compile.get_mode(mode).excluding('fusion'))
+        assert len(os.listdir(opt_db_dir)) == 3
     finally:
         theano.config.cache_optimizations = default
 
-if __name__ == '__main__':
-    test_graph_opt_caching()
+
+def test_graph_cache_key():
+    def key(inputs, outputs, optimizer=OPT_FAST_RUN):
+        specs = [In(i) for i in inputs]
+        fgraph, _ = std_fgraph(specs, [SymbolicOutput(o) for o in outputs])
+        return graph_cache_key(fgraph, specs, optimizer)
+
+    x, y = T.fmatrices('x', 'y')
+    k = key([x, y], [x * 2 + y])
+    assert k is not None
+    assert k == key([x, y], [x * 2 + y])
+    assert k == key([y, x], [y * 2 + x])
+    a, b = T.fmatrices('a', 'b')
+    assert k == key([a, b], [a * 2 + b])
+    assert k != key([x, y], [y * 2 + x])
+    assert k != key([x, y], [x * 3 + y])
+    assert k != key([x, y], [x * 2 + y], OPT_FAST_RUN.excluding('fusion'))
+    a, b = T.dmatrices('a', 'b')
+    assert k != key([a, b], [a * 2 + b])
+
+    # Inner graphs are not described.
+    op = theano.compile.builders.OpFromGraph([x], [x * 2])
+    assert key([x, y], [op(x) + y]) is None
@@ -6,10 +6,12 @@ from theano.gof.op import Op
 from theano.gof.opt import (OpKeyOptimizer, PatternSub, TopoOptimizer, OpSub,
                             MergeOptimizer, config, theano,
                             EquilibriumOptimizer, logging, pre_constant_merge,
-                            pre_greedy_local_optimizer)
+                            pre_greedy_local_optimizer, local_optimizer,
+                            LocalOptGroup, local_opt_dispatch, Updater)
 from theano.gof.fg import FunctionGraph
 
 from theano import tensor as T
+from six import iteritems
 
 
 def as_variable(x):
@@ -595,6 +597,80 @@ class TestEquilibrium(object):
         # print 'after', g
         assert str(g) == '[Op1(x, y)]'
 
+    def test_worklist(self):
+        x, y, z = map(MyVariable, 'xyz')
+        e = op3(op4(x, y))
+        g = FunctionGraph([x, y, z], [e] + [op5(x, z) for i in range(10)])
+        opt = EquilibriumOptimizer(
+            [PatternSub((op1, 'x', 'y'), (op2, 'x', 'y')),
+             PatternSub((op4, 'x', 'y'), (op1, 'x', 'y')),
+             PatternSub((op3, (op2, 'x', 'y')), (op4, 'x', 'y'))
+             ],
+            max_use_ratio=10, worklist=True)
+        prof = opt.optimize(g)
+        assert str(g).startswith('[Op2(x, y), Op5(x, z)')
+        # The clients of the replaced nodes were visited again during
+        # the first iteration, the second one has nothing left to visit.
+        nb_nodes = prof[5]
+        assert nb_nodes == [12, 0], nb_nodes
+
+    def test_worklist_error(self):
+        # The worklist must not stay attached when an optimizer fails.
+        @local_optimizer([op1])
+        def fail(node):
+            raise ValueError()
+
+        x, y = map(MyVariable, 'xy')
+        g = FunctionGraph([x, y], [op1(x, y)])
+        opt = EquilibriumOptimizer([fail], max_use_ratio=10, worklist=True)
+        try:
+            opt.optimize(g)
+            assert False
+        except ValueError:
+            pass
+        assert not any(isinstance(f, Updater) for f in g._features)
+
+
+def test_local_opt_dispatch():
+    def opt(tracks):
+        return local_optimizer(tracks)(lambda node: False)
+
+    by_type = opt([MyOp])
+    by_op = opt([op1])
+    untracked = opt(None)
+    elemwise = opt([T.Elemwise])
+    by_scalar_type = opt([theano.scalar.Add])
+    by_scalar_op = opt([theano.scalar.add])
+    both = opt([T.Elemwise, theano.scalar.Add])
+    opts = [by_type, by_op, untracked, elemwise, by_scalar_type,
+            by_scalar_op, both]
+
+    dispatch = local_opt_dispatch(opts)
+    assert dispatch is local_opt_dispatch(tuple(opts))
+    assert dispatch is LocalOptGroup(*opts).dispatch
+    assert dispatch is not local_opt_dispatch(opts, untracked_first=True)
+    assert dispatch.candidates(op1) == (by_type, by_op, untracked)
+    assert dispatch.candidates(op2) == (by_type, untracked)
+    assert dispatch.candidates(T.add) == (elemwise, both, by_scalar_type,
+                                          by_scalar_op, untracked)
+    assert dispatch.candidates(T.mul) == (elemwise, both, untracked)
+    assert local_opt_dispatch(opts, untracked_first=True).candidates(
+        op1) == (untracked, by_type, by_op)
+
+    # The calls that did not change anything are counted when profiling.
+    x, y, z = map(MyVariable, 'xyz')
+    g = FunctionGraph([x, y, z], [op1(op2(x, y), z), op1(x, y)])
+    group = LocalOptGroup(PatternSub((op1, (op2, 'x', 'y'), 'z'),
+                                     (op3, 'x', 'y', 'z')),
+                          PatternSub((op4, 'x'), (op5, 'x')),
+                          profile=True)
+    TopoOptimizer(group).optimize(g)
+    assert str(g) == '[Op3(x, y, z), Op1(x, y)]'
+    # The nodes of op2 were skipped, as no optimizer tracks it.
+    calls = dict(((o.op_key(), op_type), count) for (o, op_type, _), count
+                 in iteritems(group.dispatch.calls))
+    assert calls == {(op1, MyOp): [2, 1]}, calls
+
 
 def test_pre_constant_merge_slice():
     ms = theano.tensor.type_other.MakeSlice()(1)
@@ -453,3 +453,197 @@ def test_no_recycling():
         m1 = f.fn.thunks[0].thunk.module
         m2 = f2.fn.thunks[0].thunk.module
         assert m1 is m2
+
+
+# The (start, end) times of the calls to Sleep.perform.
+sleep_intervals = []
+
+
+class Sleep(theano.Op):
+
+    __props__ = ()
+
+    def make_node(self, x):
+        return theano.Apply(self, [x], [x.type()])
+
+    def perform(self, node, inputs, outputs):
+        start = time.time()
+        time.sleep(0.2)
+        outputs[0][0] = inputs[0] + 1
+        sleep_intervals.append((start, time.time()))
+
+
+def test_parallel_loop():
+    x = tensor.vector()
+    branches = [Sleep()(x * i) for i in range(4)]
+    for allow_gc in [True, False]:
+        lnk = vm.VM_Linker(allow_gc=allow_gc, use_cloop=False,
+                           n_threads=4)
+        f = function([x], sum(branches), mode=Mode(linker=lnk))
+        assert isinstance(f.fn, vm.ParallelLoop)
+        del sleep_intervals[:]
+        assert np.allclose(f([1, 2]), [10, 16])
+        # Some branches run at the same time.
+        assert len(sleep_intervals) == 4
+        assert any(s1 < e2 and s2 < e1
+                   for i, (s1, e1) in enumerate(sleep_intervals)
+                   for s2, e2 in sleep_intervals[i + 1:])
+        intermediates = [v for v in f.fn.storage_map
+                         if v.owner and v not in f.maker.fgraph.outputs]
+        assert any(f.fn.storage_map[v][0] is None
+                   for v in intermediates) == allow_gc
+
+    # Errors are raised with the node that failed.
+    f = function([x], Sleep()(x[5]) + branches[0],
+                 mode=Mode(linker=vm.VM_Linker(use_cloop=False,
+                                               n_threads=2)))
+    try:
+        f([1, 2])
+        assert False
+    except IndexError as e:
+        assert 'Apply node that caused the error' in str(e)
+
+
+def test_parallel_loop_inplace():
+    # The nodes reading a variable must run before the one destroying it.
+    x = tensor.vector()
+    y = x * 2
+    outs = [tensor.exp(y), Sleep()(y), tensor.inc_subtensor(y[0], 5)]
+    ref = function([x], outs)(np.arange(3.))
+    lnk = vm.VM_Linker(use_cloop=False, n_threads=3)
+    f = function([x], outs, mode=Mode(linker=lnk, optimizer='fast_run'))
+    assert any(getattr(node.op, 'destroy_map', None)
+               for node in f.maker.fgraph.apply_nodes)
+    for i in range(5):
+        for r, o in zip(ref, f(np.arange(3.))):
+            assert np.allclose(r, o)
+
+
+def test_parallel_loop_partial():
+    x = tensor.vector()
+    lnk = vm.VM_Linker(use_cloop=False, n_threads=2)
+    f = function([x], [Sleep()(x), Sleep()(x * 2), RunOnce()(x)],
+                 mode=Mode(linker=lnk))
+    assert np.allclose(f([1, 2], output_subset=[1])[0], [3, 5])
+    assert np.allclose(f([1, 2], output_subset=[0, 2])[0], [2, 3])
+
+
+def test_memory_planner():
+    x = tensor.matrix()
+    a = tensor.exp(x)
+    b = tensor.tanh(a * 2)
+    c = tensor.dot(b, a) + a
+    outs = [tensor.sqrt(abs(c) + 1).sum(), (b * 3).T]
+
+    def ref(v):
+        a = np.exp(v)
+        b = np.tanh(a * 2)
+        c = np.dot(b, a) + a
+        return [np.sqrt(abs(c) + 1).sum(), (b * 3).T]
+
+    for allow_gc in [True, False]:
+        lnk = vm.VM_Linker(allow_gc=allow_gc, memory_planner=True)
+        f = function([x], outs, mode=Mode(linker=lnk, optimizer='fast_run'))
+        assert isinstance(f.fn, vm.PlannedLoop)
+        for shape in [(4, 4), (4, 4), (4, 4), (6, 6), (6, 6), (6, 6)]:
+            v = np.random.rand(*shape).astype(x.dtype)
+            for r, o in zip(ref(v), f(v)):
+                assert np.allclose(r, o)
+        # One plan per shape.
+        assert f.fn.n_plans == 2, f.fn.n_plans
+        # Results that are not alive at the same time share memory.
+        assert 0 < f.fn.peak_memory <= f.fn.arena_size
+        intermediates = [var for var in f.maker.fgraph.variables
+                         if var.owner and var not in f.maker.fgraph.outputs]
+        assert f.fn.arena_size < sum(
+            f.fn.storage_map[var][0].nbytes if f.fn.storage_map[var][0]
+            is not None else 6 * 6 * 8 for var in intermediates
+            if var.ndim == 2)
+        # The outputs are never in the arena.
+        out = f(v)[1]
+        assert not np.may_share_memory(out, f.fn.arena)
+
+    # The peak memory is reported to the profile.
+    profile = theano.compile.ProfileStats(atexit_print=False)
+    f = function([x], outs, profile=profile,
+                 mode=Mode(linker=vm.VM_Linker(memory_planner=True),
+                           optimizer='fast_run'))
+    f(v)
+    f(v)
+    assert profile.vm_peak_memory > 0
+    assert profile.vm_arena_size >= profile.vm_peak_memory
+
+
+class CountRuns(theano.Op):
+
+    __props__ = ()
+
+    def __init__(self):
+        self.nb_run = 0
+
+    def make_node(self, x):
+        return theano.Apply(self, [x], [x.type()])
+
+    def perform(self, node, inputs, outputs):
+        self.nb_run += 1
+        outputs[0][0] = inputs[0] * 2
+
+
+def test_incremental():
+    x = tensor.vector()
+    y = tensor.vector()
+    s = theano.shared(np.ones(3, dtype=x.dtype))
+    op_x, op_y, op_s = CountRuns(), CountRuns(), CountRuns()
+    a = op_x(x)
+    b = op_y(y)
+    c = op_s(s)
+    mode = Mode(linker=vm.VM_Linker(incremental=True), optimizer='fast_run')
+
+    def check(outs, vx, vy, vs):
+        assert np.allclose(outs[0], 2 * vx + 2 * vy)
+        assert np.allclose(outs[1], 2 * vy + 2 * vs)
+
+    def runs():
+        return (op_x.nb_run, op_y.nb_run, op_s.nb_run)
+
+    # The intermediate results overwritten inplace are recomputed.
+    for m, inplace in [(mode.excluding('inplace'), False), (mode, True)]:
+        op_x.nb_run = op_y.nb_run = op_s.nb_run = 0
+        s.set_value(np.ones(3, dtype=x.dtype))
+        f = function([x, y], [a + b, b + c], mode=m)
+        assert isinstance(f.fn, vm.Stack)
+        vx = np.arange(3).astype(x.dtype)
+        vy = np.ones(3, dtype=x.dtype)
+        check(f(vx, vy), vx, vy, s.get_value())
+        assert runs() == (1, 1, 1)
+        # Nothing changed: nothing is recomputed, but new outputs are
+        # returned.
+        o1 = f(vx, vy)
+        o2 = f(vx.copy(), vy)
+        check(o2, vx, vy, s.get_value())
+        assert runs() == (1, 1, 1)
+        assert o1[0] is not o2[0]
+        o2[0][:] = 0
+        check(f(vx, vy), vx, vy, s.get_value())
+        # Only what depends on the changed input is recomputed.
+        vx = vx + 1
+        check(f(vx, vy), vx, vy, s.get_value())
+        if not inplace:
+            assert runs() == (2, 1, 1)
+        s.set_value(np.zeros(3, dtype=x.dtype))
+        check(f(vx, vy), vx, vy, s.get_value())
+        if not inplace:
+            assert runs() == (2, 1, 2)
+        vy = vy + 1
+        check(f(vx, vy), vx, vy, s.get_value())
+        if not inplace:
+            assert runs() == (2, 2, 2)
+
+    # With updates, the updated shared variable changes at each call.
+    f = function([x], a + c, updates=[(s, s + 1)],
+                 mode=mode.excluding('inplace'))
+    op_x.nb_run = op_s.nb_run = 0
+    for i in range(3):
+        vs = s.get_value()
+        assert np.allclose(f(vx), 2 * vx + 2 * vs)
+    assert (op_x.nb_run, op_s.nb_run) == (1, 3)
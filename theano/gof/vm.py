@@ -9,18 +9,23 @@ from __future__ import absolute_import, print_function, division
 
 from . import link
 from collections import defaultdict
+import copy
 import logging
 import sys
+import threading
 import time
 import warnings
 import platform
 
+import numpy as np
+
 from theano.configparser import (config, _config_var_list)
 
+import theano.gof.cc
 import theano.gof.cmodule
 
 from six import iteritems, itervalues
-from six.moves import xrange
+from six.moves import queue, xrange
 
 logger = logging.getLogger(__name__)
 
@@ -151,6 +156,9 @@ class VM(object):
         True indicates that Function.__call__ must implement the feedback from
         output storage to input storage. False means it *must not* repeat that
         feedback.
+    tracer
+        If not None, a `theano.compile.profiling.Tracer` recording the runs
+        of the thunks, if the VM supports it (Stack, ParallelLoop and CVM).
 
     """
 
@@ -164,6 +172,7 @@ class VM(object):
         self.call_counts = [0] * len(nodes)
         self.call_times = [0] * len(nodes)
         self.time_thunks = False
+        self.tracer = None
 
         # This variable (self.need_update_inputs) is overshadowed by
         # CLazyLinker in CVM which has an attribute of the same name that
@@ -305,6 +314,251 @@ class LoopGC(VM):
                 link.raise_with_op(node, thunk)
 
 
+class PlannedLoop(VM):
+    """
+    Unconditional start-to-finish program execution in Python, storing
+    the intermediate results in a preallocated arena.
+
+    The lifetime of each intermediate result goes from the node computing
+    it to the last node using it, or one of its views or inplace
+    versions. The first call records the shape of the results. Each
+    ndarray result is then given an offset in one buffer, so that results
+    whose lifetimes do not overlap share the same memory. Before a node
+    runs, the storage of its outputs is filled with views of that buffer,
+    which the C code of the ops reuses instead of allocating new memory.
+    When a result does not come out in its view (e.g. its shape changed),
+    the next call is run without the buffer and a new plan is made.
+
+    An output_subset can be given, but all the outputs are computed.
+
+    Parameters
+    ----------
+    nodes
+        A list of nodes in toposort order.
+    thunks
+        A list of thunks to execute those nodes, in toposort order.
+        They must not be lazy.
+    pre_call_clear
+        A list of containers to empty at the beginning of each call.
+    storage_map
+        Map from the variables to their containers.
+    fgraph
+        The FunctionGraph of `nodes`.
+    post_thunk_clear
+        None, or the containers to empty after each thunk, as in LoopGC.
+
+    Attributes
+    ----------
+    arena_size
+        The size in bytes of the buffer used by the current plan.
+    peak_memory
+        The peak of the memory used by the planned intermediate results
+        alive at the same time, in bytes.
+    n_plans
+        The number of plans made so far.
+
+    """
+
+    # Offsets in the arena are multiples of this.
+    alignment = 64
+
+    def __init__(self, nodes, thunks, pre_call_clear, storage_map, fgraph,
+                 post_thunk_clear=None):
+        super(PlannedLoop, self).__init__(nodes, thunks, pre_call_clear)
+        self.allow_gc = post_thunk_clear is not None
+        if post_thunk_clear is None:
+            post_thunk_clear = [[] for node in nodes]
+        if len(post_thunk_clear) != len(nodes):
+            raise ValueError()
+        self.post_thunk_clear = post_thunk_clear
+        self.storage_map = storage_map
+        self.arena = None
+        self.arena_size = 0
+        self.peak_memory = 0
+        self.n_plans = 0
+
+        # Group each variable with the variables it views or destroys.
+        node_idx = dict((node, i) for i, node in enumerate(nodes))
+        root = {}
+        aliases = defaultdict(list)
+        excluded = set()
+        for node in nodes:
+            alias_map = dict(getattr(node.op, 'view_map', {}))
+            alias_map.update(getattr(node.op, 'destroy_map', {}))
+            for o, out in enumerate(node.outputs):
+                r = out
+                if o in alias_map:
+                    r = set(root.get(node.inputs[i], node.inputs[i])
+                            for i in alias_map[o])
+                    if len(r) > 1:
+                        excluded.update(r)
+                        excluded.add(out)
+                        continue
+                    r = r.pop()
+                root[out] = r
+                aliases[r].append(out)
+
+        pre_call_clear_ids = set(id(c) for c in pre_call_clear)
+        outputs = set(fgraph.outputs)
+        end = {}
+        for i, node in enumerate(nodes):
+            for v in node.inputs:
+                if v in root:
+                    end[root[v]] = i
+        # The candidates for the arena, with the node computing them, the
+        # node after which they are dead and all their aliases.
+        self.candidates = []
+        for r, alias in iteritems(aliases):
+            if (r.owner not in node_idx or r in excluded or
+                    id(storage_map[r]) in pre_call_clear_ids or
+                    any(a in outputs or a in excluded for a in alias)):
+                continue
+            start = node_idx[r.owner]
+            self.candidates.append((r, start, max(end.get(r, start), start),
+                                    [storage_map[a] for a in alias]))
+        self.unplannable = set()
+        self._reset_plan()
+
+    def _reset_plan(self):
+        self.prealloc = None
+        self.stale = False
+        self.planned_clear = [[] for node in self.nodes]
+
+    def _make_plan(self, shapes):
+        """
+        Give an offset in the arena to each candidate recorded in `shapes`
+        (a dict variable -> (shape, dtype)) and build the views of the
+        arena to put in their storage.
+
+        """
+        align = self.alignment
+        blocks = []
+        for r, start, stop, cells in self.candidates:
+            if r not in shapes or r in self.unplannable:
+                continue
+            shape, dtype = shapes[r]
+            nbytes = int(np.prod(shape, dtype='int64')) * dtype.itemsize
+            if nbytes:
+                blocks.append((nbytes, start, stop, r, shape, dtype, cells))
+        # First fit, largest blocks first.
+        blocks.sort(key=lambda b: (-b[0], b[1]))
+        placed = []
+        for b in blocks:
+            nbytes, start, stop = b[:3]
+            offset = 0
+            for o, size in sorted((o, p[0]) for o, p in placed
+                                  if p[1] <= stop and start <= p[2]):
+                if o + size <= offset:
+                    continue
+                if offset + nbytes <= o:
+                    break
+                offset = (o + size + align - 1) // align * align
+            placed.append((offset, b))
+        size = max([o + b[0] for o, b in placed] or [0])
+
+        live = [0] * (len(self.nodes) + 1)
+        for o, b in placed:
+            live[b[1]] += b[0]
+            live[b[2] + 1] -= b[0]
+        peak = 0
+        running = 0
+        for n in live:
+            running += n
+            peak = max(peak, running)
+
+        if self.arena is None or self.arena.size < size:
+            self.arena = np.empty(size, dtype='uint8')
+        self.arena_size = size
+        self.peak_memory = max(self.peak_memory, peak)
+        self.prealloc = [[] for node in self.nodes]
+        self.planned_clear = [[] for node in self.nodes]
+        for offset, (nbytes, start, stop, r, shape, dtype, cells) in placed:
+            view = self.arena[offset:offset + nbytes].view(dtype)
+            self.prealloc[start].append(
+                (self.storage_map[r], view.reshape(shape), r))
+            self.planned_clear[stop].extend(cells)
+        self.n_plans += 1
+
+    def _miss(self, val, view, r):
+        """
+        Called when the planned result `r` was not computed in `view`.
+        A new plan is made at the next call. If `val` has the planned shape,
+        the op does not reuse its output storage and `r` is left out of the
+        next plans.
+
+        """
+        if (getattr(val, 'shape', None) == view.shape and
+                getattr(val, 'dtype', None) == view.dtype):
+            self.unplannable.add(r)
+        self.stale = True
+
+    def update_profile(self, profile):
+        super(PlannedLoop, self).update_profile(profile)
+        profile.vm_arena_size = max(profile.vm_arena_size, self.arena_size)
+        profile.vm_peak_memory = max(profile.vm_peak_memory,
+                                     self.peak_memory)
+
+    def __call__(self, output_subset=None):
+        # All the outputs are computed, even with an output_subset.
+        for cont in self.pre_call_clear:
+            cont[0] = None
+        if self.prealloc is None:
+            # Record the shapes of the candidates to make a plan.
+            shapes = {}
+            record = [[] for node in self.nodes]
+            for r, start, stop, cells in self.candidates:
+                record[start].append((self.storage_map[r], r))
+            try:
+                i = 0
+                for thunk, node, old_storage in zip(self.thunks,
+                                                    self.nodes,
+                                                    self.post_thunk_clear):
+                    if self.time_thunks:
+                        t0 = time.time()
+                        thunk()
+                        self.call_times[i] += time.time() - t0
+                        self.call_counts[i] += 1
+                    else:
+                        thunk()
+                    for cell, r in record[i]:
+                        if type(cell[0]) is np.ndarray:
+                            shapes[r] = (cell[0].shape, cell[0].dtype)
+                    for old_s in old_storage:
+                        old_s[0] = None
+                    i += 1
+            except Exception:
+                link.raise_with_op(node, thunk)
+            self._make_plan(shapes)
+            return
+
+        try:
+            i = 0
+            for thunk, node, prealloc, old_storage, planned in zip(
+                    self.thunks, self.nodes, self.prealloc,
+                    self.post_thunk_clear, self.planned_clear):
+                for cell, view, r in prealloc:
+                    cell[0] = view
+                if self.time_thunks:
+                    t0 = time.time()
+                    thunk()
+                    self.call_times[i] += time.time() - t0
+                    self.call_counts[i] += 1
+                else:
+                    thunk()
+                for cell, view, r in prealloc:
+                    if cell[0] is not view:
+                        self._miss(cell[0], view, r)
+                for old_s in old_storage:
+                    old_s[0] = None
+                for old_s in planned:
+                    old_s[0] = None
+                i += 1
+        except Exception:
+            link.raise_with_op(node, thunk)
+        if self.stale:
+            self._reset_plan()
+
+
 class Stack(VM):
     """
     Finish-to-start evalution order of thunks.
@@ -329,12 +583,22 @@ class Stack(VM):
     The actual logic is more complex to support intermediate
     garbage collection, lazily-evaluated nodes, and better speed.
 
+    With `incremental`, the results of a call are kept for the next one:
+    a variable is up to date at the start of a call if it was computed by
+    the previous call and none of the inputs it depends on changed. An
+    input changed if its value is not the same object as in the previous
+    call and is not equal to it (according to its type's `values_eq`), so
+    the values modified inplace by the user are not detected. The inputs
+    destroyed by the graph are always considered changed, and the
+    intermediate results overwritten by an inplace operation are never
+    kept. The outputs given to the user are kept as a copy.
+
     """
 
     def __init__(self, nodes, thunks, pre_call_clear,
                  storage_map, compute_map, fgraph, allow_gc,
                  n_updates, dependencies=None, callback=None,
-                 callback_input=None):
+                 callback_input=None, incremental=False):
         super(Stack, self).__init__(nodes, thunks, pre_call_clear)
 
         self.allow_gc = allow_gc
@@ -380,6 +644,105 @@ class Stack(VM):
         if self.allow_gc and self.dependencies is None:
             raise ValueError("Must set dependencies when using GC")
 
+        self.incremental = incremental
+        if incremental:
+            self._init_incremental(fgraph)
+
+    def _init_incremental(self, fgraph):
+        self.inputs = fgraph.inputs
+        # Variable -> the set of the indices of the inputs it depends on.
+        self.input_deps = input_deps = {}
+        for i, v in enumerate(fgraph.inputs):
+            input_deps[v] = frozenset([i])
+        # Variable -> the variables whose memory it may share.
+        roots = {}
+        destroyed = []
+        for k, node in enumerate(self.nodes):
+            deps = frozenset().union(*[input_deps.get(v, ())
+                                       for v in node.inputs])
+            alias_map = dict(getattr(node.op, 'view_map', {}))
+            alias_map.update(getattr(node.op, 'destroy_map', {}))
+            for o, out in enumerate(node.outputs):
+                input_deps[out] = deps
+                if o in alias_map:
+                    roots[out] = set().union(*[
+                        roots.get(node.inputs[i], [node.inputs[i]])
+                        for i in alias_map[o]])
+            for idx in itervalues(getattr(node.op, 'destroy_map', {})):
+                destroyed.extend((k, node.inputs[i]) for i in idx)
+
+        # The values computed before an inplace operation overwrites their
+        # memory can't be kept.
+        position = dict((node, k) for k, node in enumerate(self.nodes))
+        self.uncached = set()
+        destroyed_roots = set()
+        for k, d in destroyed:
+            d_roots = set(roots.get(d, [d]))
+            destroyed_roots.update(d_roots)
+            self.uncached.update(
+                v for v in input_deps
+                if v.owner and position[v.owner] < k and
+                not d_roots.isdisjoint(roots.get(v, [v])))
+        self.always_changed = frozenset(
+            i for i, v in enumerate(fgraph.inputs) if v in destroyed_roots)
+        pre_call_clear = set(id(c) for c in self.pre_call_clear)
+        self.copied_outputs = [
+            o for o in fgraph.outputs
+            if o.owner and id(self.storage_map[o]) in pre_call_clear]
+        self.last_inputs = None
+        self.valid = set()
+        self.output_cache = {}
+
+    def _start_incremental(self):
+        """
+        Set the compute_map of the variables that are up to date, and
+        put back the copy of the outputs kept.
+
+        """
+        storage_map = self.storage_map
+        values = [storage_map[v][0] for v in self.inputs]
+        changed = set(self.always_changed)
+        if self.last_inputs is None:
+            changed.update(range(len(values)))
+        else:
+            for i, (v, old, new) in enumerate(zip(self.inputs,
+                                                  self.last_inputs, values)):
+                if old is new:
+                    continue
+                try:
+                    if (old is None or new is None or
+                            not v.type.values_eq(old, new)):
+                        changed.add(i)
+                except Exception:
+                    changed.add(i)
+        self.last_inputs = values
+        # If they are recomputed, their old memory must not be reused.
+        for v in self.uncached:
+            storage_map[v][0] = None
+        valid = self.valid
+        self.valid = set()
+        self.restored = set()
+        for v in valid:
+            if not self.input_deps[v].isdisjoint(changed):
+                continue
+            if v in self.output_cache:
+                storage_map[v][0] = copy.deepcopy(self.output_cache[v])
+                self.restored.add(v)
+            elif storage_map[v][0] is None:
+                continue
+            self.compute_map[v][0] = 1
+
+    def _end_incremental(self):
+        compute_map = self.compute_map
+        self.valid = set(v for v in self.input_deps
+                         if v.owner and compute_map[v][0] == 1 and
+                         v not in self.uncached)
+        for o in self.copied_outputs:
+            if o not in self.valid:
+                self.output_cache.pop(o, None)
+            elif o not in self.restored:
+                self.output_cache[o] = copy.deepcopy(self.storage_map[o][0])
+
     def run_thunk_of_node(self, node):
         """
         Run the thunk corresponding to Apply instance `node`.
@@ -391,6 +754,8 @@ class Stack(VM):
         t0 = time.time()
         rval = self.thunks[idx]()
         self.node_executed_order.append(node)
+        if self.tracer is not None:
+            self.tracer.node(node, self.thunks[idx], t0, time.time())
 
         # Some thunks on some computers run faster than the granularity
         # of the time.time clock.
@@ -421,6 +786,8 @@ class Stack(VM):
             compute_map[k][0] = (k.owner is None)
             if self.callback_input and compute_map[k][0]:
                 self.callback_input(k, self.storage_map[k][0])
+        if self.incremental:
+            self._start_incremental()
 
         # apply_stack contains nodes
         if output_subset is not None:
@@ -489,10 +856,11 @@ class Stack(VM):
                     try:
                         _, dt = self.run_thunk_of_node(current_apply)
                         del _
-                        if config.profile or config.print_global_stats:
-                            current_idx = self.node_idx[current_apply]
+                        current_idx = self.node_idx[current_apply]
+                        if self.time_thunks:
                             self.call_counts[current_idx] += 1
                             self.call_times[current_idx] += dt
+                        if config.profile or config.print_global_stats:
                             # Computing the memory footprint of the the op
                             # ?? What about inplace .. if the op is inplace
                             # you don't actually ask for more memory!
@@ -536,6 +904,8 @@ class Stack(VM):
                                     i not in self.outputs):
                                 if all(compute_map[v][0]
                                         for v in dependencies[i]):
+                                    if self.tracer is not None:
+                                        self.tracer.free(i, time.time())
                                     storage_map[i][0] = None
                                     input_index.append(
                                         current_apply.inputs.index(i))
@@ -567,7 +937,7 @@ class Stack(VM):
                                         )
                     self.node_cleared_order.append(input_index)
 
-                elif not computed_ins:
+                elif not computed_ins and not computed_outs:
                     # -- Non-lazy case, need inputs
                     apply_stack.append(current_apply)
                     apply_stack.extend(inp.owner
@@ -586,9 +956,10 @@ class Stack(VM):
 
                 try:
                     requires, dt = self.run_thunk_of_node(current_apply)
-                    current_idx = self.node_idx[current_apply]
-                    self.call_counts[current_idx] += 1
-                    self.call_times[current_idx] += dt
+                    if self.time_thunks:
+                        current_idx = self.node_idx[current_apply]
+                        self.call_counts[current_idx] += 1
+                        self.call_times[current_idx] += dt
 
                 except Exception:
                     link.raise_with_op(
@@ -639,6 +1010,8 @@ class Stack(VM):
                                         empty_storage_map = False
                                         break
                                 if empty_storage_map:
+                                    if self.tracer is not None:
+                                        self.tracer.free(i, time.time())
                                     storage_map[i][0] = None
                                     input_index.append(
                                         current_apply.inputs.index(i))
@@ -659,11 +1032,244 @@ class Stack(VM):
                     if compute_map[v][0] == 2:
                         continue
                     else:
+                        if (self.tracer is not None and
+                                storage_map[v][0] is not None):
+                            self.tracer.free(v, time.time())
                         storage_map[v][0] = None
                         final_index.append(v)
                         compute_map[v][0] = 2
 
         self.node_cleared_order.append(final_index)
+        if self.incremental:
+            self._end_incremental()
+
+
+def _parallel_worker(tasks):
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        thunk, lock, idx, done = task
+        t0 = time.time()
+        try:
+            if lock is None:
+                thunk()
+            else:
+                with lock:
+                    thunk()
+        except Exception:
+            done.put((idx, sys.exc_info(), t0, t0, None))
+        else:
+            done.put((idx, None, t0, time.time(),
+                      threading.current_thread().ident))
+
+
+class ParallelLoop(VM):
+    """
+    Unconditional program execution in Python, running the thunks of
+    independent nodes at the same time in a pool of threads.
+
+    A node is started once all the nodes computing its inputs, and all
+    the nodes that must run before it according to ``fgraph.orderings()``
+    (e.g. the ones reading a variable it destroys), are done. Garbage
+    collection is possible on intermediate results: a variable is freed
+    once all the nodes using it are done.
+
+    As the thunks hold the GIL, this only helps when they spend time in
+    code that releases it (e.g. NumPy and BLAS computations).
+
+    Python thunks of nodes that share the same Op instance are never run
+    at the same time, as some Ops keep state in the instance (e.g. the
+    inner function of OpFromGraph).
+
+    Parameters
+    ----------
+    nodes
+        A list of nodes in toposort order.
+    thunks
+        A list of thunks to execute those nodes, in toposort order.
+        They must not be lazy.
+    pre_call_clear
+        A list of containers to empty at the beginning of each call.
+    storage_map
+        Map from the variables to their containers.
+    fgraph
+        The FunctionGraph of `nodes`.
+    allow_gc
+        If True, free the intermediate results during the computation.
+    n_threads
+        The number of threads running the thunks.
+    n_updates
+        The number of outputs of `fgraph` that are updates of the inputs,
+        they are always computed when an output_subset is given.
+
+    """
+
+    def __init__(self, nodes, thunks, pre_call_clear, storage_map, fgraph,
+                 allow_gc, n_threads, n_updates=0):
+        super(ParallelLoop, self).__init__(nodes, thunks, pre_call_clear)
+        self.allow_gc = allow_gc
+        self.n_threads = n_threads
+        self.n_updates = n_updates
+        self.node_idx = node_idx = dict((node, i)
+                                        for i, node in enumerate(nodes))
+        self.outputs = fgraph.outputs
+        ords = fgraph.orderings()
+        self.parents = []
+        self.children = [[] for node in nodes]
+        for i, node in enumerate(nodes):
+            parents = set(node_idx[v.owner] for v in node.inputs
+                          if v.owner in node_idx)
+            parents.update(node_idx[p] for p in ords.get(node, []))
+            for p in parents:
+                self.children[p].append(i)
+            self.parents.append(sorted(parents))
+
+        py_nodes = defaultdict(list)
+        for i, (node, thunk) in enumerate(zip(nodes, thunks)):
+            if not hasattr(thunk, 'cthunk'):
+                py_nodes[id(node.op)].append(i)
+        self.locks = [None] * len(nodes)
+        for idxs in itervalues(py_nodes):
+            if len(idxs) > 1:
+                lock = threading.Lock()
+                for i in idxs:
+                    self.locks[i] = lock
+
+        # For the gc, the number of nodes using each intermediate result.
+        self.gc_storage = []
+        self.gc_vars = []
+        self.n_users = []
+        self.node_gc = [[] for node in nodes]
+        if allow_gc:
+            gc_idx = {}
+            outputs = set(fgraph.outputs)
+            for i, node in enumerate(nodes):
+                for v in set(node.inputs):
+                    if v.owner not in node_idx or v in outputs:
+                        continue
+                    if v not in gc_idx:
+                        gc_idx[v] = len(self.gc_storage)
+                        self.gc_storage.append(storage_map[v])
+                        self.gc_vars.append(v)
+                        self.n_users.append(0)
+                    self.n_users[gc_idx[v]] += 1
+                    self.node_gc[i].append(gc_idx[v])
+        self.plans = {}
+        self.tasks = None
+
+    def _plan(self, output_subset):
+        """
+        Return the nodes to run for `output_subset`, the nodes that can
+        start first, the number of parents and the number of users of
+        each intermediate result among these nodes.
+
+        """
+        key = None if output_subset is None else tuple(output_subset)
+        if key in self.plans:
+            return self.plans[key]
+        if output_subset is None:
+            needed = [True] * len(self.nodes)
+        else:
+            first_updated = len(self.outputs) - self.n_updates
+            needed = [False] * len(self.nodes)
+            todo = [self.node_idx[self.outputs[i].owner]
+                    for i in (list(output_subset) +
+                              list(range(first_updated, len(self.outputs))))
+                    if self.outputs[i].owner in self.node_idx]
+            while todo:
+                i = todo.pop()
+                if not needed[i]:
+                    needed[i] = True
+                    todo.extend(self.parents[i])
+        n_parents = [len(p) for p in self.parents]
+        n_users = [0] * len(self.n_users)
+        for i, node_gc in enumerate(self.node_gc):
+            if needed[i]:
+                for v in node_gc:
+                    n_users[v] += 1
+        roots = [i for i, n in enumerate(n_parents) if needed[i] and not n]
+        plan = (needed, roots, n_parents, n_users)
+        self.plans[key] = plan
+        return plan
+
+    def _start_threads(self):
+        self.tasks = queue.Queue()
+        for i in xrange(self.n_threads):
+            t = threading.Thread(target=_parallel_worker, args=(self.tasks,))
+            t.daemon = True
+            t.start()
+
+    def __del__(self):
+        if self.tasks is not None:
+            for i in xrange(self.n_threads):
+                self.tasks.put(None)
+
+    def __call__(self, output_subset=None):
+        if self.tasks is None:
+            self._start_threads()
+        for cont in self.pre_call_clear:
+            cont[0] = None
+        thunks = self.thunks
+        children = self.children
+        node_gc = self.node_gc
+        gc_storage = self.gc_storage
+        needed, roots, n_parents, n_users = self._plan(output_subset)
+        n_parents = list(n_parents)
+        n_users = list(n_users)
+        ready = list(roots)
+        done = queue.Queue()
+        n_running = 0
+        error = None
+        while ready or n_running:
+            if ready and error is None:
+                if len(ready) == 1 and not n_running:
+                    # Nothing to run in parallel, avoid the thread switch.
+                    idx = ready.pop()
+                    t0 = time.time()
+                    try:
+                        thunks[idx]()
+                    except Exception:
+                        error = (idx, sys.exc_info())
+                        break
+                    result = (idx, None, t0, time.time(), None)
+                else:
+                    for idx in ready:
+                        self.tasks.put((thunks[idx], self.locks[idx], idx,
+                                        done))
+                    n_running += len(ready)
+                    ready = []
+                    continue
+            else:
+                result = done.get()
+                n_running -= 1
+            idx, exc_info, t0, t1, tid = result
+            if exc_info is not None:
+                # Wait for the running thunks before raising.
+                if error is None:
+                    error = (idx, exc_info)
+                continue
+            if error is not None:
+                continue
+            if self.time_thunks:
+                self.call_counts[idx] += 1
+                self.call_times[idx] += t1 - t0
+            if self.tracer is not None:
+                self.tracer.node(self.nodes[idx], thunks[idx], t0, t1, tid)
+            for c in children[idx]:
+                n_parents[c] -= 1
+                if not n_parents[c] and needed[c]:
+                    ready.append(c)
+            for v in node_gc[idx]:
+                n_users[v] -= 1
+                if not n_users[v]:
+                    if self.tracer is not None:
+                        self.tracer.free(self.gc_vars[v], time.time())
+                    gc_storage[v][0] = None
+        if error is not None:
+            idx, exc_info = error
+            link.raise_with_op(self.nodes[idx], thunks[idx],
+                               exc_info=exc_info)
 
 
 try:
@@ -674,10 +1280,16 @@ try:
     from . import lazylinker_c
 
     class CVM(lazylinker_c.CLazyLinker, VM):
-
-        def __init__(self, *args, **kwargs):
-            lazylinker_c.CLazyLinker.__init__(self, *args, **kwargs)
-            # skip VM.__init__
+        # Calling it with input_cells and inputs_seq runs the graph once
+        # for each list of input values in inputs_seq.
+        supports_inputs_seq = True
+
+        def __init__(self, nodes, thunks, pre_call_clear, *args, **kwargs):
+            lazylinker_c.CLazyLinker.__init__(self, nodes, thunks,
+                                              pre_call_clear, *args, **kwargs)
+            # skip VM.__init__, but keep the list the C code clears, as
+            # Function.__call__ changes it to write into the out buffers.
+            self.pre_call_clear = pre_call_clear
 except ImportError:
     pass
 except (OSError, theano.gof.cmodule.MissingGXX) as e:
@@ -724,12 +1336,31 @@ class VM_Linker(link.LocalLinker):
     allow_partial_eval
         If True, enforces usage of Stack or CVM, to allow for partial
         evaluation of functions (calculating a subset of outputs).
+    n_threads
+        If greater than 1, use the ParallelLoop VM with that many threads,
+        unless the graph has lazy nodes or one of the above options needs
+        the Stack VM. If None use the Theano flag vm.threads.
+    memory_planner
+        If True, use the PlannedLoop VM, unless the graph has lazy nodes or
+        one of the above options needs another VM. If None use the Theano
+        flag vm.memory_planner.
+    incremental
+        If True, use the Stack VM in incremental mode, keeping the results
+        of a call for the next ones. The intermediate results are then
+        never garbage collected. If None use the Theano flag
+        vm.incremental.
+    tracer
+        A `theano.compile.profiling.Tracer` recording when each node runs.
+        The Python VMs other than ParallelLoop are then replaced by the
+        Stack VM. If None, use the tracer saved to the file given by the
+        Theano flag profiling.trace, if it is set.
 
     """
 
     def __init__(self, allow_gc=None, use_cloop=False, callback=None,
                  callback_input=None, lazy=None, schedule=None,
-                 c_thunks=None, allow_partial_eval=None):
+                 c_thunks=None, allow_partial_eval=None, n_threads=None,
+                 memory_planner=None, incremental=None, tracer=None):
         # Note: if more parameters are added to __init__, make sure to forward
         # them in the "type(self)(...)" call in the "accept" method below.
         if allow_gc is None:
@@ -744,6 +1375,16 @@ class VM_Linker(link.LocalLinker):
             c_thunks = bool(theano.config.cxx)
         self.c_thunks = c_thunks
         self.allow_partial_eval = allow_partial_eval
+        if n_threads is None:
+            n_threads = config.vm.threads
+        self.n_threads = n_threads
+        if memory_planner is None:
+            memory_planner = config.vm.memory_planner
+        self.memory_planner = memory_planner
+        if incremental is None:
+            incremental = config.vm.incremental
+        self.incremental = incremental
+        self.tracer = tracer
         self.updated_vars = {}
         if schedule:
             self.schedule = schedule
@@ -806,7 +1447,11 @@ class VM_Linker(link.LocalLinker):
                 lazy=self.lazy,
                 schedule=self.schedule,
                 c_thunks=self.c_thunks,
-                allow_partial_eval=self.allow_partial_eval
+                allow_partial_eval=self.allow_partial_eval,
+                n_threads=self.n_threads,
+                memory_planner=self.memory_planner,
+                incremental=self.incremental,
+                tracer=self.tracer
             ).accept(fgraph, no_recycling, profile)
         self.fgraph = fgraph
         self.no_recycling = no_recycling
@@ -875,9 +1520,16 @@ class VM_Linker(link.LocalLinker):
 
         pre_call_clear = [storage_map[v] for v in self.no_recycling]
 
+        tracer = self.tracer
+        if tracer is None and config.profiling.trace:
+            tracer = theano.compile.profiling.global_tracer()
+
         if (self.callback is not None or self.callback_input is not None or
                 ((config.profile or config.print_global_stats) and config.profile_memory) or
-                (self.allow_partial_eval and not self.use_cloop)):
+                (self.allow_partial_eval and not self.use_cloop) or
+                self.incremental or
+                (tracer is not None and not self.use_cloop and
+                 self.n_threads == 1)):
 
             if self.use_cloop and (self.callback is not None or
                                    self.callback_input is not None):
@@ -894,11 +1546,22 @@ class VM_Linker(link.LocalLinker):
             vm = Stack(
                 nodes, thunks, pre_call_clear,
                 storage_map, compute_map,
-                self.fgraph, self.allow_gc,
+                self.fgraph, self.allow_gc and not self.incremental,
                 len(updated_vars),
                 dependencies=deps,
                 callback=self.callback,
-                callback_input=self.callback_input)
+                callback_input=self.callback_input,
+                incremental=self.incremental)
+        elif self.n_threads > 1 and not any(th.lazy for th in thunks):
+            vm = ParallelLoop(
+                nodes, thunks, pre_call_clear,
+                storage_map, self.fgraph, self.allow_gc,
+                self.n_threads, len(updated_vars))
+        elif (self.memory_planner and not self.allow_partial_eval and
+              tracer is None and not any(th.lazy for th in thunks)):
+            vm = PlannedLoop(
+                nodes, thunks, pre_call_clear,
+                storage_map, self.fgraph, post_thunk_clear)
         elif self.use_cloop:
             # create a map from nodes to ints and vars to ints
             nodes_idx = {}
@@ -1014,6 +1677,11 @@ class VM_Linker(link.LocalLinker):
 
             if platform.python_implementation() == 'CPython':
                 assert c0 == sys.getrefcount(node_n_inputs)
+
+            if tracer is not None:
+                vm.trace_thunk = lambda i, t0, t1: tracer.node(
+                    nodes[i], thunks[i], t0, t1)
+                vm.trace_free = lambda i, t: tracer.free(vars_idx_inv[i], t)
         else:
             lazy = self.lazy
             if lazy is None:
@@ -1045,6 +1713,7 @@ class VM_Linker(link.LocalLinker):
                     len(updated_vars),
                     dependencies=deps,
                 )
+        vm.tracer = tracer
         return vm
 
     def make_all(self, profiler=None, input_storage=None,
@@ -1078,6 +1747,8 @@ class VM_Linker(link.LocalLinker):
         impl = None
         if self.c_thunks is False:
             impl = 'py'
+        else:
+            theano.gof.cc.precompile_nodes(order)
         for node in order:
             try:
                 thunk_start = time.time()
@@ -1114,8 +1785,12 @@ class VM_Linker(link.LocalLinker):
             lazy = config.vm.lazy
         if lazy is None:
             lazy = not all([(not th.lazy) for th in thunks])
+        # The reallocation relies on the nodes being run in order.
         if not (lazy or ((config.profile or config.print_global_stats) and config.profile_memory) or
-                self.use_cloop or self.callback or self.callback_input):
+                self.use_cloop or self.callback or self.callback_input or
+                self.n_threads > 1 or self.memory_planner or
+                self.incremental or self.tracer is not None or
+                config.profiling.trace):
             for pair in itervalues(reallocated_info):
                 storage_map[pair[1]] = storage_map[pair[0]]
 
@@ -1161,3 +1836,11 @@ class VM_Linker(link.LocalLinker):
             self.allow_partial_eval = None
         if not hasattr(self, 'callback_input'):
             self.callback_input = None
+        if not hasattr(self, 'n_threads'):
+            self.n_threads = 1
+        if not hasattr(self, 'memory_planner'):
+            self.memory_planner = False
+        if not hasattr(self, 'incremental'):
+            self.incremental = False
+        if not hasattr(self, 'tracer'):
+            self.tracer = None
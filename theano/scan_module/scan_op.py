@@ -49,6 +49,7 @@ relies on the following elements to work properly :
 from __future__ import absolute_import, print_function, division
 
 import copy
+import functools
 import itertools
 import logging
 import time
@@ -705,46 +706,14 @@ class Scan(PureOp):
                      self._hash_inner_graph,
                      scan_utils.hash_listsDictsTuples(self.info)))
 
-    def make_thunk(self, node, storage_map, compute_map, no_recycling,
-                   impl=None):
+    def inner_function_builder(self):
         """
+        Return a callable without arguments that compiles the inner function.
 
-        Parameters
-        ----------
-        node
-            Something previously returned by self.make_node.
-        storage_map
-            dict variable -> one-element-list where a computed
-            value for this variable may be found.
-        compute_map
-            dict variable -> one-element-list where a boolean
-            value will be found. The boolean indicates whether the
-            variable's storage_map container contains a valid value (True)
-            or if it has not been computed yet (False).
-        no_recycling
-            List of variables for which it is forbidden to reuse memory
-            allocated by a previous call.
-        impl
-            Use 'py' if we want python execution.
-        Notes
-        -----
-        If the thunk consults the storage_map on every call, it is safe
-        for it to ignore the no_recycling argument, because elements of the
-        no_recycling list will have a value of None in the storage map. If
-        the thunk can potentially cache return values (like CLinker does),
-        then it must not do so for variables in the no_recycling list.
+        This also sets `mitmots_preallocated`, which make_thunk needs even
+        when the inner function is already compiled.
 
         """
-
-        # Before building the thunk, validate that the inner graph is
-        # coherent
-        self.validate_inner_graph()
-
-        # Setting up all my variables in what I believe is a more Cython
-        # friendly form
-
-        node_input_storage = [storage_map[r] for r in node.inputs]
-        node_output_storage = [storage_map[r] for r in node.outputs]
         # If a shared variable is the result of a ViewOp it is a clear
         # indication that we need to copy that value after the perform of
         # scan is done
@@ -855,15 +824,60 @@ class Scan(PureOp):
                 profile = ScanProfileStats(name=self.name)
         elif self.profile:
             profile = self.profile
+        return functools.partial(function,
+                                 wrapped_inputs,
+                                 wrapped_outputs,
+                                 mode=compilation_mode,
+                                 name=self.name,
+                                 profile=profile,
+                                 on_unused_input='ignore')
+
+    def make_thunk(self, node, storage_map, compute_map, no_recycling,
+                   impl=None):
+        """
+
+        Parameters
+        ----------
+        node
+            Something previously returned by self.make_node.
+        storage_map
+            dict variable -> one-element-list where a computed
+            value for this variable may be found.
+        compute_map
+            dict variable -> one-element-list where a boolean
+            value will be found. The boolean indicates whether the
+            variable's storage_map container contains a valid value (True)
+            or if it has not been computed yet (False).
+        no_recycling
+            List of variables for which it is forbidden to reuse memory
+            allocated by a previous call.
+        impl
+            Use 'py' if we want python execution.
+        Notes
+        -----
+        If the thunk consults the storage_map on every call, it is safe
+        for it to ignore the no_recycling argument, because elements of the
+        no_recycling list will have a value of None in the storage map. If
+        the thunk can potentially cache return values (like CLinker does),
+        then it must not do so for variables in the no_recycling list.
+
+        """
+
+        # Before building the thunk, validate that the inner graph is
+        # coherent
+        self.validate_inner_graph()
+
+        # Setting up all my variables in what I believe is a more Cython
+        # friendly form
+
+        node_input_storage = [storage_map[r] for r in node.inputs]
+        node_output_storage = [storage_map[r] for r in node.outputs]
+
+        compile_inner_function = self.inner_function_builder()
         # make_thunk can be called many times on the same op
         # we do not want to recompile the inner fct every time.
         if not getattr(self, 'fn', None):
-            self.fn = function(wrapped_inputs,
-                               wrapped_outputs,
-                               mode=compilation_mode,
-                               name=self.name,
-                               profile=profile,
-                               on_unused_input='ignore')
+            self.fn = compile_inner_function()
 
         # Analyse the compile inner function to determine which inputs and
         # outputs are on the gpu and speed up some checks during the execution
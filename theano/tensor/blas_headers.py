@@ -981,6 +981,16 @@ def blas_header_text():
                     }
                     """)
 
+    # The BLAS library does not use the Python C-API, so we release the
+    # GIL while it runs. The NumPy implementation needs it.
+    header += textwrap.dedent("""\
+            #ifndef THEANO_BLAS_BEGIN_CALL
+            #define THEANO_BLAS_BEGIN_CALL %s
+            #define THEANO_BLAS_END_CALL %s
+            #endif
+            """) % (('Py_BEGIN_ALLOW_THREADS', 'Py_END_ALLOW_THREADS')
+                    if config.blas.ldflags else ('', ''))
+
     return header + blas_code
 
 
@@ -1033,7 +1043,7 @@ def openblas_threads_text():
 
 def blas_header_version():
     # Version for the base header
-    version = (9,)
+    version = (10,)
     if detect_macos_sdot_bug():
         if detect_macos_sdot_bug.fix_works:
             # Version with fix
@@ -2212,7 +2212,7 @@ def local_alloc_unary(node):
 
 @register_canonicalize
 @register_specialize
-@gof.local_optimizer([T.Elemwise])
+@gof.local_optimizer([scalar.Cast])
 def local_cast_cast(node):
     """cast(cast(x, dtype1), dtype2)
 
@@ -3948,7 +3948,7 @@ def local_sumsqr2dot(node):
 @register_stabilize
 @register_specialize
 @register_canonicalize
-@gof.local_optimizer([T.Elemwise])
+@gof.local_optimizer([scalar.Sub])
 def local_expm1(node):
     """
     This optimization detects exp(a)-1 and converts this to expm1(a).
@@ -3976,7 +3976,7 @@ def local_expm1(node):
 @register_useless('local_remove_switch_const_cond')
 @register_canonicalize('fast_compile', 'local_remove_switch_const_cond')
 @register_specialize
-@gof.local_optimizer([T.Elemwise])
+@gof.local_optimizer([scalar.Switch])
 def local_useless_switch(node):
     """
     This optimization makes the following changes in the graph:
@@ -5149,7 +5149,7 @@ def local_sum_prod_mul_by_scalar(node):
 
 
 @register_specialize
-@gof.local_optimizer([T.Elemwise])
+@gof.local_optimizer([scalar.Sub])
 def local_elemwise_sub_zeros(node):
     """
     Elemwise{sub}(X,X) -> zeros_like(X)